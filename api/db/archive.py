@@ -0,0 +1,84 @@
+import asyncio
+import logging
+import os
+import sys
+import zlib
+from .database import Database
+from ..functions.cold_storage import cold_tier
+
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_AGE_DAYS = float(os.getenv("COLD_STORAGE_AGE_DAYS", 30))
+ARCHIVE_BATCH_SIZE = int(os.getenv("COLD_STORAGE_BATCH_SIZE", 20))
+ARCHIVE_INTERVAL = float(os.getenv("COLD_STORAGE_ARCHIVE_INTERVAL", 300))
+
+
+def archive_batch(age_days=ARCHIVE_AGE_DAYS, batch_size=ARCHIVE_BATCH_SIZE):
+    """Move one batch of old full-size generations to the cold tier, return how many moved"""
+    with Database() as db:
+        rows = db.get_archivable_generations(age_days, batch_size)
+        for user_id, image_id, image_bytes in rows:
+            # Cold copy is written first; a crash before commit only leaves an orphan file
+            cold_tier.archive(user_id, image_id, image_bytes)
+            # Exports lay the entry out from these instead of reading the cold copy back
+            db.mark_generation_archived(user_id, image_id, len(image_bytes), zlib.crc32(image_bytes), image_bytes[:16])
+    return len(rows)
+
+
+def backfill_batch(batch_size=ARCHIVE_BATCH_SIZE):
+    """Record size, CRC and first bytes for one batch of generations archived without them"""
+    with Database() as db:
+        rows = db.get_unrecorded_archived_generations(batch_size)
+        for user_id, image_id in rows:
+            image_bytes = cold_tier.fetch(user_id, image_id)
+            db.mark_generation_archived(user_id, image_id, len(image_bytes), zlib.crc32(image_bytes), image_bytes[:16])
+    return len(rows)
+
+
+async def run_archiver(interval=ARCHIVE_INTERVAL):
+    """Background loop started by the API; batches run in a worker thread"""
+    while True:
+        try:
+            moved = await asyncio.to_thread(archive_batch)
+        except Exception as e:
+            logger.error(f"archiver | {type(e).__name__}: {str(e)}", exc_info=True)
+            moved = 0
+
+        # Keep draining while full batches come back, otherwise wait for the next round
+        await asyncio.sleep(0 if moved == ARCHIVE_BATCH_SIZE else interval)
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    if not cold_tier:
+        logger.error("✗ COLD_STORAGE_DIR is not set")
+        return
+
+    if len(sys.argv) > 1 and sys.argv[1] == "--backfill-info":
+        total = 0
+        while True:
+            recorded = backfill_batch()
+            total += recorded
+            if recorded < ARCHIVE_BATCH_SIZE:
+                break
+        logger.info(f"✓ Recorded size and CRC for {total} archived generation(s)")
+        return
+
+    if len(sys.argv) > 1 and sys.argv[1] == "--loop":
+        logger.info(f"Archiving generations older than {ARCHIVE_AGE_DAYS} days every {ARCHIVE_INTERVAL}s...")
+        asyncio.run(run_archiver())
+        return
+
+    total = 0
+    while True:
+        moved = archive_batch()
+        total += moved
+        if moved < ARCHIVE_BATCH_SIZE:
+            break
+    logger.info(f"✓ Archived {total} generation(s) older than {ARCHIVE_AGE_DAYS} days")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,33 +1,455 @@
 import psycopg2
+import psycopg2.errors
+import psycopg2.extensions
+import asyncio
 import base64
 import calendar
+import functools
+import inspect
+import json
+import logging
+import os
+import random
+import threading
+import time
+import uuid
+from cachetools import TTLCache
+from datetime import datetime
 from psycopg2 import DatabaseError
+from psycopg2.pool import ThreadedConnectionPool
 from configparser import ConfigParser
+from ..functions.cold_storage import cold_tier
+from ..functions.metrics import metrics
+from ..functions.tracing import current_span, payload_bytes, traced, tracer
+from .query_log import current_method, query_log
+from ..functions.worker_limits import per_worker
 
+logger = logging.getLogger(__name__)
+
+
+# Hot queries run as named server-side prepared statements; off for poolers that don't keep sessions
+USE_PREPARED_STATEMENTS = os.getenv("DB_PREPARED_STATEMENTS", "true").lower() == "true"
+
+# Connections per worker never go below this, however many workers split DB_POOL_MAX_TOTAL
+POOL_MIN_PER_WORKER = int(os.getenv("DB_POOL_MIN_PER_WORKER", 4))
+# How long a caller on the event loop waits for a free connection. Waiting there stalls
+# every request in the worker, so by default it doesn't: threads still wait DB_POOL_TIMEOUT
+POOL_LOOP_TIMEOUT = float(os.getenv("DB_POOL_LOOP_TIMEOUT", 0))
+
+
+class PoolExhausted(Exception):
+    pass
+
+
+def on_event_loop():
+    try:
+        asyncio.get_running_loop()
+        return True
+    except RuntimeError:
+        return False
+
+
+class InstrumentedCursor(psycopg2.extensions.cursor):
+    """Times every statement for the query log and adds statement, row and byte counts to the current trace span"""
+
+    def execute(self, query, vars=None):
+        failed = True
+        start = time.perf_counter()
+        try:
+            result = super().execute(query, vars)
+            failed = False
+            return result
+        finally:
+            elapsed = time.perf_counter() - start
+            try:
+                query_log.record(self, query, vars, elapsed, failed)
+            except Exception as e:
+                logger.warning(f"query log | {type(e).__name__}: {str(e)}")
+            self._count_sent(vars)
+
+    def _count_sent(self, vars):
+        span = current_span.get()
+        if span is not None and span.recording:
+            span.add("db.statements", 1)
+            if self.rowcount > 0:
+                span.add("db.rows", self.rowcount)
+            if vars:
+                span.add("db.bytes_sent", payload_bytes(vars))
+
+    def fetchone(self):
+        return self._count_received(super().fetchone())
+
+    def fetchmany(self, size=None):
+        return self._count_received(super().fetchmany(size) if size is not None else super().fetchmany())
+
+    def fetchall(self):
+        return self._count_received(super().fetchall())
+
+    def _count_received(self, rows):
+        span = current_span.get()
+        if rows and span is not None and span.recording:
+            span.add("db.bytes_received", payload_bytes(rows))
+        return rows
+
+
+class PreparingConnection(psycopg2.extensions.connection):
+    """Remembers which statements are prepared in its session"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.cursor_factory = InstrumentedCursor
+        self.prepared = set()
+        self.deallocate_pending = False
+
+
+class ConnectionPool:
+    """ThreadedConnectionPool that waits for a free connection instead of raising when empty.
+
+    Callers on the event loop thread wait at most DB_POOL_LOOP_TIMEOUT, since a
+    blocked loop stops the whole worker; work in threads waits the full timeout.
+    """
+
+    def __init__(self, max_size, **connect_kwargs):
+        self._pool = ThreadedConnectionPool(1, max_size, connection_factory=PreparingConnection, **connect_kwargs)
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._lock = threading.Lock()
+        self.max_size = max_size
+        self.in_use = 0
+
+    def getconn(self, timeout):
+        if on_event_loop():
+            timeout = min(timeout, POOL_LOOP_TIMEOUT)
+        if not self._slots.acquire(timeout=timeout):
+            metrics.inc("db_pool_exhausted_total")
+            raise PoolExhausted("Timed out waiting for a database connection")
+        try:
+            conn = self._pool.getconn()
+        except Exception:
+            self._slots.release()
+            raise
+        with self._lock:
+            self.in_use += 1
+        return conn
+
+    def putconn(self, conn):
+        try:
+            # Broken connections are dropped instead of going back to the pool
+            self._pool.putconn(conn, close=bool(conn.closed))
+        finally:
+            with self._lock:
+                self.in_use -= 1
+            self._slots.release()
+
+    def closeall(self):
+        self._pool.closeall()
+
+
+class DedicatedConnection:
+    """Same interface as ConnectionPool, but hands out a connection of its own, closed on putconn.
+
+    For holders that keep a connection for minutes (gallery exports), which
+    would otherwise take slots the per-worker pool needs for short requests.
+    """
+
+    max_size = 1
+
+    def __init__(self, **connect_kwargs):
+        self._connect_kwargs = connect_kwargs
+        self.in_use = 0
+
+    def getconn(self, timeout):
+        conn = psycopg2.connect(
+            connection_factory=PreparingConnection,
+            **{"connect_timeout": max(int(timeout), 1), **self._connect_kwargs}
+        )
+        metrics.inc("db_dedicated_connections_total")
+        self.in_use = 1
+        return conn
+
+    def putconn(self, conn):
+        self.in_use = 0
+        conn.close()
+
+    def closeall(self):
+        pass
+
+
+class Replica:
+    def __init__(self, name, dsn):
+        self.name = name
+        self.dsn = dsn
+        self.pool = None
+        self.lag = 0.0
+        self.lag_checked_at = 0.0
+        self.down_until = 0.0
+
+
+def replica_read(method):
+    """Run a read-only method on a replica when one is usable for this user"""
+    @functools.wraps(method)
+    def wrapper(self, user_id, *args, **kwargs):
+        replica = self._pick_replica(user_id)
+        if replica is None:
+            return method(self, user_id, *args, **kwargs)
+
+        self._route = replica.pool
+        try:
+            return method(self, user_id, *args, **kwargs)
+        finally:
+            self._route = self._pool
+    return wrapper
 
-class Database:
-    _instance = None
 
-    def __new__(cls):
-        if cls._instance is None:
-            cls._instance = super(Database, cls).__new__(cls)
-            cls._instance.db_config = cls._config()
-        return cls._instance
+def primary_write(method):
+    """Pin the user's reads to the primary for a while once this write commits"""
+    @functools.wraps(method)
+    def wrapper(self, user_id, *args, **kwargs):
+        result = method(self, user_id, *args, **kwargs)
+        self._written_users.add(str(user_id))
+        return result
+    return wrapper
+
+
+def encode_page_cursor(created_at, image_id):
+    """Opaque keyset cursor: the (created_at, image_id) of the last preview on a page"""
+    return base64.urlsafe_b64encode(f"{created_at.isoformat()}|{image_id}".encode()).decode()
+
+
+def decode_page_cursor(cursor):
+    """(created_at, image_id) from encode_page_cursor; ValueError when it isn't one"""
+    try:
+        created_at, _, image_id = base64.urlsafe_b64decode(cursor.encode()).decode().partition("|")
+        return datetime.fromisoformat(created_at), str(uuid.UUID(image_id))
+    except (UnicodeError, ValueError, AttributeError) as e:
+        raise ValueError("Invalid page cursor") from e
+
+
+class Database:
+    _db_config = None
+    _pool = None
+    _replicas = []
+    _pool_lock = threading.Lock()
+
+    # Users who wrote recently, so they read their own writes. Per worker: a request
+    # served by another worker may still hit a replica, within the lag limit below
+    _recent_writers = TTLCache(maxsize=100000, ttl=float(os.getenv("REPLICA_STICKY_SECONDS", 5)))
+    _recent_writers_lock = threading.Lock()
+
+    def __new__(cls, dedicated=False):
+        # Config is parsed once; connection state stays per instance so threads don't share it.
+        # dedicated: use a primary connection outside the pool, and no replicas
+        instance = super(Database, cls).__new__(cls)
+        if Database._db_config is None:
+            Database._db_config = cls._config()
+        instance.db_config = Database._db_config
+        instance.dedicated = dedicated
+        return instance
+
+    @classmethod
+    def _get_pool(cls):
+        # Created lazily so every worker process opens its own connections
+        with cls._pool_lock:
+            if cls._pool is None:
+                # DB_POOL_MAX_TOTAL is the deployment-wide budget, split across workers down to
+                # DB_POOL_MIN_PER_WORKER; max_connections must allow workers x that floor
+                cls._pool = ConnectionPool(
+                    per_worker(os.getenv("DB_POOL_MAX_TOTAL", 20), POOL_MIN_PER_WORKER),
+                    **cls._db_config
+                )
+                dsns = [dsn.strip() for dsn in os.getenv("DB_REPLICA_DSNS", "").split(",") if dsn.strip()]
+                cls._replicas = [Replica(f"replica{i}", dsn) for i, dsn in enumerate(dsns)]
+            return cls._pool
+
+    @classmethod
+    def close_pool(cls):
+        with cls._pool_lock:
+            if cls._pool is not None:
+                cls._pool.closeall()
+                cls._pool = None
+            for replica in cls._replicas:
+                if replica.pool is not None:
+                    replica.pool.closeall()
+            cls._replicas = []
 
     def __enter__(self):
-        self.conn = psycopg2.connect(**self.db_config)
-        self.cursor = self.conn.cursor()
+        # Connections are taken on first use: a block of replica reads never holds a primary one
+        if self.dedicated:
+            self._pool = DedicatedConnection(**self.db_config)
+            self._replicas = []
+            self._route = self._pool
+        else:
+            self._route = self._get_pool()
+        self._connections = {}
+        self._acquire_errors = {}
+        self._written_users = set()
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        if hasattr(self, "cursor") and self.cursor:
-            self.cursor.close()
-        if hasattr(self, "conn") and self.conn:
-            if exc_type is None:
-                self.conn.commit()
+        try:
+            for pool, (conn, cursor) in self._connections.items():
+                cursor.close()
+                try:
+                    if exc_type is None:
+                        conn.commit()
+                    else:
+                        conn.rollback()
+                finally:
+                    pool.putconn(conn)
+        finally:
+            self._connections = {}
+
+        if exc_type is None and self._written_users:
+            with Database._recent_writers_lock:
+                for user_id in self._written_users:
+                    Database._recent_writers[user_id] = True
+
+    def _acquire(self, pool):
+        if pool not in self._connections:
+            # A block that already timed out doesn't wait again from its error handler
+            if pool in self._acquire_errors:
+                raise self._acquire_errors[pool]
+            try:
+                with tracer.span("db.acquire", primary=pool is self._pool):
+                    conn = pool.getconn(float(os.getenv("DB_POOL_TIMEOUT", 10)))
+            except Exception as e:
+                self._acquire_errors[pool] = e
+                raise
+            self._connections[pool] = (conn, conn.cursor())
+        return self._connections[pool]
+
+    @property
+    def conn(self):
+        return self._acquire(self._route)[0]
+
+    @property
+    def cursor(self):
+        return self._acquire(self._route)[1]
+
+    def _execute_prepared(self, name, query, params):
+        """Execute `query` as prepared statement `name`, preparing it once per pooled connection.
+
+        A statement invalidated by a schema change, or lost by the session (a
+        pooler handing out another backend), is prepared again and retried once.
+        """
+        if not USE_PREPARED_STATEMENTS:
+            return self.cursor.execute(query, params)
+
+        conn = self.conn
+        if conn.deallocate_pending:
+            self.cursor.execute("DEALLOCATE ALL")
+            conn.prepared.clear()
+            conn.deallocate_pending = False
+
+        if name not in conn.prepared:
+            self._prepare(conn, name, query, len(params))
+
+        # A failed statement aborts the transaction. First in the block, a rollback undoes
+        # nothing; after earlier statements a savepoint keeps their work
+        in_transaction = conn.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE
+        execute = f"EXECUTE {name} ({', '.join(['%s'] * len(params))})"
+        if in_transaction:
+            self.cursor.execute("SAVEPOINT execute_prepared")
+        try:
+            self.cursor.execute(execute, params)
+        except (psycopg2.errors.FeatureNotSupported, psycopg2.errors.InvalidSqlStatementName):
+            metrics.inc("db_prepared_statement_retries_total")
+            if in_transaction:
+                self.cursor.execute("ROLLBACK TO SAVEPOINT execute_prepared")
             else:
-                self.conn.rollback()
-            self.conn.close()
+                conn.rollback()
+            try:
+                # Other cached plans are as stale as this one
+                self.cursor.execute("DEALLOCATE ALL")
+                conn.prepared.clear()
+                self._prepare(conn, name, query, len(params))
+                self.cursor.execute(execute, params)
+            except Exception:
+                conn.deallocate_pending = True
+                raise
+        if in_transaction:
+            self.cursor.execute("RELEASE SAVEPOINT execute_prepared")
+
+    def _prepare(self, conn, name, query, param_count):
+        numbered = query
+        for i in range(1, param_count + 1):
+            numbered = numbered.replace("%s", f"${i}", 1)
+        self.cursor.execute(f"PREPARE {name} AS {numbered}")
+        conn.prepared.add(name)
+
+    def _pick_replica(self, user_id):
+        """A replica that is up and close enough to the primary, or None to read from the primary"""
+        # Reads after a write in the same block stay in its transaction
+        if not self._replicas or self._pool in self._connections:
+            return None
+
+        with Database._recent_writers_lock:
+            if str(user_id) in Database._recent_writers:
+                metrics.inc("db_replica_sticky_reads_total")
+                return None
+
+        now = time.monotonic()
+        candidates = [r for r in self._replicas if r.down_until <= now]
+        random.shuffle(candidates)
+        for replica in candidates:
+            if replica.pool in self._connections:
+                return replica
+            try:
+                if replica.pool is None:
+                    with Database._pool_lock:
+                        if replica.pool is None:
+                            replica.pool = ConnectionPool(
+                                per_worker(
+                                    os.getenv("DB_REPLICA_POOL_MAX_TOTAL", os.getenv("DB_POOL_MAX_TOTAL", 20)),
+                                    POOL_MIN_PER_WORKER
+                                ),
+                                dsn=replica.dsn
+                            )
+                self._acquire(replica.pool)
+                if now - replica.lag_checked_at > float(os.getenv("REPLICA_LAG_CHECK_INTERVAL", 1)):
+                    replica.lag = self._replica_lag(replica)
+                    replica.lag_checked_at = now
+            except PoolExhausted:
+                # Busy, not down: try the next one without taking it out of rotation
+                self._acquire_errors.pop(replica.pool, None)
+                continue
+            except Exception as e:
+                logger.warning(f"replica | {replica.name} unavailable | {type(e).__name__}: {str(e)}")
+                replica.down_until = now + float(os.getenv("REPLICA_RETRY_SECONDS", 30))
+                self._release(replica.pool)
+                continue
+
+            if replica.lag > float(os.getenv("REPLICA_MAX_LAG_SECONDS", 2)):
+                self._release(replica.pool)
+                continue
+
+            metrics.inc("db_replica_reads_total")
+            return replica
+
+        metrics.inc("db_replica_fallbacks_total")
+        return None
+
+    def _replica_lag(self, replica):
+        cursor = self._connections[replica.pool][1]
+        # Replay timestamp alone grows on an idle primary; caught-up receive/replay means no lag
+        cursor.execute("""
+        SELECT CASE
+            WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+            ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+        END
+        """)
+        lag = float(cursor.fetchone()[0])
+        metrics.set_gauge(f"db_{replica.name}_lag_seconds", lag)
+        return lag
+
+    def _release(self, pool):
+        if pool in self._connections:
+            conn, cursor = self._connections.pop(pool)
+            try:
+                cursor.close()
+                conn.rollback()
+            except Exception:
+                pass
+            pool.putconn(conn)
 
     def _config(filename="api/db/database.ini", section="postgresql"):
         parser = ConfigParser()
@@ -40,6 +462,44 @@ class Database:
             raise Exception(f"Section {section} not found in {filename}")
         return db_config
     
+    def _user_info_from_row(self, row):
+        last_payment = row[8]
+        next_renewal = None
+
+        # Calculate next renewal date if premium and has last_payment_at
+        if last_payment and row[4] == 'premium':
+            # Add exactly 1 month (handles month-end edge cases properly)
+            year = last_payment.year
+            month = last_payment.month
+            day = last_payment.day
+
+            # Increment month
+            if month == 12:
+                month = 1
+                year += 1
+            else:
+                month += 1
+
+            # Handle day overflow (e.g., Jan 31 -> Feb 28/29)
+            max_day = calendar.monthrange(year, month)[1]
+            day = min(day, max_day)
+
+            next_renewal_date = last_payment.replace(year=year, month=month, day=day)
+            next_renewal = next_renewal_date.strftime("%b %d, %Y")
+
+        return {
+            "name": row[0],
+            "surname": row[1],
+            "email": row[2],
+            "picture_url": row[3],
+            "type": row[4],
+            "uploads_left": row[5],
+            "generations_left": row[6],
+            "recents_left": row[7],
+            "next_renewal_date": next_renewal
+        }
+
+    @replica_read
     def get_user_info(
             self,
             user_id
@@ -50,46 +510,97 @@ class Database:
             WHERE user_id = %s
         """
         try:
-            self.cursor.execute(query, (user_id,))
+            self._execute_prepared("get_user_info", query, (user_id,))
             result = self.cursor.fetchone()
 
             if result:
-                last_payment = result[8]
-                next_renewal = None
-
-                # Calculate next renewal date if premium and has last_payment_at
-                if last_payment and result[4] == 'premium':
-                    # Add exactly 1 month (handles month-end edge cases properly)
-                    year = last_payment.year
-                    month = last_payment.month
-                    day = last_payment.day
-
-                    # Increment month
-                    if month == 12:
-                        month = 1
-                        year += 1
-                    else:
-                        month += 1
+                return self._user_info_from_row(result)
+            return None
+
+        except DatabaseError as e:
+            self.conn.rollback()
+            raise e
+        except Exception as e:
+            self.conn.rollback()
+            raise e
+    
+    @replica_read
+    def get_bootstrap(
+            self,
+            user_id,
+            page_size
+        ):
+        # User row and the first page of both galleries in a single round trip.
+        # user_id is bound directly in each branch so generations partitions are pruned at plan time
+        query = """
+        SELECT u.user_name, u.user_surname, u.user_email, u.picture_url, u.user_type,
+               u.uploads_left, u.generations_left, u.recents_left, u.last_payment_at,
+               p.kind, p.image_id, p.category, p.preview_bytes, p.faved, p.created_at
+        FROM users u
+        LEFT JOIN LATERAL (
+            (SELECT 'image' AS kind, image_id, category, preview_bytes, faved, created_at
+             FROM images
+             WHERE user_id = %s
+             ORDER BY created_at DESC, image_id DESC
+             LIMIT %s)
+            UNION ALL
+            (SELECT 'generation' AS kind, image_id, NULL, preview_bytes, faved, created_at
+             FROM generations
+             WHERE user_id = %s
+             ORDER BY created_at DESC, image_id DESC
+             LIMIT %s)
+        ) p ON TRUE
+        WHERE u.user_id = %s
+        """
+        try:
+            # One extra row per gallery tells whether another page exists
+            self.cursor.execute(query, (user_id, page_size + 1, user_id, page_size + 1, user_id))
+            data = self.cursor.fetchall()
 
-                    # Handle day overflow (e.g., Jan 31 -> Feb 28/29)
-                    max_day = calendar.monthrange(year, month)[1]
-                    day = min(day, max_day)
+            if not data:
+                return None
 
-                    next_renewal_date = last_payment.replace(year=year, month=month, day=day)
-                    next_renewal = next_renewal_date.strftime("%b %d, %Y")
+            images = [row for row in data if row[9] == 'image']
+            generations = [row for row in data if row[9] == 'generation']
+            images.sort(key=lambda row: (row[14], str(row[10])), reverse=True)
+            generations.sort(key=lambda row: (row[14], str(row[10])), reverse=True)
+
+            image_previews = {}
+            if images:
+                image_previews = {"yourself": [], "clothing": []}
+                for row in images[:page_size]:
+                    image_previews[row[11]].append({
+                        "id": str(row[10]),
+                        "base64": base64.b64encode(row[12]).decode('utf-8'),
+                        "faved": row[13],
+                        "created_at": row[14].isoformat()
+                    })
+
+            generation_previews = []
+            for row in generations[:page_size]:
+                generation_previews.append({
+                    "id": str(row[10]),
+                    "base64": base64.b64encode(row[12]).decode('utf-8'),
+                    "faved": row[13],
+                    "created_at": row[14].isoformat()
+                })
 
-                return {
-                    "name": result[0],
-                    "surname": result[1],
-                    "email": result[2],
-                    "picture_url": result[3],
-                    "type": result[4],
-                    "uploads_left": result[5],
-                    "generations_left": result[6],
-                    "recents_left": result[7],
-                    "next_renewal_date": next_renewal
-                }
-            return None
+            return {
+                "user_info": self._user_info_from_row(data[0]),
+                "image_previews": image_previews,
+                "generation_previews": generation_previews,
+                "has_more_images": len(images) > page_size,
+                "has_more_generations": len(generations) > page_size,
+                # For /get_image_previews and /get_generation_previews; None when there is no next page
+                "next_images_cursor": (
+                    encode_page_cursor(images[page_size - 1][14], images[page_size - 1][10])
+                    if len(images) > page_size else None
+                ),
+                "next_generations_cursor": (
+                    encode_page_cursor(generations[page_size - 1][14], generations[page_size - 1][10])
+                    if len(generations) > page_size else None
+                )
+            }
 
         except DatabaseError as e:
             self.conn.rollback()
@@ -97,23 +608,33 @@ class Database:
         except Exception as e:
             self.conn.rollback()
             raise e
-    
+
+    @primary_write
     def insert_image(
             self,
             user_id,
             category,
             image_bytes,
-            preview_bytes
+            preview_bytes,
+            content_hash=None,
+            phash=None
         ):
         # Check if user has upload credits
         credit_check_query = """
         SELECT uploads_left FROM users WHERE user_id = %s
         """
 
+        # Full-size bytes go to image_blobs so the images row stays narrow
         insert_query = """
-        INSERT INTO images (user_id, category, image_bytes, preview_bytes)
-        VALUES (%s, %s, %s, %s)
-        RETURNING image_id, created_at
+        WITH new_image AS (
+            INSERT INTO images (user_id, category, preview_bytes, content_hash, phash)
+            VALUES (%s, %s, %s, %s, %s)
+            RETURNING image_id, user_id, created_at
+        ), new_blob AS (
+            INSERT INTO image_blobs (image_id, user_id, image_bytes)
+            SELECT image_id, user_id, %s FROM new_image
+        )
+        SELECT image_id, created_at FROM new_image
         """
 
         decrement_query = """
@@ -132,8 +653,10 @@ class Database:
             self.cursor.execute(insert_query, (
                 user_id,
                 category,
-                image_bytes,
-                preview_bytes
+                preview_bytes,
+                content_hash,
+                phash,
+                image_bytes
             ))
             result = self.cursor.fetchone()
             image_id = result[0]
@@ -155,6 +678,132 @@ class Database:
             self.conn.rollback()
             raise e
     
+    @primary_write
+    def insert_image_copy(
+            self,
+            user_id,
+            category,
+            source_image_id
+        ):
+        # Re-upload of bytes the user already has: copy preview and blob server-side, no decoding
+        credit_check_query = """
+        SELECT uploads_left FROM users WHERE user_id = %s
+        """
+
+        insert_query = """
+        WITH source AS (
+            SELECT i.preview_bytes, i.content_hash, i.phash, b.image_bytes
+            FROM images i
+            JOIN image_blobs b ON b.image_id = i.image_id
+            WHERE i.user_id = %s AND i.image_id = %s
+        ), new_image AS (
+            INSERT INTO images (user_id, category, preview_bytes, content_hash, phash)
+            SELECT %s, %s, preview_bytes, content_hash, phash FROM source
+            RETURNING image_id, user_id, created_at, preview_bytes
+        ), new_blob AS (
+            INSERT INTO image_blobs (image_id, user_id, image_bytes)
+            SELECT new_image.image_id, new_image.user_id, source.image_bytes FROM new_image, source
+        )
+        SELECT image_id, created_at, preview_bytes FROM new_image
+        """
+
+        decrement_query = """
+        UPDATE users SET uploads_left = uploads_left - 1
+        WHERE user_id = %s
+        RETURNING uploads_left
+        """
+
+        try:
+            self.cursor.execute(credit_check_query, (user_id,))
+            credit_result = self.cursor.fetchone()
+
+            if not credit_result or credit_result[0] <= 0:
+                raise Exception("Insufficient upload credits")
+
+            self.cursor.execute(insert_query, (
+                user_id,
+                source_image_id,
+                user_id,
+                category
+            ))
+            result = self.cursor.fetchone()
+            if not result:
+                return None
+
+            self.cursor.execute(decrement_query, (user_id,))
+            new_credits = self.cursor.fetchone()[0]
+
+            return {
+                "image_id": str(result[0]),
+                "preview_base64": base64.b64encode(result[2]).decode('utf8'),
+                "created_at": result[1].isoformat(),
+                "uploads_left": new_credits
+            }
+        except DatabaseError as e:
+            self.conn.rollback()
+            raise e
+        except Exception as e:
+            self.conn.rollback()
+            raise e
+
+    def find_images_by_hash(
+            self,
+            user_id,
+            content_hash
+        ):
+        query = """
+        SELECT i.image_id, i.category, i.preview_bytes, i.created_at, u.uploads_left
+        FROM images i
+        JOIN users u ON u.user_id = i.user_id
+        WHERE i.user_id = %s AND i.content_hash = %s
+        ORDER BY i.created_at
+        """
+        try:
+            self.cursor.execute(query, (user_id, content_hash))
+            data = self.cursor.fetchall()
+
+            return [
+                {
+                    "image_id": str(row[0]),
+                    "category": row[1],
+                    "preview_bytes": bytes(row[2]),
+                    "created_at": row[3].isoformat(),
+                    "uploads_left": row[4]
+                }
+                for row in data
+            ]
+
+        except DatabaseError as e:
+            self.conn.rollback()
+            raise e
+        except Exception as e:
+            self.conn.rollback()
+            raise e
+
+    def get_image_phashes(
+            self,
+            user_id,
+            category
+        ):
+        query = """
+        SELECT image_id, phash
+        FROM images
+        WHERE user_id = %s AND category = %s AND phash IS NOT NULL
+        """
+        try:
+            self.cursor.execute(query, (user_id, category))
+            data = self.cursor.fetchall()
+
+            return [(str(row[0]), row[1]) for row in data]
+
+        except DatabaseError as e:
+            self.conn.rollback()
+            raise e
+        except Exception as e:
+            self.conn.rollback()
+            raise e
+
+    @primary_write
     def insert_generated_image(
             self,
             user_id,
@@ -168,9 +817,15 @@ class Database:
         """
 
         insert_query = """
-        INSERT INTO generations (user_id, yourself_image_id, clothing_image_id, image_bytes, preview_bytes)
-        VALUES (%s, %s, %s, %s, %s)
-        RETURNING image_id, created_at
+        WITH new_generation AS (
+            INSERT INTO generations (user_id, yourself_image_id, clothing_image_id, preview_bytes)
+            VALUES (%s, %s, %s, %s)
+            RETURNING image_id, user_id, created_at
+        ), new_blob AS (
+            INSERT INTO generation_blobs (image_id, user_id, image_bytes)
+            SELECT image_id, user_id, %s FROM new_generation
+        )
+        SELECT image_id, created_at FROM new_generation
         """
 
         decrement_query = """
@@ -193,8 +848,8 @@ class Database:
                 user_id,
                 yourself_image_id,
                 clothing_image_id,
-                generated_image_bytes,
-                generated_preview_bytes
+                generated_preview_bytes,
+                generated_image_bytes
             ))
             result = self.cursor.fetchone()
             image_id = result[0]
@@ -217,6 +872,7 @@ class Database:
             self.conn.rollback()
             raise e
     
+    @replica_read
     def get_preview_images(
             self,
             user_id
@@ -228,7 +884,7 @@ class Database:
         ORDER BY created_at DESC
         """
         try:
-            self.cursor.execute(query, (user_id,))
+            self._execute_prepared("get_preview_images", query, (user_id,))
             data = self.cursor.fetchall()
 
             if not data:
@@ -252,6 +908,7 @@ class Database:
             self.conn.rollback()
             raise e
     
+    @replica_read
     def get_preview_generations(
             self,
             user_id
@@ -263,7 +920,7 @@ class Database:
         ORDER BY created_at DESC
         """
         try:
-            self.cursor.execute(query, (user_id,))
+            self._execute_prepared("get_preview_generations", query, (user_id,))
             data = self.cursor.fetchall()
 
             if not data:
@@ -286,6 +943,118 @@ class Database:
             self.conn.rollback()
             raise e
         
+    @replica_read
+    def get_preview_images_page(
+            self,
+            user_id,
+            page_size,
+            cursor=None
+        ):
+        """One page of upload previews, newest first, after `cursor` (see decode_page_cursor).
+
+        Returns {"image_previews": {category: [...]}, "next_cursor": str or None}.
+        """
+        query = """
+        SELECT image_id, category, preview_bytes, faved, created_at
+        FROM images
+        WHERE user_id = %s
+        ORDER BY created_at DESC, image_id DESC
+        LIMIT %s
+        """
+        after_query = """
+        SELECT image_id, category, preview_bytes, faved, created_at
+        FROM images
+        WHERE user_id = %s AND (created_at, image_id) < (%s, %s::uuid)
+        ORDER BY created_at DESC, image_id DESC
+        LIMIT %s
+        """
+        try:
+            # One extra row tells whether another page exists
+            if cursor is None:
+                self._execute_prepared("get_preview_images_page", query, (user_id, page_size + 1))
+            else:
+                created_at, image_id = cursor
+                self._execute_prepared("get_preview_images_after", after_query, (user_id, created_at, image_id, page_size + 1))
+            data = self.cursor.fetchall()
+
+            result = {"yourself": [], "clothing": []} if data else {}
+            for row in data[:page_size]:
+                result.setdefault(row[1], []).append({
+                    "id": str(row[0]),
+                    "base64": base64.b64encode(row[2]).decode('utf-8'),
+                    "faved": row[3],
+                    "created_at": row[4].isoformat()
+                })
+
+            last = data[page_size - 1] if len(data) > page_size else None
+            return {
+                "image_previews": result,
+                "next_cursor": encode_page_cursor(last[4], last[0]) if last else None
+            }
+
+        except DatabaseError as e:
+            self.conn.rollback()
+            raise e
+        except Exception as e:
+            self.conn.rollback()
+            raise e
+
+    @replica_read
+    def get_preview_generations_page(
+            self,
+            user_id,
+            page_size,
+            cursor=None
+        ):
+        """One page of generation previews, newest first, after `cursor` (see decode_page_cursor).
+
+        Returns {"generation_previews": [...], "next_cursor": str or None}.
+        """
+        query = """
+        SELECT image_id, preview_bytes, faved, created_at
+        FROM generations
+        WHERE user_id = %s
+        ORDER BY created_at DESC, image_id DESC
+        LIMIT %s
+        """
+        after_query = """
+        SELECT image_id, preview_bytes, faved, created_at
+        FROM generations
+        WHERE user_id = %s AND (created_at, image_id) < (%s, %s::uuid)
+        ORDER BY created_at DESC, image_id DESC
+        LIMIT %s
+        """
+        try:
+            if cursor is None:
+                self._execute_prepared("get_preview_generations_page", query, (user_id, page_size + 1))
+            else:
+                created_at, image_id = cursor
+                self._execute_prepared("get_preview_generations_after", after_query, (user_id, created_at, image_id, page_size + 1))
+            data = self.cursor.fetchall()
+
+            result = []
+            for row in data[:page_size]:
+                result.append({
+                    "id": str(row[0]),
+                    "base64": base64.b64encode(row[1]).decode('utf-8'),
+                    "faved": row[2],
+                    "created_at": row[3].isoformat()
+                })
+
+            last = data[page_size - 1] if len(data) > page_size else None
+            return {
+                "generation_previews": result,
+                "next_cursor": encode_page_cursor(last[3], last[0]) if last else None
+            }
+
+        except DatabaseError as e:
+            self.conn.rollback()
+            raise e
+        except Exception as e:
+            self.conn.rollback()
+            raise e
+
+    @replica_read
     def get_full_image(
             self,
             user_id,
@@ -293,11 +1062,11 @@ class Database:
         ):
         query = """
         SELECT image_bytes
-        FROM images
+        FROM image_blobs
         WHERE user_id = %s AND image_id = %s
         """
         try:
-            self.cursor.execute(query, (user_id, image_id))
+            self._execute_prepared("get_full_image", query, (user_id, image_id))
             data = self.cursor.fetchone()
 
             if not data:
@@ -312,24 +1081,258 @@ class Database:
             self.conn.rollback()
             raise e
 
+    @replica_read
     def get_full_generated_image(
             self,
             user_id,
             image_id
         ):
         query = """
-        SELECT image_bytes
-        FROM generations
-        WHERE user_id = %s AND image_id = %s
+        SELECT b.image_bytes, g.archived_at IS NOT NULL
+        FROM generations g
+        LEFT JOIN generation_blobs b ON b.user_id = g.user_id AND b.image_id = g.image_id
+        WHERE g.user_id = %s AND g.image_id = %s
         """
         try:
-            self.cursor.execute(query, (user_id, image_id))
+            self._execute_prepared("get_full_generated_image", query, (user_id, image_id))
             data = self.cursor.fetchone()
 
             if not data:
                 return None
 
-            return data[0]
+            if data[0] is not None:
+                if cold_tier:
+                    cold_tier.record_hot_hit()
+                return data[0]
+
+            # Blob was moved to the cold tier by the archiver
+            if data[1] and cold_tier:
+                return cold_tier.fetch(user_id, image_id)
+
+            return None
+
+        except DatabaseError as e:
+            self.conn.rollback()
+            raise e
+        except Exception as e:
+            self.conn.rollback()
+            raise e
+
+    @replica_read
+    def get_full_images_size(
+            self,
+            user_id,
+            image_ids,
+            generation_ids
+        ):
+        """(bytes, unknown) for the ids found: total stored length, and how many have no known length.
+
+        Only stored lengths are read. Unknown ones are generations archived before
+        their size was recorded.
+        """
+        query = """
+        WITH image_sizes AS (
+            SELECT COALESCE(SUM(octet_length(image_bytes)), 0) AS size
+            FROM image_blobs
+            WHERE user_id = %s AND image_id = ANY(%s::uuid[])
+        ), generation_sizes AS (
+            SELECT
+                COALESCE(SUM(COALESCE(octet_length(b.image_bytes), g.archived_size)), 0) AS size,
+                COUNT(*) FILTER (WHERE b.image_id IS NULL AND g.archived_at IS NOT NULL AND g.archived_size IS NULL) AS unknown
+            FROM generations g
+            LEFT JOIN generation_blobs b ON b.user_id = g.user_id AND b.image_id = g.image_id
+            WHERE g.user_id = %s AND g.image_id = ANY(%s::uuid[])
+        )
+        SELECT image_sizes.size + generation_sizes.size, generation_sizes.unknown
+        FROM image_sizes, generation_sizes
+        """
+        try:
+            self.cursor.execute(query, (user_id, list(image_ids), user_id, list(generation_ids)))
+            total_bytes, unknown = self.cursor.fetchone()
+
+            return int(total_bytes), unknown
+
+        except DatabaseError as e:
+            self.conn.rollback()
+            raise e
+        except Exception as e:
+            self.conn.rollback()
+            raise e
+
+    @replica_read
+    def get_full_images(
+            self,
+            user_id,
+            image_ids,
+            max_bytes
+        ):
+        """{image_id: bytes} for the ids found, or None when together they exceed max_bytes"""
+        # The window sum is taken from the stored lengths, so an over-cap batch never reads its blobs
+        query = """
+        SELECT image_id, CASE WHEN SUM(octet_length(image_bytes)) OVER () <= %s THEN image_bytes END
+        FROM image_blobs
+        WHERE user_id = %s AND image_id = ANY(%s::uuid[])
+        """
+        try:
+            self.cursor.execute(query, (max_bytes, user_id, list(image_ids)))
+            data = self.cursor.fetchall()
+
+            if any(row[1] is None for row in data):
+                return None
+
+            return {str(row[0]): row[1] for row in data}
+
+        except DatabaseError as e:
+            self.conn.rollback()
+            raise e
+        except Exception as e:
+            self.conn.rollback()
+            raise e
+
+    @replica_read
+    def get_full_generated_images(
+            self,
+            user_id,
+            image_ids,
+            max_bytes
+        ):
+        """{image_id: bytes} for the ids found (archived ones from the cold tier), or None past max_bytes"""
+        query = """
+        SELECT
+            g.image_id,
+            CASE WHEN SUM(octet_length(b.image_bytes)) OVER () <= %s THEN b.image_bytes END,
+            b.image_id IS NOT NULL,
+            g.archived_at IS NOT NULL
+        FROM generations g
+        LEFT JOIN generation_blobs b ON b.user_id = g.user_id AND b.image_id = g.image_id
+        WHERE g.user_id = %s AND g.image_id = ANY(%s::uuid[])
+        """
+        try:
+            self.cursor.execute(query, (max_bytes, user_id, list(image_ids)))
+            data = self.cursor.fetchall()
+
+            if any(has_blob and image_bytes is None for _, image_bytes, has_blob, _ in data):
+                return None
+
+            images = {}
+            total_bytes = 0
+            for image_id, image_bytes, has_blob, archived in data:
+                if has_blob:
+                    if cold_tier:
+                        cold_tier.record_hot_hit()
+                elif archived and cold_tier:
+                    # Blob was moved to the cold tier by the archiver
+                    image_bytes = cold_tier.fetch(user_id, str(image_id))
+                else:
+                    continue
+                total_bytes += len(image_bytes)
+                if total_bytes > max_bytes:
+                    return None
+                images[str(image_id)] = image_bytes
+
+            return images
+
+        except DatabaseError as e:
+            self.conn.rollback()
+            raise e
+        except Exception as e:
+            self.conn.rollback()
+            raise e
+
+    def get_export_manifest(
+            self,
+            user_id
+        ):
+        """(kind, image_id, category, created_at, size, head, crc, archived) for every upload, then every generation.
+
+        Starts the block's transaction as REPEATABLE READ so iter_export_blobs sees
+        exactly these rows. Sizes and the first bytes (for the file type) come
+        without reading whole blobs. Archived generations carry the size, first bytes
+        and CRC recorded when they were archived, or None for all three if archived
+        before those were kept; crc is None for every other row.
+        """
+        images_query = """
+        SELECT i.image_id, i.category, i.created_at, octet_length(b.image_bytes), substring(b.image_bytes FROM 1 FOR 16)
+        FROM images i
+        JOIN image_blobs b ON b.image_id = i.image_id
+        WHERE i.user_id = %s
+        ORDER BY i.created_at, i.image_id
+        """
+
+        generations_query = """
+        SELECT
+            g.image_id,
+            g.created_at,
+            COALESCE(octet_length(b.image_bytes), g.archived_size),
+            COALESCE(substring(b.image_bytes FROM 1 FOR 16), g.archived_head),
+            g.archived_at IS NOT NULL,
+            g.archived_crc
+        FROM generations g
+        LEFT JOIN generation_blobs b ON b.user_id = g.user_id AND b.image_id = g.image_id
+        WHERE g.user_id = %s
+        ORDER BY g.created_at, g.image_id
+        """
+        try:
+            self.cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY")
+
+            self.cursor.execute(images_query, (user_id,))
+            manifest = [
+                ("image", str(row[0]), row[1], row[2], row[3], bytes(row[4]), None, False)
+                for row in self.cursor.fetchall()
+            ]
+
+            self.cursor.execute(generations_query, (user_id,))
+            for row in self.cursor.fetchall():
+                if row[2] is None and not row[4]:
+                    continue
+                manifest.append((
+                    "generation", str(row[0]), None, row[1], row[2],
+                    bytes(row[3]) if row[3] is not None else None, row[5], row[4]
+                ))
+            return manifest
+
+        except DatabaseError as e:
+            self.conn.rollback()
+            raise e
+        except Exception as e:
+            self.conn.rollback()
+            raise e
+
+    def iter_export_blobs(
+            self,
+            user_id,
+            kind,
+            image_ids,
+            batch_rows
+        ):
+        """Yield (image_id, bytes) for `image_ids` in manifest order, `batch_rows` rows in memory at a time.
+
+        Bytes are None for archived generations.
+        """
+        if kind == "image":
+            query = """
+            SELECT i.image_id, b.image_bytes
+            FROM images i
+            JOIN image_blobs b ON b.image_id = i.image_id
+            WHERE i.user_id = %s AND i.image_id = ANY(%s::uuid[])
+            ORDER BY i.created_at, i.image_id
+            """
+        else:
+            query = """
+            SELECT g.image_id, b.image_bytes
+            FROM generations g
+            LEFT JOIN generation_blobs b ON b.user_id = g.user_id AND b.image_id = g.image_id
+            WHERE g.user_id = %s AND g.image_id = ANY(%s::uuid[])
+            ORDER BY g.created_at, g.image_id
+            """
+        cursor = None
+        try:
+            # Named cursor: rows come from the server batch by batch instead of all at once
+            cursor = self.conn.cursor(name=f"export_{kind}")
+            cursor.itersize = batch_rows
+            cursor.execute(query, (user_id, list(image_ids)))
+            for row in cursor:
+                yield str(row[0]), row[1]
 
         except DatabaseError as e:
             self.conn.rollback()
@@ -337,7 +1340,11 @@ class Database:
         except Exception as e:
             self.conn.rollback()
             raise e
+        finally:
+            if cursor is not None and not cursor.closed:
+                cursor.close()
 
+    @primary_write
     def delete_image(
             self,
             user_id,
@@ -371,6 +1378,7 @@ class Database:
             self.conn.rollback()
             raise e
     
+    @primary_write
     def delete_generated_image(
             self,
             user_id,
@@ -379,6 +1387,7 @@ class Database:
         delete_query = """
         DELETE FROM generations
         WHERE image_id = %s AND user_id = %s
+        RETURNING archived_at IS NOT NULL
         """
 
         increment_query = """
@@ -391,10 +1400,14 @@ class Database:
             self.cursor.execute(delete_query, (image_id, user_id))
             if self.cursor.rowcount == 0:
                 return None
+            archived = self.cursor.fetchone()[0]
 
             self.cursor.execute(increment_query, (user_id,))
             result = self.cursor.fetchone()
-            return {"recents_left": result[0]}
+            return {
+                "recents_left": result[0],
+                "archived": archived
+            }
         except DatabaseError as e:
             self.conn.rollback()
             raise e
@@ -402,6 +1415,7 @@ class Database:
             self.conn.rollback()
             raise e
     
+    @primary_write
     def update_fav(
             self,
             user_id,
@@ -414,7 +1428,7 @@ class Database:
         RETURNING faved
         """
         try:
-            self.cursor.execute(query, (image_id, user_id))
+            self._execute_prepared("update_fav", query, (image_id, user_id))
             result = self.cursor.fetchone()
 
             if not result:
@@ -428,6 +1442,7 @@ class Database:
             self.conn.rollback()
             raise e
 
+    @primary_write
     def update_image_fav(
             self,
             user_id,
@@ -440,7 +1455,7 @@ class Database:
         RETURNING faved
         """
         try:
-            self.cursor.execute(query, (image_id, user_id))
+            self._execute_prepared("update_image_fav", query, (image_id, user_id))
             result = self.cursor.fetchone()
 
             if not result:
@@ -454,6 +1469,7 @@ class Database:
             self.conn.rollback()
             raise e
     
+    @replica_read
     def get_image(
             self,
             user_id,
@@ -461,11 +1477,11 @@ class Database:
         ):
         query = """
         SELECT image_bytes
-        FROM images
+        FROM image_blobs
         WHERE user_id = %s AND image_id = %s
         """
         try:
-            self.cursor.execute(query, (user_id, image_id))
+            self._execute_prepared("get_image", query, (user_id, image_id))
             data = self.cursor.fetchone()
             if not data:
                 return None
@@ -480,6 +1496,337 @@ class Database:
             self.conn.rollback()
             raise e
 
+    @replica_read
+    def get_images(
+            self,
+            user_id,
+            image_ids
+        ):
+        query = """
+        SELECT image_id, image_bytes
+        FROM image_blobs
+        WHERE user_id = %s AND image_id = ANY(%s::uuid[])
+        """
+        try:
+            self.cursor.execute(query, (user_id, list(image_ids)))
+            data = self.cursor.fetchall()
+
+            return {str(row[0]): bytes(row[1]) for row in data}
+
+        except DatabaseError as e:
+            self.conn.rollback()
+            raise e
+        except Exception as e:
+            self.conn.rollback()
+            raise e
+
+    @primary_write
+    def reserve_generation_credits(
+            self,
+            user_id,
+            count
+        ):
+        # Reserve all credits of a batch in one statement so concurrent batches can't overdraw
+        reserve_query = """
+        UPDATE users SET generations_left = generations_left - %s, recents_left = recents_left - %s
+        WHERE user_id = %s AND generations_left >= %s AND recents_left >= %s
+        RETURNING generations_left, recents_left
+        """
+
+        credit_check_query = """
+        SELECT generations_left, recents_left FROM users WHERE user_id = %s
+        """
+
+        try:
+            self.cursor.execute(reserve_query, (count, count, user_id, count, count))
+            result = self.cursor.fetchone()
+
+            if not result:
+                self.cursor.execute(credit_check_query, (user_id,))
+                credit_result = self.cursor.fetchone()
+
+                if not credit_result or credit_result[0] < count:
+                    raise Exception("Insufficient generation credits")
+                raise Exception("Insufficient recents storage")
+
+            return {
+                "generations_left": result[0],
+                "recents_left": result[1]
+            }
+        except DatabaseError as e:
+            self.conn.rollback()
+            raise e
+        except Exception as e:
+            self.conn.rollback()
+            raise e
+
+    @primary_write
+    def refund_generation_credits(
+            self,
+            user_id,
+            count
+        ):
+        query = """
+        UPDATE users SET generations_left = generations_left + %s, recents_left = recents_left + %s
+        WHERE user_id = %s
+        RETURNING generations_left, recents_left
+        """
+        try:
+            self.cursor.execute(query, (count, count, user_id))
+            result = self.cursor.fetchone()
+
+            return {
+                "generations_left": result[0],
+                "recents_left": result[1]
+            }
+        except DatabaseError as e:
+            self.conn.rollback()
+            raise e
+        except Exception as e:
+            self.conn.rollback()
+            raise e
+
+    @primary_write
+    def insert_reserved_generated_image(
+            self,
+            user_id,
+            yourself_image_id,
+            clothing_image_id,
+            generated_image_bytes,
+            generated_preview_bytes
+        ):
+        # Credits were already taken by reserve_generation_credits
+        insert_query = """
+        WITH new_generation AS (
+            INSERT INTO generations (user_id, yourself_image_id, clothing_image_id, preview_bytes)
+            VALUES (%s, %s, %s, %s)
+            RETURNING image_id, user_id, created_at
+        ), new_blob AS (
+            INSERT INTO generation_blobs (image_id, user_id, image_bytes)
+            SELECT image_id, user_id, %s FROM new_generation
+        )
+        SELECT image_id, created_at FROM new_generation
+        """
+
+        try:
+            self.cursor.execute(insert_query, (
+                user_id,
+                yourself_image_id,
+                clothing_image_id,
+                generated_preview_bytes,
+                generated_image_bytes
+            ))
+            result = self.cursor.fetchone()
+
+            return {
+                "image_id": str(result[0]),
+                "preview_base64": base64.b64encode(generated_preview_bytes).decode('utf8'),
+                "created_at": result[1].isoformat()
+            }
+        except DatabaseError as e:
+            self.conn.rollback()
+            raise e
+        except Exception as e:
+            self.conn.rollback()
+            raise e
+
+    def get_archivable_generations(
+            self,
+            older_than_days,
+            limit
+        ):
+        # Locks the picked rows until commit so concurrent archivers skip them
+        query = """
+        SELECT g.user_id, g.image_id, b.image_bytes
+        FROM generations g
+        JOIN generation_blobs b ON b.user_id = g.user_id AND b.image_id = g.image_id
+        WHERE g.archived_at IS NULL AND g.created_at < CURRENT_TIMESTAMP - %s * INTERVAL '1 day'
+        ORDER BY g.created_at
+        LIMIT %s
+        FOR UPDATE OF g SKIP LOCKED
+        """
+        try:
+            self.cursor.execute(query, (older_than_days, limit))
+            data = self.cursor.fetchall()
+
+            return [(str(row[0]), str(row[1]), bytes(row[2])) for row in data]
+
+        except DatabaseError as e:
+            self.conn.rollback()
+            raise e
+        except Exception as e:
+            self.conn.rollback()
+            raise e
+
+    def mark_generation_archived(
+            self,
+            user_id,
+            image_id,
+            size,
+            crc,
+            head
+        ):
+        # Also records size, CRC and first bytes for generations archived before they were kept
+        update_query = """
+        UPDATE generations
+        SET archived_at = COALESCE(archived_at, CURRENT_TIMESTAMP), archived_size = %s, archived_crc = %s, archived_head = %s
+        WHERE user_id = %s AND image_id = %s
+        """
+
+        delete_blob_query = """
+        DELETE FROM generation_blobs
+        WHERE user_id = %s AND image_id = %s
+        """
+
+        try:
+            self.cursor.execute(update_query, (size, crc, head, user_id, image_id))
+            self.cursor.execute(delete_blob_query, (user_id, image_id))
+        except DatabaseError as e:
+            self.conn.rollback()
+            raise e
+        except Exception as e:
+            self.conn.rollback()
+            raise e
+
+    def get_unrecorded_archived_generations(
+            self,
+            limit
+        ):
+        """(user_id, image_id) of archived generations without a recorded size, CRC and first bytes"""
+        query = """
+        SELECT user_id, image_id
+        FROM generations
+        WHERE archived_at IS NOT NULL AND archived_size IS NULL
+        LIMIT %s
+        FOR UPDATE SKIP LOCKED
+        """
+        try:
+            self.cursor.execute(query, (limit,))
+            return [(str(row[0]), str(row[1])) for row in self.cursor.fetchall()]
+
+        except DatabaseError as e:
+            self.conn.rollback()
+            raise e
+        except Exception as e:
+            self.conn.rollback()
+            raise e
+
+    def claim_idempotency_key(
+            self,
+            user_id,
+            idempotency_key,
+            route,
+            request_hash,
+            ttl_seconds,
+            pending_timeout
+        ):
+        # Takes over keys that expired or whose original request died without finishing
+        claim_query = """
+        INSERT INTO idempotency_keys (user_id, idempotency_key, route, request_hash, expires_at)
+        VALUES (%s, %s, %s, %s, CURRENT_TIMESTAMP + %s * INTERVAL '1 second')
+        ON CONFLICT (user_id, idempotency_key) DO UPDATE
+        SET route = EXCLUDED.route,
+            request_hash = EXCLUDED.request_hash,
+            response = NULL,
+            created_at = CURRENT_TIMESTAMP,
+            expires_at = EXCLUDED.expires_at
+        WHERE idempotency_keys.expires_at < CURRENT_TIMESTAMP
+           OR (idempotency_keys.response IS NULL
+               AND idempotency_keys.created_at < CURRENT_TIMESTAMP - %s * INTERVAL '1 second')
+        RETURNING 1
+        """
+
+        existing_query = """
+        SELECT route, request_hash, response
+        FROM idempotency_keys
+        WHERE user_id = %s AND idempotency_key = %s
+        """
+
+        try:
+            self.cursor.execute(claim_query, (user_id, idempotency_key, route, request_hash, ttl_seconds, pending_timeout))
+            if self.cursor.fetchone():
+                return {"claimed": True}
+
+            self.cursor.execute(existing_query, (user_id, idempotency_key))
+            data = self.cursor.fetchone()
+
+            # Released between the two statements: the caller tries again
+            if not data:
+                return None
+
+            return {
+                "claimed": False,
+                "route": data[0],
+                "request_hash": bytes(data[1]),
+                "response": data[2]
+            }
+        except DatabaseError as e:
+            self.conn.rollback()
+            raise e
+        except Exception as e:
+            self.conn.rollback()
+            raise e
+
+    def complete_idempotency_key(
+            self,
+            user_id,
+            idempotency_key,
+            response
+        ):
+        query = """
+        UPDATE idempotency_keys SET response = %s::jsonb
+        WHERE user_id = %s AND idempotency_key = %s
+        """
+        try:
+            self.cursor.execute(query, (json.dumps(response), user_id, idempotency_key))
+        except DatabaseError as e:
+            self.conn.rollback()
+            raise e
+        except Exception as e:
+            self.conn.rollback()
+            raise e
+
+    def release_idempotency_key(
+            self,
+            user_id,
+            idempotency_key
+        ):
+        # Failed requests leave nothing behind, so a retry runs them again
+        query = """
+        DELETE FROM idempotency_keys
+        WHERE user_id = %s AND idempotency_key = %s AND response IS NULL
+        """
+        try:
+            self.cursor.execute(query, (user_id, idempotency_key))
+        except DatabaseError as e:
+            self.conn.rollback()
+            raise e
+        except Exception as e:
+            self.conn.rollback()
+            raise e
+
+    def purge_expired_idempotency_keys(
+            self,
+            limit
+        ):
+        query = """
+        DELETE FROM idempotency_keys
+        WHERE ctid IN (
+            SELECT ctid FROM idempotency_keys
+            WHERE expires_at < CURRENT_TIMESTAMP
+            LIMIT %s
+        )
+        """
+        try:
+            self.cursor.execute(query, (limit,))
+            return self.cursor.rowcount
+        except DatabaseError as e:
+            self.conn.rollback()
+            raise e
+        except Exception as e:
+            self.conn.rollback()
+            raise e
+
     def insert_feedback(
             self,
             user_id,
@@ -560,6 +1907,7 @@ class Database:
             ))
             result = self.cursor.fetchone()
             user_id = str(result[0])
+            self._written_users.add(user_id)
             return user_id
 
         except DatabaseError as e:
@@ -568,3 +1916,58 @@ class Database:
         except Exception as e:
             self.conn.rollback()
             raise e
+
+
+def instrumented(method):
+    """Trace span per call; the statements it runs are attributed to it in the query log"""
+    name = method.__name__
+    if inspect.isgeneratorfunction(method):
+        return instrumented_generator(method)
+    traced_method = traced(f"db.{name}")(method)
+
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        token = current_method.set(name)
+        try:
+            return traced_method(*args, **kwargs)
+        finally:
+            current_method.reset(token)
+    return wrapper
+
+
+def instrumented_generator(method):
+    """Attribution for generator methods, which run their statements while being iterated.
+
+    The method name is set around each step rather than across yields: steps may run
+    in different threads and contexts (iterate_in_threadpool), and a context variable
+    can only be reset in the context that set it. No span, since one would have to
+    stay open across those steps.
+    """
+    name = method.__name__
+
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        generator = method(*args, **kwargs)
+        try:
+            while True:
+                token = current_method.set(name)
+                try:
+                    item = next(generator)
+                except StopIteration:
+                    return
+                finally:
+                    current_method.reset(token)
+                yield item
+        finally:
+            # Closing runs the method's own cleanup (e.g. closing a named cursor)
+            token = current_method.set(name)
+            try:
+                generator.close()
+            finally:
+                current_method.reset(token)
+    return wrapper
+
+
+for _name, _method in list(vars(Database).items()):
+    if inspect.isfunction(_method) and not _name.startswith("_"):
+        setattr(Database, _name, instrumented(_method))
@@ -0,0 +1,180 @@
+import hashlib
+import itertools
+import logging
+import os
+import threading
+import zlib
+from cachetools import LRUCache
+from .database import Database
+from ..functions.cold_storage import cold_tier
+from ..functions.metrics import metrics
+from ..functions.zip_stream import DATA_DESCRIPTOR_SIZE, StoredZip, ZipEntry, clip, overlaps
+
+
+logger = logging.getLogger(__name__)
+
+# Rows (full-size images) held in memory at a time while streaming
+EXPORT_CURSOR_ROWS = int(os.getenv("EXPORT_CURSOR_ROWS", 4))
+
+# CRCs of exported blobs, so a resumed download doesn't re-read what it already received
+_crc_cache = LRUCache(maxsize=int(os.getenv("EXPORT_CRC_CACHE_ENTRIES", 100000)))
+_crc_cache_lock = threading.Lock()
+
+# Upload categories get their own folder; anything else (the column is client-supplied text) goes under "other"
+CATEGORY_FOLDERS = {"yourself": "yourself", "clothing": "clothing"}
+
+SIGNATURES = (
+    (b"\xff\xd8\xff", "jpg"),
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"GIF8", "gif"),
+)
+
+
+def file_extension(head):
+    if head is None:
+        return "bin"
+    for signature, ext in SIGNATURES:
+        if head.startswith(signature):
+            return ext
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "webp"
+    if head[4:12] in (b"ftypavif", b"ftypavis"):
+        return "avif"
+    return "bin"
+
+
+class GalleryExport:
+    """A user's uploads and generations as one store-mode ZIP, streamed from the database.
+
+    open() reads the manifest (ids, sizes, first bytes; no blobs) in a REPEATABLE
+    READ transaction and fixes the archive layout, so the response length, ETag and
+    any byte range are known before data is read. chunks() then walks server-side
+    cursors over just the blobs a range needs, a few rows at a time. open(),
+    chunks() and close() are blocking and hold one connection from open() to
+    close(), opened outside the pool so a long download doesn't starve other requests.
+    """
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.db = None
+        self.zip = None
+        self.etag = None
+
+    def open(self):
+        self.db = Database(dedicated=True).__enter__()
+        try:
+            entries = []
+            for kind, image_id, category, created_at, size, head, crc, archived in self.db.get_export_manifest(self.user_id):
+                if archived:
+                    # Archived blobs are only in the cold tier
+                    if not cold_tier:
+                        logger.warning(f"export | {self.user_id} | archived generation {image_id} skipped: COLD_STORAGE_DIR is not set")
+                        continue
+                    if size is None:
+                        # Archived before size and CRC were recorded: read it once (or run --backfill-info)
+                        image_bytes = cold_tier.fetch(self.user_id, image_id)
+                        size, head, crc = len(image_bytes), image_bytes[:16], zlib.crc32(image_bytes)
+                        del image_bytes
+                else:
+                    crc = self._cached_crc(kind, image_id, size)
+
+                folder = f"uploads/{CATEGORY_FOLDERS.get(category, 'other')}" if kind == "image" else "generations"
+                stamp = created_at.strftime("%Y%m%d-%H%M%S") if created_at else "00000000-000000"
+                name = f"{folder}/{stamp}_{image_id}.{file_extension(head)}"
+                entries.append(ZipEntry(name, size, created_at, crc, source=(kind, image_id)))
+
+            self.zip = StoredZip(entries)
+            manifest_hash = hashlib.sha256()
+            for entry in entries:
+                manifest_hash.update(entry.name + entry.size.to_bytes(8, "big"))
+            self.etag = f'"{manifest_hash.hexdigest()[:32]}"'
+        except BaseException:
+            self.close(failed=True)
+            raise
+
+    @property
+    def size(self):
+        return self.zip.size
+
+    def chunks(self, start, end):
+        """Archive bytes [start, end] (inclusive), as memoryviews"""
+        zip_layout = self.zip
+        needs_directory = end >= zip_layout.directory_offset
+
+        # Blobs to read: those with bytes in the range, and those whose CRC the range needs but isn't known
+        wanted = {"image": [], "generation": []}
+        for entry in zip_layout.entries:
+            in_range = overlaps(entry.data_offset, entry.size, start, end)
+            needs_crc = entry.crc is None and (
+                needs_directory or overlaps(entry.descriptor_offset, DATA_DESCRIPTOR_SIZE, start, end)
+            )
+            if in_range or needs_crc:
+                wanted[entry.source[0]].append(entry.source)
+        wanted_sources = set(wanted["image"] + wanted["generation"])
+
+        # Uploads come before generations in the layout, so one cursor runs out before the next opens
+        readers = [
+            self.db.iter_export_blobs(self.user_id, kind, [image_id for _, image_id in sources], EXPORT_CURSOR_ROWS)
+            for kind, sources in wanted.items() if sources
+        ]
+        blobs = itertools.chain.from_iterable(readers)
+        sent = 0
+        try:
+            for entry in zip_layout.entries:
+                if entry.offset > end:
+                    break
+
+                image_bytes = None
+                if entry.source in wanted_sources:
+                    image_id, image_bytes = next(blobs)
+                    if image_bytes is None:
+                        image_bytes = cold_tier.fetch(self.user_id, image_id)
+                    if image_id != entry.source[1] or len(image_bytes) != entry.size:
+                        raise RuntimeError("Gallery changed during export")
+                    if entry.crc is None:
+                        entry.crc = zlib.crc32(image_bytes)
+                        self._cache_crc(entry.source[0], image_id, entry.size, entry.crc)
+
+                if overlaps(entry.offset, entry.data_offset - entry.offset, start, end):
+                    yield clip(entry.offset, zip_layout.local_header(entry), start, end)
+                if image_bytes is not None and overlaps(entry.data_offset, entry.size, start, end):
+                    chunk = clip(entry.data_offset, image_bytes, start, end)
+                    sent += len(chunk)
+                    yield chunk
+                if overlaps(entry.descriptor_offset, DATA_DESCRIPTOR_SIZE, start, end):
+                    yield clip(entry.descriptor_offset, zip_layout.data_descriptor(entry), start, end)
+                del image_bytes
+
+            if needs_directory:
+                offset = zip_layout.directory_offset
+                for entry in zip_layout.entries:
+                    record = zip_layout.central_record(entry)
+                    if overlaps(offset, len(record), start, end):
+                        yield clip(offset, record, start, end)
+                    offset += len(record)
+                end_records = zip_layout.end_records()
+                if overlaps(offset, len(end_records), start, end):
+                    yield clip(offset, end_records, start, end)
+        finally:
+            for reader in readers:
+                reader.close()
+            metrics.inc("gallery_export_image_bytes_total", sent)
+
+    def close(self, failed=False):
+        if self.db is not None:
+            db, self.db = self.db, None
+            if failed:
+                db.__exit__(RuntimeError, None, None)
+            else:
+                db.__exit__(None, None, None)
+
+    def _cached_crc(self, kind, image_id, size):
+        with _crc_cache_lock:
+            cached = _crc_cache.get((self.user_id, kind, image_id))
+        if cached and cached[0] == size:
+            return cached[1]
+        return None
+
+    def _cache_crc(self, kind, image_id, size, crc):
+        with _crc_cache_lock:
+            _crc_cache[(self.user_id, kind, image_id)] = (size, crc)
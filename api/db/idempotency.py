@@ -0,0 +1,28 @@
+import asyncio
+import logging
+import os
+from .database import Database
+
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_TTL = float(os.getenv("IDEMPOTENCY_TTL_HOURS", 24)) * 3600
+IDEMPOTENCY_PURGE_BATCH_SIZE = int(os.getenv("IDEMPOTENCY_PURGE_BATCH_SIZE", 1000))
+IDEMPOTENCY_PURGE_INTERVAL = float(os.getenv("IDEMPOTENCY_PURGE_INTERVAL", 600))
+
+
+def purge_batch(batch_size=IDEMPOTENCY_PURGE_BATCH_SIZE):
+    with Database() as db:
+        return db.purge_expired_idempotency_keys(batch_size)
+
+
+async def run_purger(interval=IDEMPOTENCY_PURGE_INTERVAL):
+    """Background loop started by the API that deletes expired idempotency keys"""
+    while True:
+        try:
+            purged = await asyncio.to_thread(purge_batch)
+        except Exception as e:
+            logger.error(f"idempotency_purger | {type(e).__name__}: {str(e)}", exc_info=True)
+            purged = 0
+
+        await asyncio.sleep(0 if purged == IDEMPOTENCY_PURGE_BATCH_SIZE else interval)
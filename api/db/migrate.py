@@ -1,12 +1,20 @@
 import psycopg2
 import logging
+import re
 import sys
+import time
 from configparser import ConfigParser
 from pathlib import Path
 
 
 logger = logging.getLogger(__name__)
 
+# Arbitrary constant shared by every runner so concurrent pods serialize on it
+MIGRATION_LOCK_KEY = 804_215_370
+
+# First-line marker for migrations that can't run in a transaction (CREATE INDEX CONCURRENTLY etc.)
+NO_TRANSACTION_MARKER = "-- migrate: no-transaction"
+
 class MigrationRunner:
     def __init__(self):
         self.db_config = self._config()
@@ -25,52 +33,182 @@ class MigrationRunner:
         return db_config
 
     def get_migration_files(self):
-        files = sorted(self.migrations_dir.glob("v*.sql"))
-        return files
+        files = self.migrations_dir.glob("v*.sql")
+        return sorted(files, key=lambda f: int(f.stem.split('_')[0][1:]))
 
-    def apply_migration(self, cursor, migration_file):
-        """Apply a single migration file"""
-        version = migration_file.stem.split('_')[0]
+    def is_transactional(self, sql):
+        return not sql.lstrip().startswith(NO_TRANSACTION_MARKER)
+
+    def split_statements(self, sql):
+        """Split a script on top-level semicolons, skipping comments, quotes and $$ bodies"""
+        statements = []
+        current = []
+        i = 0
+        while i < len(sql):
+            if sql.startswith('--', i):
+                end = sql.find('\n', i)
+                end = len(sql) if end == -1 else end
+                current.append(sql[i:end])
+                i = end
+            elif sql[i] == "'":
+                end = sql.find("'", i + 1)
+                while end != -1 and sql.startswith("''", end):
+                    end = sql.find("'", end + 2)
+                end = len(sql) if end == -1 else end + 1
+                current.append(sql[i:end])
+                i = end
+            elif sql[i] == '$' and (tag := re.match(r'\$[A-Za-z_]*\$', sql[i:])):
+                end = sql.find(tag.group(), i + len(tag.group()))
+                end = len(sql) if end == -1 else end + len(tag.group())
+                current.append(sql[i:end])
+                i = end
+            elif sql[i] == ';':
+                statements.append(''.join(current))
+                current = []
+                i += 1
+            else:
+                current.append(sql[i])
+                i += 1
+        statements.append(''.join(current))
+
+        # Drop fragments that are only whitespace and comments
+        return [
+            statement.strip() for statement in statements
+            if re.sub(r'--[^\n]*', '', statement).strip()
+        ]
+
+    def ensure_migrations_table(self, cursor):
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version VARCHAR(20) PRIMARY KEY,
+                name VARCHAR(255) NOT NULL,
+                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                duration_ms INT NOT NULL
+            )
+        """)
 
-        logger.info(f"Applying migration: {migration_file.name}")
+    def get_applied_versions(self, cursor):
+        cursor.execute("SELECT version FROM schema_migrations")
+        return {row[0] for row in cursor.fetchall()}
+
+    def record_migration(self, cursor, migration_file, duration_ms):
+        cursor.execute("""
+            INSERT INTO schema_migrations (version, name, duration_ms)
+            VALUES (%s, %s, %s)
+            ON CONFLICT (version) DO UPDATE
+            SET name = EXCLUDED.name, applied_at = CURRENT_TIMESTAMP, duration_ms = EXCLUDED.duration_ms
+        """, (migration_file.stem.split('_')[0], migration_file.name, duration_ms))
+
+    def apply_migration(self, conn, migration_file):
+        """Apply a single migration file and record it in schema_migrations"""
+        version = migration_file.stem.split('_')[0]
 
         with migration_file.open('r') as f:
             sql = f.read()
 
+        transactional = self.is_transactional(sql)
+        logger.info(f"Applying migration: {migration_file.name} ({'transactional' if transactional else 'non-transactional'})")
+
+        start = time.perf_counter()
+        cursor = conn.cursor()
         try:
-            cursor.execute(sql)
-            return True
+            if transactional:
+                conn.autocommit = False
+                cursor.execute(sql)
+                duration_ms = int((time.perf_counter() - start) * 1000)
+                self.record_migration(cursor, migration_file, duration_ms)
+                conn.commit()
+            else:
+                # Each statement runs in its own implicit transaction; files must be idempotent
+                conn.autocommit = True
+                for statement in self.split_statements(sql):
+                    cursor.execute(statement)
+                duration_ms = int((time.perf_counter() - start) * 1000)
+                self.record_migration(cursor, migration_file, duration_ms)
+
+            logger.info(f"✓ Migration {version} applied in {duration_ms} ms")
+            return duration_ms
         except Exception as e:
+            if not conn.autocommit:
+                conn.rollback()
             logger.error(f"✗ Migration {version} failed: {e}")
             raise
+        finally:
+            cursor.close()
+            conn.autocommit = False
 
-    def run_all_migrations(self):
+    def _locked_connection(self):
         conn = psycopg2.connect(**self.db_config)
+        conn.autocommit = True
+        cursor = conn.cursor()
+        logger.info("Waiting for migration lock...")
+        cursor.execute("SELECT pg_advisory_lock(%s)", (MIGRATION_LOCK_KEY,))
+        self.ensure_migrations_table(cursor)
+        cursor.close()
         conn.autocommit = False
+        return conn
+
+    def _release(self, conn):
+        try:
+            conn.rollback()
+            conn.autocommit = True
+            cursor = conn.cursor()
+            cursor.execute("SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK_KEY,))
+            cursor.close()
+        finally:
+            conn.close()
+
+    def get_pending_migrations(self, conn):
         cursor = conn.cursor()
+        try:
+            applied = self.get_applied_versions(cursor)
+        finally:
+            cursor.close()
+        conn.commit()
+        return [f for f in self.get_migration_files() if f.stem.split('_')[0] not in applied]
+
+    def run_all_migrations(self):
+        """Apply pending migrations in version order while holding the migration lock"""
+        conn = self._locked_connection()
 
         try:
             migration_files = self.get_migration_files()
-            logger.info(f"Found {len(migration_files)} migration file(s)")
+            pending = self.get_pending_migrations(conn)
+            logger.info(f"Found {len(migration_files)} migration file(s), {len(pending)} pending")
 
-            for migration_file in migration_files:
-                self.apply_migration(cursor, migration_file)
+            total_ms = 0
+            for migration_file in pending:
+                total_ms += self.apply_migration(conn, migration_file)
 
-            conn.commit()
-            logger.info(f"✓ Successfully applied {len(migration_files)} migration(s)")
+            logger.info(f"✓ Successfully applied {len(pending)} migration(s) in {total_ms} ms")
 
         except Exception as e:
-            conn.rollback()
-            logger.error(f"✗ Migration failed, rolled back: {e}")
+            logger.error(f"✗ Migration failed: {e}")
             raise
         finally:
+            self._release(conn)
+
+    def show_status(self):
+        conn = self._locked_connection()
+
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT version, name, applied_at, duration_ms FROM schema_migrations")
+            applied = {row[0]: row for row in cursor.fetchall()}
             cursor.close()
-            conn.close()
+
+            for migration_file in self.get_migration_files():
+                version = migration_file.stem.split('_')[0]
+                if version in applied:
+                    _, _, applied_at, duration_ms = applied[version]
+                    logger.info(f"  ✓ {migration_file.name:<40} applied {applied_at:%Y-%m-%d %H:%M:%S} ({duration_ms} ms)")
+                else:
+                    logger.info(f"  · {migration_file.name:<40} pending")
+        finally:
+            self._release(conn)
 
     def run_specific_migration(self, target_version):
-        conn = psycopg2.connect(**self.db_config)
-        conn.autocommit = False
-        cursor = conn.cursor()
+        conn = self._locked_connection()
 
         try:
             migration_files = self.get_migration_files()
@@ -89,18 +227,15 @@ class MigrationRunner:
                 logger.info(f"Available migrations: {[f.stem.split('_')[0] for f in migration_files]}")
                 return
 
-            # Apply the specific migration
-            self.apply_migration(cursor, target_file)
-            conn.commit()
+            # Apply the specific migration, even if it was already recorded
+            self.apply_migration(conn, target_file)
             logger.info(f"✓ Successfully applied migration {target_version}")
 
         except Exception as e:
-            conn.rollback()
-            logger.error(f"✗ Migration failed, rolled back: {e}")
+            logger.error(f"✗ Migration failed: {e}")
             raise
         finally:
-            cursor.close()
-            conn.close()
+            self._release(conn)
 
     def reset_database(self):
         reset_file = Path(__file__).parent / "migrations" / "reset.sql"
@@ -123,13 +258,16 @@ class MigrationRunner:
             conn.close()
 
 def main():
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
     # Show usage if no arguments
     if len(sys.argv) < 2:
         logger.error("✗ No operation specified")
         logger.info("")
         logger.info("Usage:")
         logger.info("  python -m api.db.migrate --reset      # Reset database (deletes everything)")
-        logger.info("  python -m api.db.migrate --all        # Run all migrations from v0")
+        logger.info("  python -m api.db.migrate --all        # Run pending migrations")
+        logger.info("  python -m api.db.migrate --status     # Show applied and pending migrations")
         logger.info("  python -m api.db.migrate --v0         # Run only v0 migration")
         logger.info("  python -m api.db.migrate --v1         # Run only v1 migration")
         logger.info("  python -m api.db.migrate --v2         # Run only v2 migration (etc.)")
@@ -148,9 +286,12 @@ def main():
             logger.info("Reset cancelled")
 
     elif arg == "--all":
-        logger.info("Running all migrations...")
+        logger.info("Running pending migrations...")
         runner.run_all_migrations()
 
+    elif arg == "--status":
+        runner.show_status()
+
     elif arg.startswith("--v"):
         # Extract version number (e.g., --v1 -> v1)
         version_str = arg[2:]  # Remove '--' prefix
@@ -163,7 +304,8 @@ def main():
         logger.info("")
         logger.info("Usage:")
         logger.info("  python -m api.db.migrate --reset      # Reset database (deletes everything)")
-        logger.info("  python -m api.db.migrate --all        # Run all migrations from v0")
+        logger.info("  python -m api.db.migrate --all        # Run pending migrations")
+        logger.info("  python -m api.db.migrate --status     # Show applied and pending migrations")
         logger.info("  python -m api.db.migrate --v0         # Run only v0 migration")
         logger.info("  python -m api.db.migrate --v1         # Run only v1 migration")
         logger.info("")
@@ -0,0 +1,5 @@
+-- migrate: no-transaction
+-- Gallery listings filter by user and sort by recency; build without blocking writes.
+-- A failed concurrent build leaves an INVALID index behind: drop it before re-running.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_images_user_created ON images (user_id, created_at DESC);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_generations_user_created ON generations (user_id, created_at DESC);
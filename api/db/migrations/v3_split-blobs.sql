@@ -0,0 +1,38 @@
+-- Full-size images live in their own tables so gallery rows stay narrow
+CREATE TABLE IF NOT EXISTS image_blobs (
+    image_id UUID PRIMARY KEY,
+    user_id UUID NOT NULL,
+    image_bytes BYTEA NOT NULL,
+    FOREIGN KEY (image_id) REFERENCES images(image_id) ON DELETE CASCADE
+);
+
+CREATE TABLE IF NOT EXISTS generation_blobs (
+    image_id UUID PRIMARY KEY,
+    user_id UUID NOT NULL,
+    image_bytes BYTEA NOT NULL,
+    FOREIGN KEY (image_id) REFERENCES generations(image_id) ON DELETE CASCADE
+);
+
+-- Images are already compressed: store them out of line without trying pglz first
+ALTER TABLE image_blobs ALTER COLUMN image_bytes SET STORAGE EXTERNAL;
+ALTER TABLE generation_blobs ALTER COLUMN image_bytes SET STORAGE EXTERNAL;
+ALTER TABLE images ALTER COLUMN preview_bytes SET STORAGE EXTERNAL;
+ALTER TABLE generations ALTER COLUMN preview_bytes SET STORAGE EXTERNAL;
+
+-- Move existing blobs, then drop the wide columns
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name = 'images' AND column_name = 'image_bytes') THEN
+        INSERT INTO image_blobs (image_id, user_id, image_bytes)
+        SELECT image_id, user_id, image_bytes FROM images WHERE image_bytes IS NOT NULL
+        ON CONFLICT (image_id) DO NOTHING;
+        ALTER TABLE images DROP COLUMN image_bytes;
+    END IF;
+
+    IF EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name = 'generations' AND column_name = 'image_bytes') THEN
+        INSERT INTO generation_blobs (image_id, user_id, image_bytes)
+        SELECT image_id, user_id, image_bytes FROM generations WHERE image_bytes IS NOT NULL
+        ON CONFLICT (image_id) DO NOTHING;
+        ALTER TABLE generations DROP COLUMN image_bytes;
+    END IF;
+END $$;
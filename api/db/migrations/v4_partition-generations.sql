@@ -0,0 +1,185 @@
+-- migrate: no-transaction
+-- Convert generations and generation_blobs into tables hash-partitioned by user_id.
+-- Online: triggers mirror live writes into the new tables while existing rows are
+-- copied in small committed batches, then a short locked swap renames them into place.
+-- Every step is skipped once generations is already partitioned.
+
+DO $$
+BEGIN
+    IF (SELECT relkind FROM pg_class WHERE oid = 'generations'::regclass) = 'p' THEN
+        RETURN;
+    END IF;
+
+    CREATE TABLE IF NOT EXISTS generations_partitioned (
+        image_id UUID NOT NULL DEFAULT gen_random_uuid(),
+        user_id UUID NOT NULL,
+        yourself_image_id VARCHAR(50) NOT NULL,
+        clothing_image_id VARCHAR(50) NOT NULL,
+        preview_bytes BYTEA,
+        faved BOOLEAN DEFAULT FALSE,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (user_id, image_id),
+        FOREIGN KEY (user_id) REFERENCES users(user_id)
+    ) PARTITION BY HASH (user_id);
+
+    CREATE TABLE IF NOT EXISTS generation_blobs_partitioned (
+        image_id UUID NOT NULL,
+        user_id UUID NOT NULL,
+        image_bytes BYTEA NOT NULL,
+        PRIMARY KEY (user_id, image_id),
+        FOREIGN KEY (user_id, image_id) REFERENCES generations_partitioned(user_id, image_id) ON DELETE CASCADE
+    ) PARTITION BY HASH (user_id);
+
+    FOR i IN 0..15 LOOP
+        EXECUTE format(
+            'CREATE TABLE IF NOT EXISTS generations_p%s PARTITION OF generations_partitioned FOR VALUES WITH (MODULUS 16, REMAINDER %s)',
+            lpad(i::text, 2, '0'), i
+        );
+        EXECUTE format(
+            'CREATE TABLE IF NOT EXISTS generation_blobs_p%s PARTITION OF generation_blobs_partitioned FOR VALUES WITH (MODULUS 16, REMAINDER %s)',
+            lpad(i::text, 2, '0'), i
+        );
+    END LOOP;
+
+    -- Set after the partitions exist so it recurses into them
+    ALTER TABLE generations_partitioned ALTER COLUMN preview_bytes SET STORAGE EXTERNAL;
+    ALTER TABLE generation_blobs_partitioned ALTER COLUMN image_bytes SET STORAGE EXTERNAL;
+
+    CREATE INDEX IF NOT EXISTS generations_partitioned_user_created_idx ON generations_partitioned (user_id, created_at DESC);
+END $$;
+
+-- Mirror live writes into the new tables
+CREATE OR REPLACE FUNCTION mirror_generations() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        DELETE FROM generations_partitioned WHERE user_id = OLD.user_id AND image_id = OLD.image_id;
+        RETURN OLD;
+    END IF;
+
+    INSERT INTO generations_partitioned (image_id, user_id, yourself_image_id, clothing_image_id, preview_bytes, faved, created_at)
+    VALUES (NEW.image_id, NEW.user_id, NEW.yourself_image_id, NEW.clothing_image_id, NEW.preview_bytes, NEW.faved, NEW.created_at)
+    ON CONFLICT (user_id, image_id) DO UPDATE
+    SET yourself_image_id = EXCLUDED.yourself_image_id,
+        clothing_image_id = EXCLUDED.clothing_image_id,
+        preview_bytes = EXCLUDED.preview_bytes,
+        faved = EXCLUDED.faved,
+        created_at = EXCLUDED.created_at;
+    RETURN NEW;
+END $$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION mirror_generation_blobs() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        DELETE FROM generation_blobs_partitioned WHERE user_id = OLD.user_id AND image_id = OLD.image_id;
+        RETURN OLD;
+    END IF;
+
+    INSERT INTO generation_blobs_partitioned (image_id, user_id, image_bytes)
+    VALUES (NEW.image_id, NEW.user_id, NEW.image_bytes)
+    ON CONFLICT (user_id, image_id) DO UPDATE
+    SET image_bytes = EXCLUDED.image_bytes;
+    RETURN NEW;
+END $$ LANGUAGE plpgsql;
+
+DO $$
+BEGIN
+    IF (SELECT relkind FROM pg_class WHERE oid = 'generations'::regclass) = 'p' THEN
+        RETURN;
+    END IF;
+
+    DROP TRIGGER IF EXISTS mirror_generations ON generations;
+    CREATE TRIGGER mirror_generations
+        AFTER INSERT OR UPDATE OR DELETE ON generations
+        FOR EACH ROW EXECUTE FUNCTION mirror_generations();
+
+    DROP TRIGGER IF EXISTS mirror_generation_blobs ON generation_blobs;
+    CREATE TRIGGER mirror_generation_blobs
+        AFTER INSERT OR UPDATE OR DELETE ON generation_blobs
+        FOR EACH ROW EXECUTE FUNCTION mirror_generation_blobs();
+END $$;
+
+-- Backfill in committed batches, keyset-paginated on the old primary key
+DO $$
+DECLARE
+    last_id UUID := '00000000-0000-0000-0000-000000000000';
+BEGIN
+    IF (SELECT relkind FROM pg_class WHERE oid = 'generations'::regclass) = 'p' THEN
+        RETURN;
+    END IF;
+
+    LOOP
+        WITH batch AS (
+            SELECT * FROM generations
+            WHERE image_id > last_id
+            ORDER BY image_id
+            LIMIT 1000
+        ), copied AS (
+            INSERT INTO generations_partitioned (image_id, user_id, yourself_image_id, clothing_image_id, preview_bytes, faved, created_at)
+            SELECT image_id, user_id, yourself_image_id, clothing_image_id, preview_bytes, faved, created_at FROM batch
+            ON CONFLICT (user_id, image_id) DO NOTHING
+        )
+        SELECT image_id INTO last_id FROM batch ORDER BY image_id DESC LIMIT 1;
+        EXIT WHEN NOT FOUND;
+        COMMIT;
+    END LOOP;
+
+    last_id := '00000000-0000-0000-0000-000000000000';
+    LOOP
+        -- Blobs are multi-MB: keep batches small
+        WITH batch AS (
+            SELECT b.* FROM generation_blobs b
+            WHERE b.image_id > last_id
+            ORDER BY b.image_id
+            LIMIT 50
+        ), copied AS (
+            INSERT INTO generation_blobs_partitioned (image_id, user_id, image_bytes)
+            SELECT batch.image_id, batch.user_id, batch.image_bytes FROM batch
+            JOIN generations_partitioned g ON g.user_id = batch.user_id AND g.image_id = batch.image_id
+            ON CONFLICT (user_id, image_id) DO NOTHING
+        )
+        SELECT image_id INTO last_id FROM batch ORDER BY image_id DESC LIMIT 1;
+        EXIT WHEN NOT FOUND;
+        COMMIT;
+    END LOOP;
+END $$;
+
+-- Swap under a short exclusive lock, first fixing rows a batch copied after a concurrent delete
+DO $$
+BEGIN
+    IF (SELECT relkind FROM pg_class WHERE oid = 'generations'::regclass) = 'p' THEN
+        RETURN;
+    END IF;
+
+    LOCK TABLE generations, generation_blobs IN ACCESS EXCLUSIVE MODE;
+
+    DELETE FROM generations_partitioned n
+    WHERE NOT EXISTS (SELECT 1 FROM generations o WHERE o.image_id = n.image_id);
+
+    INSERT INTO generations_partitioned (image_id, user_id, yourself_image_id, clothing_image_id, preview_bytes, faved, created_at)
+    SELECT o.image_id, o.user_id, o.yourself_image_id, o.clothing_image_id, o.preview_bytes, o.faved, o.created_at FROM generations o
+    WHERE NOT EXISTS (
+        SELECT 1 FROM generations_partitioned n
+        WHERE n.user_id = o.user_id AND n.image_id = o.image_id
+    );
+
+    INSERT INTO generation_blobs_partitioned (image_id, user_id, image_bytes)
+    SELECT o.image_id, o.user_id, o.image_bytes FROM generation_blobs o
+    WHERE NOT EXISTS (
+        SELECT 1 FROM generation_blobs_partitioned n
+        WHERE n.user_id = o.user_id AND n.image_id = o.image_id
+    );
+
+    DROP TRIGGER mirror_generations ON generations;
+    DROP TRIGGER mirror_generation_blobs ON generation_blobs;
+
+    ALTER TABLE generation_blobs RENAME TO generation_blobs_old;
+    ALTER TABLE generations RENAME TO generations_old;
+    ALTER TABLE generations_partitioned RENAME TO generations;
+    ALTER TABLE generation_blobs_partitioned RENAME TO generation_blobs;
+END $$;
+
+DROP TABLE IF EXISTS generation_blobs_old;
+DROP TABLE IF EXISTS generations_old;
+DROP FUNCTION IF EXISTS mirror_generations();
+DROP FUNCTION IF EXISTS mirror_generation_blobs();
+ALTER INDEX IF EXISTS generations_partitioned_user_created_idx RENAME TO idx_generations_user_created;
@@ -0,0 +1,2 @@
+-- Set when the full-size blob has been moved from generation_blobs to the cold tier
+ALTER TABLE generations ADD COLUMN IF NOT EXISTS archived_at TIMESTAMP DEFAULT NULL;
@@ -0,0 +1,32 @@
+-- migrate: no-transaction
+-- sha256 of the uploaded bytes for exact dedup, 64-bit dHash of the preview for near-duplicate warnings
+ALTER TABLE images ADD COLUMN IF NOT EXISTS content_hash BYTEA DEFAULT NULL;
+ALTER TABLE images ADD COLUMN IF NOT EXISTS phash BIGINT DEFAULT NULL;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_images_user_content_hash ON images (user_id, content_hash);
+
+-- Existing uploads can be matched too; hashing happens in Postgres without shipping the blobs out.
+-- Committed batches, keyset-paginated on image_id, so no long transaction or lock covers the table
+DO $$
+DECLARE
+    last_id UUID := '00000000-0000-0000-0000-000000000000';
+BEGIN
+    LOOP
+        -- Blobs are multi-MB: keep batches small
+        WITH batch AS (
+            SELECT image_id FROM images
+            WHERE image_id > last_id
+            ORDER BY image_id
+            LIMIT 50
+        ), hashed AS (
+            UPDATE images i
+            SET content_hash = sha256(b.image_bytes)
+            FROM batch
+            JOIN image_blobs b ON b.image_id = batch.image_id
+            WHERE i.image_id = batch.image_id AND i.content_hash IS NULL
+        )
+        SELECT image_id INTO last_id FROM batch ORDER BY image_id DESC LIMIT 1;
+        EXIT WHEN NOT FOUND;
+        COMMIT;
+    END LOOP;
+END $$;
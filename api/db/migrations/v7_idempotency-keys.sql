@@ -0,0 +1,15 @@
+-- Outcome of requests sent with an Idempotency-Key, so client retries get the original
+-- result instead of running the model, the preview and the credit update again
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+    user_id UUID NOT NULL REFERENCES users(user_id) ON DELETE CASCADE,
+    idempotency_key VARCHAR(255) NOT NULL,
+    route VARCHAR(50) NOT NULL,
+    request_hash BYTEA NOT NULL,
+    -- NULL while the original request is still running
+    response JSONB,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    expires_at TIMESTAMP NOT NULL,
+    PRIMARY KEY (user_id, idempotency_key)
+);
+
+CREATE INDEX IF NOT EXISTS idx_idempotency_keys_expires_at ON idempotency_keys (expires_at);
@@ -0,0 +1,6 @@
+-- Size, CRC-32 and first bytes of the full-size image, recorded when it moves to the cold
+-- tier, so exports can lay out archived generations without reading them back.
+-- NULL for generations archived before this migration (python -m api.db.archive --backfill-info)
+ALTER TABLE generations ADD COLUMN IF NOT EXISTS archived_size INTEGER DEFAULT NULL;
+ALTER TABLE generations ADD COLUMN IF NOT EXISTS archived_crc BIGINT DEFAULT NULL;
+ALTER TABLE generations ADD COLUMN IF NOT EXISTS archived_head BYTEA DEFAULT NULL;
@@ -0,0 +1,176 @@
+from contextvars import ContextVar
+import logging
+import os
+import random
+import re
+import threading
+import time
+import psycopg2.extensions
+from ..functions.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Set by the Database method wrapper so statements are attributed to the method that ran them
+current_method: ContextVar = ContextVar("current_method", default=None)
+
+SLOW_QUERY_MS = float(os.getenv("DB_SLOW_QUERY_MS", 200))
+# Share of slow statements that get an EXPLAIN (ANALYZE, BUFFERS); 0 turns plan capture off
+SLOW_QUERY_EXPLAIN_RATE = float(os.getenv("DB_SLOW_QUERY_EXPLAIN_RATE", 0))
+# At most one plan per statement in this many seconds
+SLOW_QUERY_EXPLAIN_INTERVAL = float(os.getenv("DB_SLOW_QUERY_EXPLAIN_INTERVAL", 300))
+QUERY_STATS_MAX = int(os.getenv("DB_QUERY_STATS_MAX", 1000))
+
+UUID_PATTERN = re.compile(r"^[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}$")
+# Statements that can be re-run under EXPLAIN ANALYZE inside a savepoint
+EXPLAINABLE = ("select", "with", "insert", "update", "delete", "execute")
+
+
+def normalize(query):
+    query = query.decode() if isinstance(query, bytes) else str(query)
+    return " ".join(query.split())
+
+
+def sanitize(params):
+    """Parameters safe to log: ids, numbers and flags as they are, everything else by type and size"""
+    if params is None:
+        return None
+    if isinstance(params, dict):
+        return {key: sanitize_value(value) for key, value in params.items()}
+    return [sanitize_value(value) for value in params]
+
+
+def sanitize_value(value):
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    if isinstance(value, psycopg2.extensions.Binary):
+        value = value.adapted
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return f"<bytes {len(value)}>"
+    if isinstance(value, str):
+        return value if UUID_PATTERN.match(value) else f"<str {len(value)}>"
+    if isinstance(value, (list, tuple)):
+        return f"<{type(value).__name__} {len(value)}>"
+    return f"<{type(value).__name__}>"
+
+
+class QueryLog:
+    """Per-statement timing for everything the Database class executes.
+
+    Aggregates calls, total/max time, rows and slow calls per (method, statement);
+    statements slower than `slow_ms` are logged with sanitized parameters, and a
+    sample of them is re-run under EXPLAIN (ANALYZE, BUFFERS) inside a savepoint
+    so the plan that was slow is kept next to the stats. Per process.
+    """
+
+    def __init__(self, slow_ms, explain_rate, explain_interval, max_entries):
+        self.slow_ms = slow_ms
+        self.explain_rate = explain_rate
+        self.explain_interval = explain_interval
+        self.max_entries = max_entries
+        self._stats = {}
+        self._lock = threading.Lock()
+        self.since = time.time()
+
+    def record(self, cursor, query, params, elapsed, failed):
+        method = current_method.get() or "-"
+        statement = normalize(query)
+        ms = elapsed * 1000
+        rows = max(cursor.rowcount, 0)
+        slow = ms >= self.slow_ms
+
+        with self._lock:
+            entry = self._stats.get((method, statement))
+            if entry is None:
+                if len(self._stats) >= self.max_entries:
+                    metrics.inc("db_query_stats_overflow_total")
+                else:
+                    entry = self._stats[(method, statement)] = {
+                        "calls": 0, "errors": 0, "slow_calls": 0, "total_ms": 0.0, "max_ms": 0.0,
+                        "rows": 0, "plan": None, "plan_captured_at": 0.0
+                    }
+            if entry is not None:
+                entry["calls"] += 1
+                entry["errors"] += failed
+                entry["slow_calls"] += slow
+                entry["total_ms"] += ms
+                entry["max_ms"] = max(entry["max_ms"], ms)
+                entry["rows"] += rows
+
+        metrics.observe("db_statement_seconds", elapsed)
+        if not slow:
+            return
+
+        metrics.inc("db_slow_statements_total")
+        logger.warning(
+            f"slow query | {method} | {ms:.1f} ms | {rows} rows | {statement[:500]} | params {sanitize(params)}"
+        )
+        if not failed and entry is not None and self._should_explain(entry, statement, cursor):
+            plan = self.explain(cursor.connection, query, params)
+            if plan:
+                with self._lock:
+                    entry["plan"] = plan
+                logger.warning(f"slow query plan | {method} | {statement[:200]}\n{plan}")
+
+    def _should_explain(self, entry, statement, cursor):
+        if self.explain_rate <= 0 or random.random() >= self.explain_rate:
+            return False
+        # Named cursors stream results; re-running their statement would disturb the fetch
+        if cursor.name is not None or not statement.lower().startswith(EXPLAINABLE):
+            return False
+        if cursor.connection.autocommit and not statement.lower().startswith("select"):
+            return False
+        now = time.monotonic()
+        with self._lock:
+            if now - entry["plan_captured_at"] < self.explain_interval:
+                return False
+            entry["plan_captured_at"] = now
+        return True
+
+    def explain(self, conn, query, params):
+        """Re-run the statement under EXPLAIN ANALYZE; the savepoint undoes any writes it makes"""
+        # Plain cursor: its statements must not be recorded (or explained) again
+        cursor = psycopg2.extensions.cursor(conn)
+        savepoint = not conn.autocommit
+        try:
+            if savepoint:
+                cursor.execute("SAVEPOINT slow_query_explain")
+            cursor.execute(f"EXPLAIN (ANALYZE, BUFFERS) {query}", params)
+            plan = "\n".join(line for (line,) in cursor.fetchall())
+            metrics.inc("db_slow_statement_plans_total")
+            return plan
+        except Exception as e:
+            logger.warning(f"slow query explain failed | {type(e).__name__}: {str(e)}")
+            return None
+        finally:
+            try:
+                if savepoint:
+                    cursor.execute("ROLLBACK TO SAVEPOINT slow_query_explain")
+                    cursor.execute("RELEASE SAVEPOINT slow_query_explain")
+            finally:
+                cursor.close()
+
+    def snapshot(self, sort="total_ms", limit=50):
+        with self._lock:
+            entries = [
+                {"method": method, "statement": statement, **{k: v for k, v in entry.items() if k != "plan_captured_at"}}
+                for (method, statement), entry in self._stats.items()
+            ]
+        for entry in entries:
+            entry["mean_ms"] = round(entry["total_ms"] / entry["calls"], 3) if entry["calls"] else 0.0
+            entry["total_ms"] = round(entry["total_ms"], 3)
+            entry["max_ms"] = round(entry["max_ms"], 3)
+        entries.sort(key=lambda entry: entry.get(sort, 0), reverse=True)
+        return {
+            "since": self.since,
+            "slow_ms": self.slow_ms,
+            "statements": len(entries),
+            "queries": entries[:limit]
+        }
+
+    def reset(self):
+        with self._lock:
+            self._stats = {}
+        self.since = time.time()
+
+
+query_log = QueryLog(SLOW_QUERY_MS, SLOW_QUERY_EXPLAIN_RATE, SLOW_QUERY_EXPLAIN_INTERVAL, QUERY_STATS_MAX)
@@ -0,0 +1,215 @@
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import time
+import psycopg2
+from pathlib import Path
+from psycopg2.extras import execute_values
+from .database import Database
+from ..functions.cold_storage import cold_tier
+from ..functions.image_functions import ImageFunctions
+
+
+logger = logging.getLogger(__name__)
+
+# Keyset-paginated on an indexed key so every chunk is an index range scan
+TABLES = {
+    "images": {
+        "key": ("image_id",),
+        "start": ["00000000-0000-0000-0000-000000000000"],
+        "select": """
+            SELECT i.image_id, i.user_id, b.image_bytes
+            FROM images i
+            JOIN image_blobs b ON b.image_id = i.image_id
+            WHERE i.image_id > %s
+            ORDER BY i.image_id
+            LIMIT %s
+        """,
+        "update": """
+            UPDATE images AS i
+            SET preview_bytes = v.preview_bytes, phash = v.phash
+            FROM (VALUES %s) AS v(image_id, preview_bytes, phash)
+            WHERE i.image_id = v.image_id::uuid
+        """,
+    },
+    "generations": {
+        "key": ("user_id", "image_id"),
+        "start": ["00000000-0000-0000-0000-000000000000", "00000000-0000-0000-0000-000000000000"],
+        # Archived generations have no blob row; their bytes come from the cold tier
+        "select": """
+            SELECT g.image_id, g.user_id, b.image_bytes
+            FROM generations g
+            LEFT JOIN generation_blobs b ON b.user_id = g.user_id AND b.image_id = g.image_id
+            WHERE (g.user_id, g.image_id) > (%s, %s)
+            ORDER BY g.user_id, g.image_id
+            LIMIT %s
+        """,
+        "update": """
+            UPDATE generations AS g
+            SET preview_bytes = v.preview_bytes
+            FROM (VALUES %s) AS v(user_id, image_id, preview_bytes)
+            WHERE g.user_id = v.user_id::uuid AND g.image_id = v.image_id::uuid
+        """,
+    },
+}
+
+_imgf = None
+
+
+def _init_worker():
+    global _imgf
+    # Only the preview and hash code runs here: no model client (nor GEMINI_API_KEY) needed
+    os.environ["IMAGE_BACKEND"] = "simulated"
+    os.environ["MODEL_INPUT_CACHE"] = "false"
+    _imgf = ImageFunctions()
+
+
+def _render(job):
+    """Runs in a pool process: (table, image_id, user_id, image_bytes) -> (image_id, user_id, preview, phash, error)"""
+    table, image_id, user_id, image_bytes = job
+    try:
+        if image_bytes is None:
+            if not cold_tier:
+                raise Exception("Full-size image is archived but COLD_STORAGE_DIR is not set")
+            image_bytes = cold_tier.fetch(user_id, image_id)
+        preview_bytes = _imgf.create_preview(image_bytes)
+        phash = _imgf.perceptual_hash(preview_bytes) if table == "images" else None
+        return image_id, user_id, preview_bytes, phash, None
+    except Exception as e:
+        return image_id, user_id, None, None, f"{type(e).__name__}: {str(e)}"
+
+
+class PreviewRegenerator:
+    """Re-renders stored previews with the current ImageFunctions settings.
+
+    Reads through short-lived server-side cursors (one per chunk, so no snapshot
+    stays open for the whole run), renders in a process pool and writes each batch
+    with one UPDATE. The last committed key per table goes to a checkpoint file,
+    so an interrupted run picks up where it stopped.
+    """
+
+    def __init__(self, workers, batch_size, chunk_size, max_rows_per_sec, checkpoint_path):
+        self.db_config = Database._config()
+        self.workers = workers
+        self.batch_size = batch_size
+        self.chunk_size = chunk_size
+        self.max_rows_per_sec = max_rows_per_sec
+        self.checkpoint_path = Path(checkpoint_path)
+        self.checkpoint = {}
+
+    def load_checkpoint(self, restart):
+        if restart or not self.checkpoint_path.exists():
+            self.checkpoint = {}
+            return
+        self.checkpoint = json.loads(self.checkpoint_path.read_text())
+        logger.info(f"Resuming from {self.checkpoint_path}")
+
+    def save_checkpoint(self):
+        # Write then rename so an interrupt never leaves a truncated checkpoint
+        tmp_path = self.checkpoint_path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(self.checkpoint, indent=2))
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def run(self, tables):
+        # Pool first: forked workers must not inherit (and later close) the DB sockets
+        pool = multiprocessing.Pool(self.workers, initializer=_init_worker)
+        read_conn = psycopg2.connect(**self.db_config)
+        read_conn.set_session(readonly=True)
+        write_conn = psycopg2.connect(**self.db_config)
+        try:
+            for table in tables:
+                self.regenerate_table(table, read_conn, write_conn, pool)
+        finally:
+            pool.terminate()
+            read_conn.close()
+            write_conn.close()
+
+    def regenerate_table(self, table, read_conn, write_conn, pool):
+        config = TABLES[table]
+        state = self.checkpoint.setdefault(table, {"after": config["start"], "updated": 0, "failed": 0, "done": False})
+        if state["done"]:
+            logger.info(f"✓ {table}: already done ({state['updated']} updated, {state['failed']} failed)")
+            return
+
+        started = time.monotonic()
+        processed = 0
+        write_cursor = write_conn.cursor()
+        while True:
+            # Named cursor: rows stream from the server in batches instead of the whole chunk at once
+            with read_conn:
+                read_cursor = read_conn.cursor(name=f"regenerate_{table}")
+                read_cursor.itersize = self.batch_size
+                read_cursor.execute(config["select"], (*state["after"], self.chunk_size))
+
+                chunk_rows = 0
+                while rows := read_cursor.fetchmany(self.batch_size):
+                    chunk_rows += len(rows)
+                    jobs = [(table, str(image_id), str(user_id), bytes(image_bytes) if image_bytes is not None else None)
+                            for image_id, user_id, image_bytes in rows]
+                    results = pool.map(_render, jobs)
+
+                    if table == "images":
+                        values = [(image_id, psycopg2.Binary(preview), phash) for image_id, _, preview, phash, error in results if not error]
+                    else:
+                        values = [(user_id, image_id, psycopg2.Binary(preview)) for image_id, user_id, preview, _, error in results if not error]
+                    for image_id, user_id, _, _, error in results:
+                        if error:
+                            logger.error(f"✗ {table} {image_id} (user {user_id}): {error}")
+
+                    if values:
+                        execute_values(write_cursor, config["update"], values, page_size=len(values))
+                    write_conn.commit()
+
+                    last = rows[-1]
+                    state["after"] = [str(last[1]), str(last[0])] if len(config["key"]) == 2 else [str(last[0])]
+                    state["updated"] += len(values)
+                    state["failed"] += len(rows) - len(values)
+                    self.save_checkpoint()
+
+                    processed += len(rows)
+                    elapsed = time.monotonic() - started
+                    logger.info(f"{table}: {state['updated']} updated, {state['failed']} failed, {processed / elapsed:.1f} rows/s")
+                    self.throttle(processed, elapsed)
+
+                read_cursor.close()
+
+            if chunk_rows < self.chunk_size:
+                break
+
+        state["done"] = True
+        self.save_checkpoint()
+        logger.info(f"✓ {table}: {state['updated']} updated, {state['failed']} failed")
+
+    def throttle(self, processed, elapsed):
+        # Stay under the row rate so production traffic keeps its share of the DB
+        if self.max_rows_per_sec > 0:
+            ahead = processed / self.max_rows_per_sec - elapsed
+            if ahead > 0:
+                time.sleep(ahead)
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    parser = argparse.ArgumentParser(description="Re-render stored previews with the current preview settings")
+    parser.add_argument("--tables", nargs="+", choices=list(TABLES), default=list(TABLES))
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) - 1))
+    parser.add_argument("--batch-size", type=int, default=32, help="rows rendered and updated together")
+    parser.add_argument("--chunk-size", type=int, default=1000, help="rows read per server-side cursor")
+    parser.add_argument("--max-rows-per-sec", type=float, default=50, help="0 for no limit")
+    parser.add_argument("--checkpoint", default="preview_regeneration.json")
+    parser.add_argument("--restart", action="store_true", help="ignore an existing checkpoint")
+    args = parser.parse_args()
+
+    regenerator = PreviewRegenerator(args.workers, args.batch_size, args.chunk_size, args.max_rows_per_sec, args.checkpoint)
+    regenerator.load_checkpoint(args.restart)
+    try:
+        regenerator.run(args.tables)
+    except KeyboardInterrupt:
+        logger.info(f"Interrupted; rerun to resume from {args.checkpoint}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,79 @@
 from fastapi import APIRouter, Request, HTTPException, Depends
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from starlette.concurrency import iterate_in_threadpool, run_in_threadpool
 from google.oauth2 import id_token
 from google.auth.transport import requests as google_requests
+import asyncio
 import base64
+import hashlib
+import hmac
+import json
 import logging
 import requests
 import jwt
 import os
+import struct
+import time
+import uuid
 from datetime import datetime, timedelta, timezone
-from .db.database import Database
+from .db.database import Database, decode_page_cursor
+from .db.idempotency import IDEMPOTENCY_TTL
+from .db.query_log import query_log
+from .db.export import EXPORT_CURSOR_ROWS, GalleryExport
 from .functions.image_functions import ImageFunctions
+from .functions.admission import AdmissionController, AdmissionRejected
+from .functions.metrics import metrics
+from .functions.cold_storage import cold_tier
+from .functions.image_pool import image_pool
+from .functions.loop_lag import loop_lag
+from .functions.memory_budget import memory_budget
+from .functions.structured_logging import set_request_user
+from .functions.tracing import tracer
+from .functions.resilience import CircuitOpenError, DeadlineExceeded
+from .functions.variant_cache import variant_cache
+from .functions.worker_limits import per_worker
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
 imgf = ImageFunctions()
 
+admission = AdmissionController()
+
+# Batch generation limits
+generation_batch_max = int(os.getenv("GENERATION_BATCH_MAX", 6))
+
+bootstrap_page_size = int(os.getenv("BOOTSTRAP_PAGE_SIZE", 24))
+# Largest page /get_image_previews and /get_generation_previews hand out
+preview_page_max = int(os.getenv("PREVIEW_PAGE_MAX", 100))
+
+# /get_full_images: ids per request and total image bytes per response
+full_images_batch_max = int(os.getenv("FULL_IMAGES_BATCH_MAX", 50))
+full_images_max_bytes = int(os.getenv("FULL_IMAGES_MAX_MB", 64)) * 1024 * 1024
+
+# Gallery exports each hold a DB connection (outside the pool) for the whole download.
+# EXPORT_MAX_CONCURRENT is the deployment-wide total, so max_connections must allow for it
+export_max_concurrent = per_worker(os.getenv("EXPORT_MAX_CONCURRENT", 2))
+exports_in_flight = 0
+
+# Max differing dHash bits for an upload to be flagged as a near-duplicate
+near_duplicate_distance = int(os.getenv("NEAR_DUPLICATE_DISTANCE", 6))
+
+# Uploads: decoded image size limit, and the matching JSON body size (base64 is 4/3 of it)
+upload_max_bytes = 6 * 1024 * 1024
+upload_body_max_bytes = upload_max_bytes * 4 // 3 + 64 * 1024
+# Memory a generation holds beyond its source images: model output, bitmaps, re-encode
+generation_memory_overhead = int(os.getenv("GENERATION_MEMORY_MB", 24)) * 1024 * 1024
+
+# /ready reports not-ready past these
+ready_max_loop_lag = float(os.getenv("READY_MAX_LOOP_LAG", 0.5))
+ready_max_db_pool_utilisation = float(os.getenv("READY_MAX_DB_POOL_UTILISATION", 0.9))
+ready_max_image_queue = int(os.getenv("READY_MAX_IMAGE_QUEUE", image_pool.max_workers * 4))
+
+# How long a retry waits for the original request before getting a 409
+idempotency_wait = float(os.getenv("IDEMPOTENCY_WAIT", 30))
+# A key still pending after this is taken to be abandoned (worker died) and can be reclaimed
+idempotency_pending_timeout = imgf.request_budget + 30
+
 
 def verify_jwt_token(request: Request) -> str:
     auth_token = request.cookies.get("authToken")
@@ -25,13 +84,15 @@ def verify_jwt_token(request: Request) -> str:
 
     try:
         secret_key = os.getenv("JWT_SECRET_KEY")
-        payload = jwt.decode(auth_token, secret_key, algorithms=["HS256"])
+        with tracer.span("jwt.verify"):
+            payload = jwt.decode(auth_token, secret_key, algorithms=["HS256"])
         user_id = payload.get("user_id")
 
         if not user_id:
             logger.warning("No user_id in token payload")
             raise HTTPException(status_code=401, detail="Invalid token")
 
+        set_request_user(user_id)
         return user_id
     except jwt.ExpiredSignatureError:
         logger.warning("Token expired")
@@ -40,14 +101,218 @@ def verify_jwt_token(request: Request) -> str:
         logger.error(f"Invalid token: {e}")
         raise HTTPException(status_code=401, detail="Invalid token")
 
+def verify_admin_token(request: Request):
+    # Admin routes are off unless ADMIN_TOKEN is set; callers send it in X-Admin-Token
+    admin_token = os.getenv("ADMIN_TOKEN")
+    if not admin_token:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not hmac.compare_digest(request.headers.get("X-Admin-Token", ""), admin_token):
+        raise HTTPException(status_code=403, detail="Forbidden")
+
+def rate_limited(rejection: AdmissionRejected) -> HTTPException:
+    return HTTPException(
+        status_code=429,
+        detail=rejection.reason,
+        headers={"Retry-After": str(rejection.retry_after)}
+    )
+
+def admit_generation(user_id: str, cost: int = 1):
+    # In memory only: called before the DB is touched so overload is shed cheaply.
+    # The returned Admission must be released on every path
+    try:
+        return admission.admit(user_id, cost)
+    except AdmissionRejected as e:
+        raise rate_limited(e)
+
+async def begin_idempotent(request: Request, user_id: str, route: str, body: bytes):
+    """Claim the request's Idempotency-Key, or wait for the original request and return its response.
+
+    `body` is the raw request body, hashed to tell a retry from a different request.
+    Returns (key, response): key is None without the header, response is set for a replay.
+    """
+    idempotency_key = request.headers.get("Idempotency-Key")
+    if not idempotency_key:
+        return None, None
+    if len(idempotency_key) > 255:
+        raise HTTPException(status_code=400, detail="Idempotency-Key is too long")
+
+    request_hash = hashlib.sha256(body).digest()
+    give_up_at = time.monotonic() + idempotency_wait
+    while True:
+        with Database() as db:
+            existing = db.claim_idempotency_key(
+                user_id,
+                idempotency_key,
+                route,
+                request_hash,
+                IDEMPOTENCY_TTL,
+                idempotency_pending_timeout
+                )
+
+        if existing and existing["claimed"]:
+            return idempotency_key, None
+
+        if existing:
+            if existing["route"] != route or existing["request_hash"] != request_hash:
+                raise HTTPException(status_code=422, detail="Idempotency-Key was already used for a different request")
+            if existing["response"] is not None:
+                metrics.inc("idempotent_replays_total")
+                return idempotency_key, existing["response"]
+
+        if time.monotonic() >= give_up_at:
+            raise HTTPException(
+                status_code=409,
+                detail="A request with this Idempotency-Key is still in progress",
+                headers={"Retry-After": "5"}
+            )
+        await asyncio.sleep(0.5)
+
+def complete_idempotent(db: Database, user_id: str, idempotency_key, response: dict):
+    # Called inside the block that does the write, so the key's response commits with it
+    if idempotency_key:
+        db.complete_idempotency_key(user_id, idempotency_key, response)
+
+def release_idempotent(user_id: str, idempotency_key):
+    # Called on the failure path, so it must not replace the original error
+    if not idempotency_key:
+        return
+    try:
+        with Database() as db:
+            db.release_idempotency_key(user_id, idempotency_key)
+    except Exception as e:
+        logger.error(f"release_idempotent | {user_id} | {type(e).__name__}: {str(e)}", exc_info=True)
+
+async def reserve_memory(nbytes: int) -> int:
+    try:
+        return await memory_budget.acquire(nbytes)
+    except AdmissionRejected as e:
+        raise rate_limited(e)
+
+async def reserve_upload_memory(request: Request):
+    # Runs before the body is read. The body is dropped once parsed (see read_body), so at
+    # most two copies coexist: body and base64 string, then base64 string and decoded bytes.
+    # The preview's bitmap is reserved separately, once its size is known from the header
+    content_length = int(request.headers.get("content-length") or upload_body_max_bytes)
+    if content_length > upload_body_max_bytes:
+        raise HTTPException(status_code=413, detail="Image file size exceeds 5MB limit")
+    reserved = await reserve_memory(content_length * 2)
+    try:
+        yield
+    finally:
+        await memory_budget.release(reserved)
+
+async def read_body(request: Request, max_bytes: int) -> bytearray:
+    """The request body, read without caching it on the request.
+
+    request.body() keeps its result on the request until the response is sent, so the
+    caller couldn't free it after parsing. Enforces max_bytes even without a Content-Length.
+    """
+    body = bytearray()
+    async for chunk in request.stream():
+        body += chunk
+        if len(body) > max_bytes:
+            raise HTTPException(status_code=413, detail="Image file size exceeds 5MB limit")
+    return body
+
+def base64_json_response(content: dict, field: str, raw, status_code: int = 200, headers: dict = None) -> Response:
+    """JSON response with one large base64 field, encoded straight into the body.
+
+    Skips the str copy of the base64 text and JSONResponse's re-serialisation of it.
+    """
+    head = json.dumps(content)[:-1] + (", " if content else "") + f'"{field}": "'
+    with tracer.span("base64.encode", bytes=len(raw)):
+        body = b"".join((head.encode(), base64.b64encode(raw), b'"}'))
+    return Response(content=body, status_code=status_code, media_type="application/json", headers=headers)
+
+class CleanupStreamingResponse(StreamingResponse):
+    """StreamingResponse that always runs `cleanup` once the response is over.
+
+    Starlette never starts the body generator when the client disconnects before
+    the first chunk, so releases in the generator's own finally can be skipped.
+    The generator is closed first, so its finally (if it started) runs before cleanup.
+    """
+
+    def __init__(self, content, cleanup, **kwargs):
+        super().__init__(content, **kwargs)
+        self.cleanup = cleanup
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            try:
+                await self.body_iterator.aclose()
+            finally:
+                await self.cleanup()
+
+def idempotent_replay(content: dict) -> JSONResponse:
+    return JSONResponse(
+        content=content,
+        status_code=200,
+        headers={"Idempotent-Replayed": "true"}
+    )
+
 @router.get("/health")
 async def health_check():
+    # Liveness only: answering at all is the check, so it stays trivial
     logger.log(msg='Working Fine!', level=1)
     return JSONResponse(
         content={"status": "healthy", "service": "Unmarble API"},
         status_code=200
     )
 
+@router.get("/ready")
+async def readiness_check():
+    # In-process state only, cheap enough for frequent load balancer probes
+    db_pool = Database._pool
+    signals = {
+        "event_loop_lag_seconds": round(loop_lag.peak(), 3),
+        "db_pool_utilisation": round(db_pool.in_use / db_pool.max_size, 3) if db_pool else 0.0,
+        "image_pool_queue_depth": image_pool.queued,
+        "generations_in_flight": admission.in_flight,
+        "generations_waiting": admission.queued
+    }
+
+    failing = []
+    if signals["event_loop_lag_seconds"] > ready_max_loop_lag:
+        failing.append("event_loop_lag")
+    if signals["db_pool_utilisation"] >= ready_max_db_pool_utilisation:
+        failing.append("db_pool")
+    if signals["image_pool_queue_depth"] > ready_max_image_queue:
+        failing.append("image_pool")
+    if admission.queued >= admission.max_queue:
+        failing.append("generation_queue")
+
+    return JSONResponse(
+        content={"status": "not_ready" if failing else "ready", "failing": failing, **signals},
+        status_code=503 if failing else 200
+    )
+
+@router.get("/metrics")
+async def get_metrics():
+    return JSONResponse(
+        content=metrics.snapshot(),
+        status_code=200
+    )
+
+@router.get("/admin/query_stats", dependencies=[Depends(verify_admin_token)])
+async def get_query_stats(sort: str = "total_ms", limit: int = 50):
+    # Per worker process: each worker keeps its own stats
+    if sort not in ("total_ms", "mean_ms", "max_ms", "calls", "slow_calls", "rows", "errors"):
+        raise HTTPException(status_code=400, detail="Invalid sort")
+    return JSONResponse(
+        content={"pid": os.getpid(), **query_log.snapshot(sort, limit)},
+        status_code=200
+    )
+
+@router.post("/admin/query_stats/reset", dependencies=[Depends(verify_admin_token)])
+async def reset_query_stats():
+    query_log.reset()
+    return JSONResponse(
+        content={"pid": os.getpid(), "reset": True},
+        status_code=200
+    )
+
 @router.post("/get_user")
 async def get_user(user_id: str = Depends(verify_jwt_token)):
     try:
@@ -82,6 +347,72 @@ async def get_previews(user_id: str = Depends(verify_jwt_token)):
         logger.error(f"get_previews | {user_id} | {type(e).__name__}: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
 
+async def preview_page_request(request: Request):
+    """(page_size, cursor) from an optional {"limit": ..., "cursor": ...} body; 400 when malformed"""
+    body = await request.body()
+    try:
+        data = json.loads(body) if body else {}
+        page_size = min(max(int(data.get("limit") or bootstrap_page_size), 1), preview_page_max)
+        cursor = decode_page_cursor(data["cursor"]) if data.get("cursor") else None
+    except (AttributeError, TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid limit or cursor")
+    return page_size, cursor
+
+@router.post("/get_image_previews")
+async def get_image_previews(request: Request, user_id: str = Depends(verify_jwt_token)):
+    """Upload previews a page at a time, continuing from /bootstrap's next_images_cursor"""
+    try:
+        page_size, cursor = await preview_page_request(request)
+        with Database() as db:
+            result = db.get_preview_images_page(user_id, page_size, cursor)
+
+        return JSONResponse(
+            content=result,
+            status_code=200,
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"get_image_previews | {user_id} | {type(e).__name__}: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/get_generation_previews")
+async def get_generation_previews(request: Request, user_id: str = Depends(verify_jwt_token)):
+    """Generation previews a page at a time, continuing from /bootstrap's next_generations_cursor"""
+    try:
+        page_size, cursor = await preview_page_request(request)
+        with Database() as db:
+            result = db.get_preview_generations_page(user_id, page_size, cursor)
+
+        return JSONResponse(
+            content=result,
+            status_code=200,
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"get_generation_previews | {user_id} | {type(e).__name__}: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/bootstrap")
+async def bootstrap(user_id: str = Depends(verify_jwt_token)):
+    try:
+        with Database() as db:
+            result = db.get_bootstrap(user_id, bootstrap_page_size)
+
+        if not result:
+            raise HTTPException(status_code=404, detail="User not found")
+
+        return JSONResponse(
+            content=result,
+            status_code=200,
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"bootstrap | {user_id} | {type(e).__name__}: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e))
+
 @router.post("/get_full_image")
 async def get_full_image(request: Request, user_id: str = Depends(verify_jwt_token)):
     try:
@@ -93,14 +424,8 @@ async def get_full_image(request: Request, user_id: str = Depends(verify_jwt_tok
                 user_id,
                 image_id
                 )
-            image_base64 = base64.b64encode(image_bytes).decode('utf-8')
 
-        return JSONResponse(
-            content={
-                "image_base64": image_base64,
-            },
-            status_code=200,
-        )
+        return base64_json_response({}, "image_base64", image_bytes)
     except Exception as e:
         logger.error(f"get_full_image | {user_id} | {type(e).__name__}: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
@@ -116,53 +441,384 @@ async def get_full_generated_image(request: Request, user_id: str = Depends(veri
                 user_id,
                 image_id
                 )
-            image_base64 = base64.b64encode(image_bytes).decode('utf-8')
 
-        return JSONResponse(
-            content={
-                "image_base64": image_base64,
-            },
-            status_code=200,
-        )
+        return base64_json_response({}, "image_base64", image_bytes)
     except Exception as e:
         logger.error(f"get_full_generated_image | {user_id} | {type(e).__name__}: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
+
+def image_frame(image_id: str, kind: str, image_bytes) -> bytes:
+    """Frame header: 4-byte big-endian header length, then a JSON header; `length` payload bytes follow"""
+    header = json.dumps({
+        "image_id": image_id,
+        "kind": kind,
+        "status": 200 if image_bytes is not None else 404,
+        "length": len(image_bytes) if image_bytes is not None else 0
+    }).encode()
+    return struct.pack(">I", len(header)) + header
+
+@router.post("/get_full_images")
+async def get_full_images(request: Request, user_id: str = Depends(verify_jwt_token)):
+    """Full-size images and generations in one response, in request order.
+
+    Body: {"images": [{"image_id": ..., "kind": "image" | "generation"}, ...]}. The
+    response is a stream of frames (see image_frame); ids that aren't found get a
+    404 frame with no payload so positions still line up.
+    """
+    reserved = 0
+    try:
+        data = await request.json()
+        items = data.get("images") or []
+
+        if not items:
+            raise HTTPException(status_code=400, detail="At least one image is required")
+        if len(items) > full_images_batch_max:
+            raise HTTPException(status_code=400, detail=f"Cannot fetch more than {full_images_batch_max} images at once")
+
+        requested = []
+        for item in items:
+            kind = item.get("kind") if isinstance(item, dict) else None
+            if kind not in ("image", "generation"):
+                raise HTTPException(status_code=400, detail="kind must be image or generation")
+            try:
+                image_id = str(uuid.UUID(str(item.get("image_id"))))
+            except ValueError:
+                raise HTTPException(status_code=400, detail="Invalid image id")
+            requested.append((kind, image_id))
+
+        image_ids = {image_id for kind, image_id in requested if kind == "image"}
+        generation_ids = {image_id for kind, image_id in requested if kind == "generation"}
+        too_large = HTTPException(
+            status_code=413,
+            detail=f"Requested images exceed {full_images_max_bytes // (1024 * 1024)}MB; request fewer at once"
+        )
+
+        # Sizes first, from stored lengths, so only what the response holds is reserved
+        with Database() as db:
+            total_bytes, unknown = db.get_full_images_size(
+                user_id,
+                image_ids,
+                generation_ids
+                )
+        if total_bytes > full_images_max_bytes:
+            raise too_large
+        # Generations archived without a recorded size could be anything up to the cap
+        fetch_bytes = full_images_max_bytes if unknown else total_bytes
+
+        # Held until the response is over
+        reserved = await reserve_memory(fetch_bytes)
+
+        images, generations = {}, {}
+        with Database() as db:
+            if image_ids:
+                images = db.get_full_images(
+                    user_id,
+                    image_ids,
+                    fetch_bytes
+                    )
+            if images is not None and generation_ids:
+                generations = db.get_full_generated_images(
+                    user_id,
+                    generation_ids,
+                    fetch_bytes - sum(len(image_bytes) for image_bytes in images.values())
+                    )
+
+        if images is None or generations is None:
+            raise too_large
+    except HTTPException:
+        await memory_budget.release(reserved)
+        raise
+    except Exception as e:
+        await memory_budget.release(reserved)
+        logger.error(f"get_full_images | {user_id} | {type(e).__name__}: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e))
+
+    async def stream_frames():
+        for kind, image_id in requested:
+            image_bytes = (images if kind == "image" else generations).get(image_id)
+            yield image_frame(image_id, kind, image_bytes)
+            if image_bytes is not None:
+                # Payload goes out as the buffer psycopg2 returned, without a copy
+                yield image_bytes
+
+    async def release():
+        # Also runs when the client left before the first frame and stream_frames never started
+        await memory_budget.release(reserved)
+
+    return CleanupStreamingResponse(
+        stream_frames(),
+        release,
+        media_type="application/octet-stream",
+        headers={"X-Image-Count": str(len(requested))}
+    )
+
+def parse_range(range_header: str, size: int):
+    """Inclusive (start, end) of a single bytes range, None to send everything, or "unsatisfiable" for a 416"""
+    unit, _, spec = (range_header or "").partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, _, last = spec.strip().partition("-")
+    try:
+        if not first:
+            # Suffix range: the last N bytes
+            length = int(last)
+            if length <= 0:
+                return "unsatisfiable"
+            return max(size - length, 0), size - 1
+        start = int(first)
+        end = int(last) if last else size - 1
+    except ValueError:
+        return None
+    if start >= size:
+        return "unsatisfiable"
+    if start > end:
+        return None
+    return start, min(end, size - 1)
+
+@router.get("/export_gallery")
+async def export_gallery(request: Request, user_id: str = Depends(verify_jwt_token)):
+    """All of the user's uploads and generations as a ZIP, streamed as it is read.
+
+    Entries are stored uncompressed (the images already are compressed), so the
+    size and every byte offset are known up front: the response has a
+    Content-Length, and Range/If-Range requests resume an interrupted download.
+    """
+    global exports_in_flight
+    if exports_in_flight >= export_max_concurrent:
+        raise HTTPException(status_code=429, detail="Too many exports in progress", headers={"Retry-After": "30"})
+
+    exports_in_flight += 1
+    reserved = 0
+    export = GalleryExport(user_id)
+    try:
+        reserved = await reserve_memory((EXPORT_CURSOR_ROWS + 1) * upload_max_bytes)
+        await run_in_threadpool(export.open)
+
+        headers = {
+            "Accept-Ranges": "bytes",
+            "ETag": export.etag,
+            "Content-Disposition": 'attachment; filename="unmarble-gallery.zip"',
+            "Cache-Control": "private, no-store"
+        }
+        status_code = 200
+        start, end = 0, export.size - 1
+
+        # A Range only applies to the same archive: If-Range must match the current ETag
+        byte_range = None
+        if request.headers.get("range") and request.headers.get("if-range", export.etag) == export.etag:
+            byte_range = parse_range(request.headers["range"], export.size)
+        if byte_range == "unsatisfiable":
+            raise HTTPException(status_code=416, detail="Range not satisfiable", headers={"Content-Range": f"bytes */{export.size}"})
+        if byte_range:
+            start, end = byte_range
+            status_code = 206
+            headers["Content-Range"] = f"bytes {start}-{end}/{export.size}"
+        headers["Content-Length"] = str(end - start + 1)
+    except HTTPException:
+        await run_in_threadpool(export.close)
+        await memory_budget.release(reserved)
+        exports_in_flight -= 1
+        raise
+    except Exception as e:
+        await run_in_threadpool(export.close)
+        await memory_budget.release(reserved)
+        exports_in_flight -= 1
+        logger.error(f"export_gallery | {user_id} | {type(e).__name__}: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e))
+
+    async def stream_zip():
+        chunks = export.chunks(start, end)
+        try:
+            # Each step reads from the server-side cursor in a worker thread
+            async for chunk in iterate_in_threadpool(chunks):
+                yield chunk
+            metrics.inc("gallery_exports_completed_total")
+        except Exception as e:
+            logger.error(f"export_gallery | {user_id} | {type(e).__name__}: {str(e)}", exc_info=True)
+            raise
+        finally:
+            await run_in_threadpool(chunks.close)
+
+    async def finish():
+        # Also runs when the client left before the first chunk and stream_zip never started
+        global exports_in_flight
+        try:
+            await run_in_threadpool(export.close)
+        finally:
+            await memory_budget.release(reserved)
+            exports_in_flight -= 1
+
+    return CleanupStreamingResponse(
+        stream_zip(),
+        finish,
+        status_code=status_code,
+        media_type="application/zip",
+        headers=headers
+    )
+
+def render_variant(user_id, image_id, width, image_format, ext, image_bytes):
+    variant_bytes = imgf.create_variant(image_bytes, width, image_format)
+    variant_cache.put(user_id, image_id, width, ext, variant_bytes)
+    return variant_bytes
+
+@router.get("/image_variant/{kind}/{image_id}")
+async def get_image_variant(kind: str, image_id: str, w: int, request: Request, user_id: str = Depends(verify_jwt_token)):
+    # GET so <img> tags can use it directly and browsers send a real Accept header
+    if kind not in ("image", "generation"):
+        raise HTTPException(status_code=404, detail="Unknown image kind")
+    if w not in imgf.variant_widths:
+        raise HTTPException(status_code=400, detail=f"Width must be one of {imgf.variant_widths}")
+    try:
+        # Also keeps the id safe to use as a cache path component
+        image_id = str(uuid.UUID(image_id))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid image id")
+
+    mime_type, image_format, ext = imgf.negotiate_variant_format(request.headers.get("accept"))
+    headers = {"Cache-Control": "private, max-age=86400", "Vary": "Accept, Cookie"}
+
+    try:
+        variant_bytes = variant_cache.get(user_id, image_id, w, ext)
+        if variant_bytes is not None:
+            return Response(content=variant_bytes, media_type=mime_type, headers=headers)
+
+        with Database() as db:
+            if kind == "image":
+                image_bytes = db.get_full_image(user_id, image_id)
+            else:
+                image_bytes = db.get_full_generated_image(user_id, image_id)
+
+        if image_bytes is None:
+            raise HTTPException(status_code=404, detail="Image not found")
+
+        variant_bytes = await image_pool.run(render_variant, user_id, image_id, w, image_format, ext, image_bytes)
+        return Response(content=variant_bytes, media_type=mime_type, headers=headers)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"get_image_variant | {user_id} | {type(e).__name__}: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e))
     
-@router.post("/upload_image")
+@router.post("/upload_image", dependencies=[Depends(reserve_upload_memory)])
 async def upload_image(request: Request, user_id: str = Depends(verify_jwt_token)):
+    body = await read_body(request, upload_body_max_bytes)
+    idempotency_key, replay = await begin_idempotent(request, user_id, "upload_image", body)
+    if replay is not None:
+        return idempotent_replay(replay)
+
+    completed = False
     try:
-        data = await request.json()
+        # The only reference to the body is this local, so it is freed as soon as it's parsed
+        data = json.loads(body)
+        del body
         category = data.get("category")
-        image_bytes = data.get("imageBytes")
+        with tracer.span("base64.decode") as span:
+            decoded_bytes = base64.b64decode(data.pop("imageBytes"))
+            span.set("bytes", len(decoded_bytes))
+        del data
 
-        decoded_bytes = base64.b64decode(image_bytes)
-
-        max_size_bytes = 6 * 1024 * 1024
-        if len(decoded_bytes) > max_size_bytes:
+        if len(decoded_bytes) > upload_max_bytes:
             raise HTTPException(
                 status_code=400,
                 detail="Image file size exceeds 5MB limit"
             )
 
-        preview_bytes = imgf.create_preview(image_bytes=decoded_bytes)
+        content_hash = hashlib.sha256(decoded_bytes).digest()
 
         with Database() as db:
-            result = db.insert_image(
+            duplicates = db.find_images_by_hash(
                 user_id,
-                category,
-                decoded_bytes,
-                preview_bytes
+                content_hash
                 )
 
-        return JSONResponse(
-            content={
+        # Same bytes already in this category: hand back the stored image, nothing is charged
+        existing = next((d for d in duplicates if d["category"] == category), None)
+        if existing:
+            metrics.inc("upload_dedup_hits_total")
+            metrics.inc("upload_dedup_bytes_saved_total", len(decoded_bytes) + len(existing["preview_bytes"]))
+            metrics.inc("upload_dedup_preview_seconds_saved_total", metrics.average("create_preview_seconds"))
+
+            content = {
+                "image_id": existing["image_id"],
+                "preview_base64": base64.b64encode(existing["preview_bytes"]).decode('utf-8'),
+                "created_at": existing["created_at"],
+                "uploads_left": existing["uploads_left"],
+                "deduplicated": True,
+                "near_duplicate_of": None
+            }
+            with Database() as db:
+                complete_idempotent(db, user_id, idempotency_key, content)
+            completed = True
+            return JSONResponse(
+                content=content,
+                status_code=200,
+            )
+
+        def upload_content(result, near_duplicate_of):
+            return {
                 "image_id": result["image_id"],
                 "preview_base64": result["preview_base64"],
                 "created_at": result["created_at"],
-                "uploads_left": result["uploads_left"]
-            },
+                "uploads_left": result["uploads_left"],
+                # Only the same-category path above hands back an existing row
+                "deduplicated": False,
+                "near_duplicate_of": near_duplicate_of
+            }
+
+        content = None
+        if duplicates:
+            # Same bytes in the other category: a new row, but preview and blob are copied
+            # server-side instead of decoded again. Saves the preview work, not storage
+            with Database() as db:
+                result = db.insert_image_copy(
+                    user_id,
+                    category,
+                    duplicates[0]["image_id"]
+                    )
+                if result:
+                    content = upload_content(result, None)
+                    complete_idempotent(db, user_id, idempotency_key, content)
+            if result:
+                metrics.inc("upload_preview_reused_total")
+                metrics.inc("upload_dedup_preview_seconds_saved_total", metrics.average("create_preview_seconds"))
+
+        if content is None:
+            # The decoded bitmap dwarfs the file for PNG/WEBP (width x height x 4)
+            try:
+                bitmap_bytes = imgf.preview_memory(decoded_bytes)
+            except Exception:
+                raise HTTPException(status_code=400, detail="Unsupported image format")
+            bitmap_reserved = await reserve_memory(bitmap_bytes)
+            try:
+                preview_bytes = await image_pool.run(imgf.create_preview, decoded_bytes)
+            finally:
+                await memory_budget.release(bitmap_reserved)
+            phash = imgf.perceptual_hash(preview_bytes)
+
+            with Database() as db:
+                near_duplicate_of = None
+                for other_image_id, other_phash in db.get_image_phashes(user_id, category):
+                    if imgf.hash_distance(phash, other_phash) <= near_duplicate_distance:
+                        near_duplicate_of = other_image_id
+                        break
+
+                result = db.insert_image(
+                    user_id,
+                    category,
+                    decoded_bytes,
+                    preview_bytes,
+                    content_hash,
+                    phash
+                    )
+                content = upload_content(result, near_duplicate_of)
+                complete_idempotent(db, user_id, idempotency_key, content)
+        completed = True
+        return JSONResponse(
+            content=content,
             status_code=200,
         )
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"upload_image | {user_id} | {type(e).__name__}: {str(e)}", exc_info=True)
         if "Insufficient upload credits" in str(e):
@@ -171,6 +827,9 @@ async def upload_image(request: Request, user_id: str = Depends(verify_jwt_token
                 detail="Insufficient upload credits. Please upgrade to premium for more uploads."
             )
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        if not completed:
+            release_idempotent(user_id, idempotency_key)
 
 @router.post("/delete_image")
 async def delete_image(request: Request, user_id: str = Depends(verify_jwt_token)):
@@ -184,6 +843,9 @@ async def delete_image(request: Request, user_id: str = Depends(verify_jwt_token
                 image_id
                 )
 
+        if result:
+            variant_cache.delete(user_id, str(uuid.UUID(image_id)))
+
         if result:
             return JSONResponse(
                 content={
@@ -213,6 +875,12 @@ async def delete_generated_image(request: Request, user_id: str = Depends(verify
                 image_id
                 )
 
+        # Only remove the cold copy once the row deletion has committed
+        if result and result["archived"] and cold_tier:
+            cold_tier.delete(user_id, image_id)
+        if result:
+            variant_cache.delete(user_id, str(uuid.UUID(image_id)))
+
         if result:
             return JSONResponse(
                 content={
@@ -232,11 +900,32 @@ async def delete_generated_image(request: Request, user_id: str = Depends(verify
     
 @router.post("/generate_image")
 async def generate_image(request: Request, user_id: str = Depends(verify_jwt_token)):
+    deadline = time.monotonic() + imgf.request_budget
+    # Admitted before the key is claimed or polled, so overload is shed without touching the DB.
+    # A replay gives its slot back straight away
+    admitted = admit_generation(user_id)
+    try:
+        idempotency_key, replay = await begin_idempotent(request, user_id, "generate_image", await request.body())
+    except BaseException:
+        admitted.release()
+        raise
+    if replay is not None:
+        admitted.release()
+        # The full image isn't kept with the key; it is read back like /get_full_generated_image
+        with Database() as db:
+            image_bytes = db.get_full_generated_image(user_id, replay["image_id"])
+        if image_bytes is None:
+            raise HTTPException(status_code=404, detail="Generated image no longer exists")
+        return base64_json_response(replay, "image_base64", image_bytes, headers={"Idempotent-Replayed": "true"})
+
+    completed = False
+    reserved = 0
     try:
         data = await request.json()
         yourself_image_id = data.get("yourself_image_id")
         clothing_image_id = data.get("clothing_image_id")
 
+        reserved = await memory_budget.acquire(2 * upload_max_bytes + generation_memory_overhead)
         with Database() as db:
             yourself_image_bytes = db.get_image(
                 user_id,
@@ -247,13 +936,18 @@ async def generate_image(request: Request, user_id: str = Depends(verify_jwt_tok
                 clothing_image_id
                 )
 
-        generated_image_bytes = imgf.generate_image(
-            yourself_image_bytes,
-            clothing_image_bytes
-            )
-        image_base64 = base64.b64encode(generated_image_bytes).decode('utf-8')
+        # Model call and preview run off the event loop so cheap reads stay responsive
+        async with admitted.slot():
+            generated_image_bytes = await run_in_threadpool(
+                imgf.generate_image,
+                yourself_image_bytes,
+                clothing_image_bytes,
+                deadline
+                )
+        del yourself_image_bytes, clothing_image_bytes
+        generated_image_bytes = await image_pool.run(imgf.compress_generated, generated_image_bytes)
 
-        generated_preview_bytes = imgf.create_preview(generated_image_bytes)
+        generated_preview_bytes = await image_pool.run(imgf.create_preview, generated_image_bytes)
         with Database() as db:
             result = db.insert_generated_image(
                 user_id,
@@ -262,18 +956,26 @@ async def generate_image(request: Request, user_id: str = Depends(verify_jwt_tok
                 generated_image_bytes,
                 generated_preview_bytes
                 )
-
-        return JSONResponse(
-            content={
+            content = {
                 "image_id": result["image_id"],
-                "image_base64": image_base64,
                 "preview_base64": result["preview_base64"],
                 "created_at": result["created_at"],
                 "generations_left": result["generations_left"],
                 "recents_left": result["recents_left"]
-            },
-            status_code=200,
+            }
+            complete_idempotent(db, user_id, idempotency_key, content)
+        completed = True
+        return base64_json_response(content, "image_base64", generated_image_bytes)
+    except AdmissionRejected as e:
+        raise rate_limited(e)
+    except CircuitOpenError as e:
+        raise HTTPException(
+            status_code=503,
+            detail="Image generation is temporarily unavailable",
+            headers={"Retry-After": str(int(e.retry_after))}
         )
+    except DeadlineExceeded:
+        raise HTTPException(status_code=504, detail="Image generation timed out")
     except Exception as e:
         logger.error(f"generate_image | {user_id} | {type(e).__name__}: {str(e)}", exc_info=True)
         if "Insufficient generation credits" in str(e):
@@ -282,6 +984,266 @@ async def generate_image(request: Request, user_id: str = Depends(verify_jwt_tok
                 detail="Insufficient generation credits. Please upgrade to premium for more generations."
             )
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        admitted.release()
+        if reserved:
+            await memory_budget.release(reserved)
+        if not completed:
+            release_idempotent(user_id, idempotency_key)
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@router.post("/generate_image_stream")
+async def generate_image_stream(request: Request, user_id: str = Depends(verify_jwt_token)):
+    """Server-Sent Events variant of /generate_image.
+
+    Emits queued, started, model_responded and preview_ready (with the stored
+    image's id, preview and counters), then done; failures end the stream with an
+    error event. The full image is not sent: fetch it via /get_full_generated_image.
+    """
+    deadline = time.monotonic() + imgf.request_budget
+    admitted = admit_generation(user_id)
+    reserved = 0
+    try:
+        # Held until the stream ends
+        reserved = await reserve_memory(2 * upload_max_bytes + generation_memory_overhead)
+        data = await request.json()
+        yourself_image_id = data.get("yourself_image_id")
+        clothing_image_id = data.get("clothing_image_id")
+
+        with Database() as db:
+            yourself_image_bytes = db.get_image(
+                user_id,
+                yourself_image_id
+                )
+            clothing_image_bytes = db.get_image(
+                user_id,
+                clothing_image_id
+                )
+
+        if yourself_image_bytes is None or clothing_image_bytes is None:
+            raise HTTPException(status_code=404, detail="Image not found")
+    except HTTPException:
+        admitted.release()
+        await memory_budget.release(reserved)
+        raise
+    except Exception as e:
+        admitted.release()
+        await memory_budget.release(reserved)
+        logger.error(f"generate_image_stream | {user_id} | {type(e).__name__}: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e))
+
+    async def stream_events():
+        nonlocal yourself_image_bytes, clothing_image_bytes
+        try:
+            yield sse_event("queued", {})
+
+            async with admitted.slot():
+                yield sse_event("started", {})
+                generated_image_bytes = await run_in_threadpool(
+                    imgf.generate_image,
+                    yourself_image_bytes,
+                    clothing_image_bytes,
+                    deadline
+                    )
+            yield sse_event("model_responded", {"size_bytes": len(generated_image_bytes)})
+            yourself_image_bytes = clothing_image_bytes = None
+
+            generated_image_bytes = await image_pool.run(imgf.compress_generated, generated_image_bytes)
+            generated_preview_bytes = await image_pool.run(imgf.create_preview, generated_image_bytes)
+            with Database() as db:
+                result = db.insert_generated_image(
+                    user_id,
+                    yourself_image_id,
+                    clothing_image_id,
+                    generated_image_bytes,
+                    generated_preview_bytes
+                    )
+            yield sse_event("preview_ready", result)
+            yield sse_event("done", {"image_id": result["image_id"]})
+
+        except AdmissionRejected as e:
+            yield sse_event("error", {"status": 429, "detail": e.reason, "retry_after": e.retry_after})
+        except CircuitOpenError as e:
+            yield sse_event("error", {"status": 503, "detail": "Image generation is temporarily unavailable", "retry_after": int(e.retry_after)})
+        except DeadlineExceeded:
+            yield sse_event("error", {"status": 504, "detail": "Image generation timed out"})
+        except Exception as e:
+            logger.error(f"generate_image_stream | {user_id} | {type(e).__name__}: {str(e)}", exc_info=True)
+            if "Insufficient generation credits" in str(e):
+                yield sse_event("error", {
+                    "status": 403,
+                    "detail": "Insufficient generation credits. Please upgrade to premium for more generations."
+                })
+            else:
+                yield sse_event("error", {"status": 500, "detail": str(e)})
+
+    async def release():
+        # Also runs when the client left before the stream started
+        admitted.release()
+        await memory_budget.release(reserved)
+
+    return CleanupStreamingResponse(
+        stream_events(),
+        release,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.post("/generate_images")
+async def generate_images(request: Request, user_id: str = Depends(verify_jwt_token)):
+    """Generate one clothing item on many photos (or many clothing items on one photo).
+
+    Results are streamed as newline-delimited JSON in completion order, followed by a
+    summary line. Credits for the whole batch are reserved up front and refunded for
+    every pair that fails. Full-size results are fetched through /get_full_generated_image.
+    """
+    deadline = time.monotonic() + imgf.request_budget
+    admitted = None
+    reserved = 0
+    try:
+        data = await request.json()
+        yourself_image_ids = data.get("yourself_image_ids") or []
+        clothing_image_ids = data.get("clothing_image_ids") or []
+
+        if not yourself_image_ids or not clothing_image_ids:
+            raise HTTPException(status_code=400, detail="At least one yourself and one clothing image is required")
+
+        if len(yourself_image_ids) > 1 and len(clothing_image_ids) > 1:
+            raise HTTPException(status_code=400, detail="Batch must use a single yourself image or a single clothing image")
+
+        pairs = [(y, c) for y in yourself_image_ids for c in clothing_image_ids]
+        if len(pairs) > generation_batch_max:
+            raise HTTPException(status_code=400, detail=f"Batch cannot exceed {generation_batch_max} generations")
+
+        admitted = admission.admit(user_id, cost=len(pairs))
+        # Held until the stream ends
+        reserved = await memory_budget.acquire(
+            len(set(yourself_image_ids + clothing_image_ids)) * upload_max_bytes + len(pairs) * generation_memory_overhead
+        )
+
+        with Database() as db:
+            source_images = db.get_images(
+                user_id,
+                set(yourself_image_ids + clothing_image_ids)
+                )
+            if len(source_images) != len(set(yourself_image_ids + clothing_image_ids)):
+                raise HTTPException(status_code=404, detail="Image not found")
+
+            credits = db.reserve_generation_credits(
+                user_id,
+                len(pairs)
+                )
+    except HTTPException:
+        if admitted:
+            admitted.release()
+        await memory_budget.release(reserved)
+        raise
+    except AdmissionRejected as e:
+        if admitted:
+            admitted.release()
+        await memory_budget.release(reserved)
+        raise rate_limited(e)
+    except Exception as e:
+        if admitted:
+            admitted.release()
+        await memory_budget.release(reserved)
+        logger.error(f"generate_images | {user_id} | {type(e).__name__}: {str(e)}", exc_info=True)
+        if "Insufficient generation credits" in str(e):
+            raise HTTPException(
+                status_code=403,
+                detail="Insufficient generation credits. Please upgrade to premium for more generations."
+            )
+        raise HTTPException(status_code=500, detail=str(e))
+
+    async def generate_pair(index, yourself_image_id, clothing_image_id):
+        try:
+            async with admitted.slot():
+                generated_image_bytes = await run_in_threadpool(
+                    imgf.generate_image,
+                    source_images[yourself_image_id],
+                    source_images[clothing_image_id],
+                    deadline
+                    )
+                generated_image_bytes = await image_pool.run(imgf.compress_generated, generated_image_bytes)
+                generated_preview_bytes = await image_pool.run(imgf.create_preview, generated_image_bytes)
+            return index, generated_image_bytes, generated_preview_bytes, None
+        except Exception as e:
+            logger.error(f"generate_images | {user_id} | {type(e).__name__}: {str(e)}", exc_info=True)
+            return index, None, None, e
+
+    def refund(count):
+        with Database() as db:
+            return db.refund_generation_credits(user_id, count)
+
+    tasks = []
+    succeeded = 0
+    settled = False
+
+    async def stream_results():
+        nonlocal succeeded, settled
+        tasks.extend(
+            asyncio.create_task(generate_pair(index, yourself_image_id, clothing_image_id))
+            for index, (yourself_image_id, clothing_image_id) in enumerate(pairs)
+        )
+
+        for next_result in asyncio.as_completed(tasks):
+            index, generated_image_bytes, generated_preview_bytes, error = await next_result
+            yourself_image_id, clothing_image_id = pairs[index]
+            line = {
+                "index": index,
+                "yourself_image_id": yourself_image_id,
+                "clothing_image_id": clothing_image_id
+            }
+
+            if error is None:
+                try:
+                    with Database() as db:
+                        result = db.insert_reserved_generated_image(
+                            user_id,
+                            yourself_image_id,
+                            clothing_image_id,
+                            generated_image_bytes,
+                            generated_preview_bytes
+                            )
+                    succeeded += 1
+                    line.update(status="ok", **result)
+                except Exception as e:
+                    logger.error(f"generate_images | {user_id} | {type(e).__name__}: {str(e)}", exc_info=True)
+                    error = e
+
+            if error is not None:
+                line.update(status="error", detail=str(error))
+
+            yield json.dumps(line) + "\n"
+
+        failed = len(pairs) - succeeded
+        summary = refund(failed) if failed else credits
+        settled = True
+
+        yield json.dumps({
+            "done": True,
+            "succeeded": succeeded,
+            "failed": failed,
+            "generations_left": summary["generations_left"],
+            "recents_left": summary["recents_left"]
+        }) + "\n"
+
+    async def settle():
+        # Runs however the response ended, also when the client left before the first line
+        # and the generator never started: stop pending work and give back what wasn't delivered
+        for task in tasks:
+            task.cancel()
+        if not settled:
+            try:
+                refund(len(pairs) - succeeded)
+            except Exception as e:
+                logger.error(f"generate_images | {user_id} | refund failed | {type(e).__name__}: {str(e)}", exc_info=True)
+        admitted.release()
+        await memory_budget.release(reserved)
+
+    return CleanupStreamingResponse(stream_results(), settle, media_type="application/x-ndjson")
 
 @router.post("/update_fav")
 async def update_fav(request: Request, user_id: str = Depends(verify_jwt_token)):
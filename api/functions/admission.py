@@ -0,0 +1,146 @@
+from cachetools import TTLCache
+from contextlib import asynccontextmanager
+import asyncio
+import math
+import os
+import time
+from .worker_limits import per_worker
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, reason, retry_after):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+class TokenBucket:
+    def __init__(self, rate_per_sec, capacity):
+        self.rate = rate_per_sec
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def wait_time(self, tokens=1):
+        """Seconds until `tokens` are available, 0 if they are available now"""
+        self._refill()
+        if self.tokens >= tokens:
+            return 0.0
+        return (tokens - self.tokens) / self.rate
+
+    def take(self, tokens=1):
+        self._refill()
+        self.tokens -= tokens
+
+
+class Admission:
+    """Model calls admitted for one request: each slot() uses one, release() hands back the rest"""
+
+    def __init__(self, controller, count):
+        self.controller = controller
+        self.remaining = count
+
+    def slot(self):
+        if self.remaining > 0:
+            self.remaining -= 1
+            self.controller.admitted -= 1
+        return self.controller.slot()
+
+    def release(self):
+        self.controller.admitted -= self.remaining
+        self.remaining = 0
+
+
+class AdmissionController:
+    """Rate limits and a bounded wait queue in front of the model call.
+
+    Everything runs on the event loop, so no locking is needed. Checks are
+    cheap and are meant to run before any DB read or image decoding. Admitted
+    calls count toward the queue from admit() on, so a burst of requests still
+    reading the DB can't all pass the bound before any of them reaches slot().
+    """
+
+    def __init__(self):
+        self.user_rate = float(os.getenv("GENERATION_USER_RATE_PER_MIN", 10)) / 60
+        self.user_burst = int(os.getenv("GENERATION_USER_BURST", 6))
+        # Global limits and model concurrency are per host, split across workers. Per-user
+        # buckets are not split (a batch must fit one burst), so they are per worker
+        self.global_bucket = TokenBucket(
+            per_worker(float(os.getenv("GENERATION_GLOBAL_RATE_PER_MIN", 120))) / 60,
+            per_worker(os.getenv("GENERATION_GLOBAL_BURST", 20))
+        )
+        self.max_concurrent = per_worker(os.getenv("GENERATION_CONCURRENCY", 4))
+        self.max_queue = per_worker(os.getenv("GENERATION_QUEUE_MAX", 16))
+        self.queue_timeout = float(os.getenv("GENERATION_QUEUE_TIMEOUT", 30))
+
+        # An evicted bucket would have refilled anyway, so expiry doesn't loosen the limit
+        self.user_buckets = TTLCache(
+            maxsize=10000,
+            ttl=max(60, self.user_burst / self.user_rate)
+        )
+        self.slots = asyncio.Semaphore(self.max_concurrent)
+        self.waiting = 0
+        self.in_flight = 0
+        # Admitted model calls that haven't reached slot() yet
+        self.admitted = 0
+
+    def _user_bucket(self, user_id):
+        bucket = self.user_buckets.get(user_id)
+        if bucket is None:
+            bucket = TokenBucket(self.user_rate, self.user_burst)
+            self.user_buckets[user_id] = bucket
+        return bucket
+
+    @property
+    def queued(self):
+        return self.waiting + self.admitted
+
+    def admit(self, user_id, cost=1):
+        """Take `cost` tokens from the user and global buckets or raise AdmissionRejected.
+
+        Returns the request's Admission; callers take model-call slots through it and
+        release() it when done, so calls that never ran stop counting toward the queue.
+        """
+        if cost > self.user_burst:
+            raise AdmissionRejected("Request exceeds per-user generation burst", 60)
+
+        # Queue is measured in model calls: admitted and waiting ones plus the ones this request adds
+        if self.queued + cost > self.max_queue + max(0, self.max_concurrent - self.in_flight):
+            raise AdmissionRejected("Generation queue is full", self.queue_timeout / 2)
+
+        user_bucket = self._user_bucket(user_id)
+        user_wait = user_bucket.wait_time(cost)
+        if user_wait:
+            raise AdmissionRejected("Too many generation requests", user_wait)
+
+        global_wait = self.global_bucket.wait_time(cost)
+        if global_wait:
+            raise AdmissionRejected("Generation capacity exhausted", global_wait)
+
+        user_bucket.take(cost)
+        self.global_bucket.take(cost)
+        self.admitted += cost
+        return Admission(self, cost)
+
+    @asynccontextmanager
+    async def slot(self):
+        """Hold one model-call slot, waiting in a bounded queue for it"""
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self.slots.acquire(), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            raise AdmissionRejected("Timed out waiting for a generation slot", self.queue_timeout / 2)
+        finally:
+            self.waiting -= 1
+
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self.slots.release()
@@ -0,0 +1,113 @@
+from cachetools import LRUCache
+from dotenv import load_dotenv
+from pathlib import Path
+import os
+import tempfile
+import threading
+import zlib
+from .metrics import metrics
+
+
+class LocalColdStore:
+    """Compressed full-size images on a local (or mounted) directory"""
+
+    def __init__(self, root, compression_level=6):
+        self.root = Path(root)
+        self.compression_level = compression_level
+
+    def _path(self, user_id, image_id):
+        return self.root / str(user_id) / f"{image_id}.z"
+
+    def put(self, user_id, image_id, data):
+        path = self._path(user_id, image_id)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        compressed = zlib.compress(data, self.compression_level)
+
+        # Write then rename so readers never see a partial file
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(compressed)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+        return len(compressed)
+
+    def get(self, user_id, image_id):
+        with self._path(user_id, image_id).open("rb") as f:
+            return zlib.decompress(f.read())
+
+    def delete(self, user_id, image_id):
+        self._path(user_id, image_id).unlink(missing_ok=True)
+
+
+class ColdTier:
+    """Read-through LRU cache in front of the cold store, with tier hit-rate metrics"""
+
+    def __init__(self, store, cache_bytes):
+        self.store = store
+        self._cache = LRUCache(maxsize=cache_bytes, getsizeof=len)
+        self._lock = threading.Lock()
+        self.hot_hits = 0
+        self.cache_hits = 0
+        self.cold_reads = 0
+
+        metrics.register_gauge("full_image_hot_hit_rate", lambda: self._rate(self.hot_hits))
+        metrics.register_gauge("full_image_cache_hit_rate", lambda: self._rate(self.cache_hits))
+        metrics.register_gauge("full_image_cold_read_rate", lambda: self._rate(self.cold_reads))
+        metrics.register_gauge("cold_tier_cache_bytes", lambda: self._cache.currsize)
+
+    @classmethod
+    def from_env(cls):
+        load_dotenv()
+        root = os.getenv("COLD_STORAGE_DIR")
+        if not root:
+            return None
+        return cls(
+            LocalColdStore(root, int(os.getenv("COLD_STORAGE_COMPRESSION_LEVEL", 6))),
+            int(os.getenv("COLD_STORAGE_CACHE_MB", 64)) * 1024 * 1024
+        )
+
+    def _rate(self, hits):
+        total = self.hot_hits + self.cache_hits + self.cold_reads
+        return hits / total if total else 0.0
+
+    def record_hot_hit(self):
+        with self._lock:
+            self.hot_hits += 1
+
+    def fetch(self, user_id, image_id):
+        key = (str(user_id), str(image_id))
+        with self._lock:
+            data = self._cache.get(key)
+            if data is not None:
+                self.cache_hits += 1
+                return data
+            self.cold_reads += 1
+
+        data = self.store.get(user_id, image_id)
+        metrics.inc("cold_tier_bytes_read_total", len(data))
+
+        with self._lock:
+            # Larger than the whole cache: serve it without caching
+            if len(data) <= self._cache.maxsize:
+                self._cache[key] = data
+        return data
+
+    def archive(self, user_id, image_id, data):
+        stored = self.store.put(user_id, image_id, data)
+        metrics.inc("cold_tier_archived_total")
+        metrics.inc("cold_tier_bytes_moved_total", len(data))
+        metrics.inc("cold_tier_bytes_stored_total", stored)
+        return stored
+
+    def delete(self, user_id, image_id):
+        with self._lock:
+            self._cache.pop((str(user_id), str(image_id)), None)
+        self.store.delete(user_id, image_id)
+
+
+cold_tier = ColdTier.from_env()
@@ -1,27 +1,291 @@
-from PIL import Image
+from PIL import Image, features
 from google import genai
+from google.genai import errors as genai_errors
 from google.genai import types
 from dotenv import load_dotenv
+from tenacity import Retrying, retry_if_exception, stop_after_attempt, wait_random_exponential
 import io
 import os
+import random
+import time
+import uuid
+from .metrics import metrics
+from .model_inputs import FileHandle, ModelInputCache
+from .resilience import CircuitBreaker, DeadlineExceeded, is_retryable, stop_before_deadline
+from .tracing import traced, tracer
 
 class ImageFunctions:
     def __init__(self):
         load_dotenv()
-        self.client = genai.Client(
-            api_key=os.getenv("GEMINI_API_KEY"),
-        )
+        # "gemini", or "simulated"/"failing" to exercise the pipeline without the model API
+        self.backend = os.getenv("IMAGE_BACKEND", "gemini")
+        if self.backend == "gemini":
+            self.client = genai.Client(
+                api_key=os.getenv("GEMINI_API_KEY"),
+            )
         self.model = "gemini-2.5-flash-image"
         self.max_preview_size = (400, 500)
 
+        # Widths /image_variant will render; a fixed set keeps the variant cache bounded
+        self.variant_widths = sorted(int(w) for w in os.getenv("VARIANT_WIDTHS", "320,640,1080").split(","))
+        self.variant_quality = int(os.getenv("VARIANT_QUALITY", 80))
+        # (mime type, Pillow format, extension), most preferred first; JPEG is the fallback
+        self.variant_formats = [("image/webp", "WEBP", "webp")]
+        if features.check("avif"):
+            self.variant_formats.insert(0, ("image/avif", "AVIF", "avif"))
+
+        # Model output is transcoded before it is stored and returned: WEBP, AVIF, JPEG, PNG or NONE
+        self.generated_format = os.getenv("GENERATED_IMAGE_FORMAT", "WEBP").upper()
+        if self.generated_format == "AVIF" and not features.check("avif"):
+            self.generated_format = "WEBP"
+        self.generated_quality = int(os.getenv("GENERATED_IMAGE_QUALITY", 90))
+        self.generated_lossless = os.getenv("GENERATED_IMAGE_LOSSLESS", "false").lower() == "true"
+        self.generated_max_side = int(os.getenv("GENERATED_IMAGE_MAX_SIDE", 2048))
+        # The original is kept unless the re-encode is at least this much smaller
+        self.generated_min_savings = float(os.getenv("GENERATED_IMAGE_MIN_SAVINGS", 0.1))
+
+        # Model call budget
+        self.request_budget = float(os.getenv("GENERATION_REQUEST_BUDGET", 90))
+        self.attempt_timeout = float(os.getenv("GEMINI_ATTEMPT_TIMEOUT", 60))
+        self.max_attempts = int(os.getenv("GEMINI_MAX_ATTEMPTS", 3))
+        self.simulated_latency = float(os.getenv("SIMULATED_LATENCY", 2))
+        self.simulated_failure_rate = 1.0 if self.backend == "failing" else float(os.getenv("SIMULATED_FAILURE_RATE", 0))
+        self.breaker = CircuitBreaker(
+            "gemini",
+            window_size=int(os.getenv("GEMINI_BREAKER_WINDOW", 20)),
+            min_calls=int(os.getenv("GEMINI_BREAKER_MIN_CALLS", 10)),
+            failure_threshold=float(os.getenv("GEMINI_BREAKER_THRESHOLD", 0.5)),
+            open_seconds=float(os.getenv("GEMINI_BREAKER_OPEN_SECONDS", 30))
+        )
+
+        # Source images go up once through the provider's file store; generations reference the handle
+        self.model_input_cache = None
+        if os.getenv("MODEL_INPUT_CACHE", "true").lower() == "true":
+            self.model_input_cache = ModelInputCache(
+                self._upload_gemini if self.backend == "gemini" else self._upload_simulated,
+                max_entries=int(os.getenv("MODEL_INPUT_CACHE_ENTRIES", 1000)),
+                expiry_margin=float(os.getenv("MODEL_INPUT_EXPIRY_MARGIN", 3600))
+            )
+        self.model_input_upload_timeout = float(os.getenv("MODEL_INPUT_UPLOAD_TIMEOUT", 30))
+        # Stand-in for the provider file store, so the cache works end to end without the model API
+        self.simulated_file_ttl = float(os.getenv("SIMULATED_FILE_TTL", 48 * 3600))
+        self._simulated_files = {}
+
+    @traced("image.create_preview")
     def create_preview(self, image_bytes):
+        start = time.perf_counter()
         image = Image.open(io.BytesIO(image_bytes))
         image.thumbnail(self.max_preview_size, Image.LANCZOS)
         output = io.BytesIO()
         image.save(output, format='WEBP', quality=100, method=6)
+        metrics.observe("create_preview_seconds", time.perf_counter() - start)
         return output.getvalue()
 
-    def generate_image(self, yourself_image_base64, clothing_image_base64):
+    def preview_memory(self, image_bytes):
+        """Bytes of the bitmap create_preview decodes, from the header alone.
+
+        thumbnail() lets JPEG decode at a reduced scale (draft); other formats
+        decode at full size. 4 bytes per pixel, plus a quarter for the reduced copy.
+        """
+        image = Image.open(io.BytesIO(image_bytes))
+        # Only configures the decoder, as thumbnail() will
+        image.draft(None, (self.max_preview_size[0] * 2, self.max_preview_size[1] * 2))
+        width, height = image.size
+        return width * height * 5
+
+    def negotiate_variant_format(self, accept):
+        # Only formats the client names explicitly, without q=0; wildcards get the JPEG fallback
+        accepted = set()
+        for media_range in (accept or "").split(","):
+            mime_type, *params = [part.strip() for part in media_range.split(";")]
+            quality = 1.0
+            for param in params:
+                key, _, value = param.partition("=")
+                if key.strip().lower() == "q":
+                    try:
+                        quality = float(value)
+                    except ValueError:
+                        quality = 0.0
+            if quality > 0:
+                accepted.add(mime_type.lower())
+
+        for mime_type, image_format, ext in self.variant_formats:
+            if mime_type in accepted:
+                return mime_type, image_format, ext
+        return "image/jpeg", "JPEG", "jpg"
+
+    @traced("image.create_variant")
+    def create_variant(self, image_bytes, width, image_format):
+        start = time.perf_counter()
+        image = Image.open(io.BytesIO(image_bytes))
+        # JPEG sources decode straight at a reduced scale, skipping most of the full-size bitmap
+        image.draft("RGB", (width, image.height * width // image.width))
+        if image.width > width:
+            image = image.resize((width, round(image.height * width / image.width)), Image.LANCZOS)
+
+        variant_bytes = self._encode(image, image_format, quality=self.variant_quality)
+        metrics.observe("create_variant_seconds", time.perf_counter() - start)
+        return variant_bytes
+
+    @traced("image.compress_generated")
+    def compress_generated(self, image_bytes, image_format=None, quality=None, lossless=None):
+        """Re-encode model output (often a large PNG), keeping the original when it doesn't pay off"""
+        image_format = image_format or self.generated_format
+        quality = self.generated_quality if quality is None else quality
+        lossless = self.generated_lossless if lossless is None else lossless
+        if image_format == "NONE":
+            return image_bytes
+
+        start = time.perf_counter()
+        image = Image.open(io.BytesIO(image_bytes))
+        if max(image.size) > self.generated_max_side:
+            image.thumbnail((self.generated_max_side, self.generated_max_side), Image.LANCZOS)
+
+        if image_format == "WEBP":
+            options = {"quality": quality, "lossless": lossless, "method": 4}
+        elif image_format == "AVIF":
+            options = {"quality": 100 if lossless else quality}
+        elif image_format == "JPEG":
+            options = {"quality": quality, "optimize": True, "progressive": True}
+        else:
+            options = {"optimize": True}
+        compressed = self._encode(image, image_format, **options)
+        metrics.observe("compress_generated_seconds", time.perf_counter() - start)
+
+        metrics.inc("generated_bytes_in_total", len(image_bytes))
+        if len(compressed) > len(image_bytes) * (1 - self.generated_min_savings):
+            compressed = image_bytes
+        metrics.inc("generated_bytes_out_total", len(compressed))
+        return compressed
+
+    def _encode(self, image, image_format, **options):
+        if image_format == "JPEG":
+            if image.mode != "RGB":
+                image = image.convert("RGB")
+        elif image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA")
+
+        output = io.BytesIO()
+        image.save(output, format=image_format, **options)
+        return output.getvalue()
+
+    def perceptual_hash(self, image_bytes):
+        # 64-bit difference hash; survives re-encoding and resizing, so the small preview is enough
+        image = Image.open(io.BytesIO(image_bytes)).convert("L").resize((9, 8), Image.LANCZOS)
+        pixels = list(image.getdata())
+        value = 0
+        for row in range(8):
+            for col in range(8):
+                value = (value << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+
+        # Stored in a signed BIGINT column
+        return value - (1 << 64) if value >= (1 << 63) else value
+
+    def hash_distance(self, first_hash, second_hash):
+        return bin((first_hash ^ second_hash) & 0xFFFFFFFFFFFFFFFF).count("1")
+
+    def generate_image(self, yourself_image_base64, clothing_image_base64, deadline=None):
+        """Run the model call with jittered retries for transient errors.
+
+        `deadline` is a time.monotonic() timestamp; each attempt gets the time left
+        until it (capped at GEMINI_ATTEMPT_TIMEOUT) and no retry starts past it.
+        """
+        if deadline is None:
+            deadline = time.monotonic() + self.request_budget
+
+        retrying = Retrying(
+            retry=retry_if_exception(is_retryable),
+            wait=wait_random_exponential(multiplier=0.5, max=8),
+            stop=stop_after_attempt(self.max_attempts) | stop_before_deadline(deadline),
+            before_sleep=lambda retry_state: metrics.inc("gemini_retries_total"),
+            reraise=True
+        )
+        with tracer.span("gemini.generate_image", backend=self.backend) as span:
+            result = retrying(self._attempt, yourself_image_base64, clothing_image_base64, deadline)
+            span.set("attempts", retrying.statistics.get("attempt_number", 1))
+            span.set("bytes_out", len(result))
+            return result
+
+    def _attempt(self, yourself_image_base64, clothing_image_base64, deadline):
+        if deadline - time.monotonic() <= 0:
+            raise DeadlineExceeded("Generation deadline exceeded")
+
+        if self.backend == "gemini":
+            call = self._call_gemini
+        else:
+            call = self._call_simulated
+
+        images = [yourself_image_base64, clothing_image_base64]
+        handles = [self._model_input_handle(image_bytes, deadline) for image_bytes in images]
+
+        # Measured after the uploads, which spend from the same deadline
+        timeout = min(self.attempt_timeout, deadline - time.monotonic())
+        if timeout <= 0:
+            raise DeadlineExceeded("Generation deadline exceeded")
+
+        metrics.inc("gemini_calls_total")
+        start = time.monotonic()
+        with tracer.span("gemini.request", timeout=round(timeout, 3)) as span:
+            span.set("inline_bytes", sum(len(image_bytes) for image_bytes, handle in zip(images, handles) if not handle))
+            span.set("file_inputs", sum(1 for handle in handles if handle))
+            try:
+                try:
+                    return self.breaker.call(call, images, handles, timeout)
+                except genai_errors.ClientError as e:
+                    # An expired or deleted file handle is rejected; drop it and send the bytes inline once
+                    if e.code not in (400, 403, 404) or not any(handles):
+                        raise
+                    for handle in handles:
+                        if handle:
+                            self.model_input_cache.invalidate(handle)
+                    timeout = min(timeout, deadline - time.monotonic())
+                    if timeout <= 0:
+                        raise DeadlineExceeded("Generation deadline exceeded")
+                    span.set("inline_retry", True)
+                    return self.breaker.call(call, images, [None] * len(images), timeout)
+            except Exception:
+                metrics.inc("gemini_failures_total")
+                raise
+            finally:
+                metrics.observe("gemini_call_seconds", time.monotonic() - start)
+
+    def _model_input_handle(self, image_bytes, deadline):
+        if self.model_input_cache is None:
+            return None
+        # An upload never runs past the request deadline; with no time left the bytes go inline
+        upload_timeout = min(self.model_input_upload_timeout, deadline - time.monotonic())
+        if upload_timeout <= 0:
+            return None
+        return self.model_input_cache.handle_for(image_bytes, self._mime_type(image_bytes), upload_timeout)
+
+    def _mime_type(self, image_bytes):
+        # Uploads may be PNG or WEBP as well; only the header is read
+        try:
+            image_format = Image.open(io.BytesIO(image_bytes)).format
+        except Exception:
+            return "image/jpeg"
+        return Image.MIME.get(image_format, "image/jpeg")
+
+    def _upload_gemini(self, image_bytes, mime_type, timeout):
+        uploaded = self.client.files.upload(
+            file=io.BytesIO(image_bytes),
+            config=types.UploadFileConfig(
+                mime_type=mime_type,
+                http_options=types.HttpOptions(timeout=max(int(timeout * 1000), 1))
+            )
+        )
+        return FileHandle(uploaded.uri, uploaded.mime_type or mime_type, uploaded.expiration_time.timestamp())
+
+    def _upload_simulated(self, image_bytes, mime_type, timeout):
+        now = time.time()
+        for uri, (_, expires_at) in list(self._simulated_files.items()):
+            if expires_at <= now:
+                self._simulated_files.pop(uri, None)
+        uri = f"simulated://files/{uuid.uuid4()}"
+        self._simulated_files[uri] = (image_bytes, now + self.simulated_file_ttl)
+        return FileHandle(uri, mime_type, now + self.simulated_file_ttl)
+
+    def _call_gemini(self, images, handles, timeout):
         main_prompt = f"""
         Combine two images seamlessly. In the first image, there is a person.
         In the second image, there is a clothing item which may or may not be worn by a model.
@@ -32,19 +296,12 @@ class ImageFunctions:
         The final result must look like the person in the first image is realistically wearing the clothing from the second image.
         """
 
-        # Create parts list using Blob format (matching sample code)
-        person_part = types.Part(
-            inline_data=types.Blob(
-                data=yourself_image_base64,
-                mime_type="image/jpeg"
-            )
-        )
-        clothing_part = types.Part(
-            inline_data=types.Blob(
-                data=clothing_image_base64,
-                mime_type="image/jpeg"
-            )
-        )
+        # Uploaded files are referenced by URI; anything without a handle goes inline as a Blob
+        person_part, clothing_part = [
+            types.Part.from_uri(file_uri=handle.uri, mime_type=handle.mime_type) if handle
+            else types.Part(inline_data=types.Blob(data=image_bytes, mime_type=self._mime_type(image_bytes)))
+            for image_bytes, handle in zip(images, handles)
+        ]
         text_part = types.Part.from_text(text=main_prompt)
 
         # Contents is a list of Parts (not wrapped in Content object)
@@ -53,7 +310,8 @@ class ImageFunctions:
         # Configure model response to include IMAGE output
         generate_config = types.GenerateContentConfig(
             response_modalities=["IMAGE"],
-            temperature=0.2
+            temperature=0.2,
+            http_options=types.HttpOptions(timeout=int(timeout * 1000))
         )
 
         # Send to model
@@ -69,3 +327,37 @@ class ImageFunctions:
 
         image_part = response.candidates[0].content.parts[0]
         return image_part.inline_data.data
+
+    def _call_simulated(self, images, handles, timeout):
+        # Person photo with the clothing pasted in a corner, after a model-like delay
+        if self.simulated_latency > timeout:
+            time.sleep(timeout)
+            raise TimeoutError("Simulated model call timed out")
+        time.sleep(self.simulated_latency)
+
+        if random.random() < self.simulated_failure_rate:
+            raise genai_errors.ServerError(
+                503,
+                {"error": {"code": 503, "message": "Simulated backend failure", "status": "UNAVAILABLE"}}
+            )
+
+        yourself_image_bytes, clothing_image_bytes = [
+            self._simulated_file(handle) if handle else image_bytes
+            for image_bytes, handle in zip(images, handles)
+        ]
+        person = Image.open(io.BytesIO(yourself_image_bytes)).convert("RGB")
+        clothing = Image.open(io.BytesIO(clothing_image_bytes)).convert("RGB")
+        clothing.thumbnail((person.width // 3, person.height // 3))
+        person.paste(clothing, (0, 0))
+        output = io.BytesIO()
+        person.save(output, format='PNG')
+        return output.getvalue()
+
+    def _simulated_file(self, handle):
+        image_bytes, expires_at = self._simulated_files.get(handle.uri, (None, 0))
+        if expires_at <= time.time():
+            raise genai_errors.ClientError(
+                403,
+                {"error": {"code": 403, "message": f"File {handle.uri} does not exist or has expired", "status": "PERMISSION_DENIED"}}
+            )
+        return image_bytes
@@ -0,0 +1,56 @@
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import contextvars
+import os
+import threading
+from .metrics import metrics
+from .worker_limits import per_worker
+
+
+class ImagePool:
+    """Dedicated threads for Pillow work (previews, variants).
+
+    Kept apart from Starlette's shared threadpool so a burst of decodes can't
+    starve DB-bound handlers. Pillow releases the GIL while resizing and encoding.
+    """
+
+    def __init__(self, max_workers):
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="image")
+        self._lock = threading.Lock()
+        self.queued = 0
+        self.active = 0
+
+        metrics.register_gauge("image_pool_queue_depth", lambda: self.queued)
+        metrics.register_gauge("image_pool_active", lambda: self.active)
+
+    def _run(self, fn, args):
+        with self._lock:
+            self.queued -= 1
+            self.active += 1
+        try:
+            return fn(*args)
+        finally:
+            with self._lock:
+                self.active -= 1
+
+    async def run(self, fn, *args):
+        with self._lock:
+            self.queued += 1
+        # Carry the caller's context (request id, trace span) into the worker thread
+        context = contextvars.copy_context()
+        future = self._executor.submit(context.run, self._run, fn, args)
+        try:
+            return await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            # Not started yet: drop it instead of burning a thread for a gone client
+            if future.cancel():
+                with self._lock:
+                    self.queued -= 1
+            raise
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+image_pool = ImagePool(per_worker(os.getenv("IMAGE_POOL_SIZE", os.cpu_count() or 1)))
@@ -0,0 +1,43 @@
+from collections import deque
+import asyncio
+import os
+import time
+from .metrics import metrics
+
+
+class LoopLagMonitor:
+    """Measures how late the event loop wakes a sleeping task.
+
+    A blocked loop can't run the sampler either, so a stall shows up on the first
+    sample after it; the peak over the last `window` seconds keeps it visible to
+    readiness checks for a while.
+    """
+
+    def __init__(self, interval, window):
+        self.interval = interval
+        self.window = window
+        self.lag = 0.0
+        self._samples = deque()
+
+        metrics.register_gauge("event_loop_lag_seconds", lambda: self.lag)
+        metrics.register_gauge("event_loop_lag_peak_seconds", self.peak)
+
+    def peak(self):
+        cutoff = time.monotonic() - self.window
+        return max((lag for at, lag in self._samples if at >= cutoff), default=0.0)
+
+    async def run(self):
+        while True:
+            start = time.monotonic()
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self.lag = max(0.0, now - start - self.interval)
+            self._samples.append((now, self.lag))
+            while self._samples and self._samples[0][0] < now - self.window:
+                self._samples.popleft()
+
+
+loop_lag = LoopLagMonitor(
+    float(os.getenv("LOOP_LAG_INTERVAL", 0.1)),
+    float(os.getenv("LOOP_LAG_WINDOW", 5))
+)
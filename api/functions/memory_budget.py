@@ -0,0 +1,58 @@
+from contextlib import asynccontextmanager
+import asyncio
+import os
+from .admission import AdmissionRejected
+from .metrics import metrics
+from .worker_limits import per_worker
+
+
+class MemoryBudget:
+    """Caps the estimated bytes that large-payload requests hold at once.
+
+    Requests wait (up to `timeout`) for room instead of all decoding at the same
+    time and pushing the worker out of memory. Runs on the event loop only.
+    """
+
+    def __init__(self, total_bytes, timeout):
+        self.total_bytes = total_bytes
+        self.timeout = timeout
+        self.in_use = 0
+        self._condition = asyncio.Condition()
+
+        metrics.register_gauge("memory_budget_in_use_bytes", lambda: self.in_use)
+        metrics.register_gauge("memory_budget_utilisation", lambda: self.in_use / self.total_bytes)
+
+    async def acquire(self, nbytes):
+        """Reserve `nbytes` or raise AdmissionRejected; returns the amount to release"""
+        # Larger than the whole budget would never fit: let it run once nothing else does
+        nbytes = min(nbytes, self.total_bytes)
+        async with self._condition:
+            try:
+                await asyncio.wait_for(
+                    self._condition.wait_for(lambda: self.in_use + nbytes <= self.total_bytes),
+                    timeout=self.timeout
+                )
+            except asyncio.TimeoutError:
+                metrics.inc("memory_budget_rejected_total")
+                raise AdmissionRejected("Server is busy with large requests", self.timeout)
+            self.in_use += nbytes
+        return nbytes
+
+    async def release(self, nbytes):
+        async with self._condition:
+            self.in_use -= nbytes
+            self._condition.notify_all()
+
+    @asynccontextmanager
+    async def reserve(self, nbytes):
+        reserved = await self.acquire(nbytes)
+        try:
+            yield
+        finally:
+            await self.release(reserved)
+
+
+memory_budget = MemoryBudget(
+    per_worker(int(os.getenv("MEMORY_BUDGET_MB", 1024)) * 1024 * 1024),
+    float(os.getenv("MEMORY_BUDGET_TIMEOUT", 10))
+)
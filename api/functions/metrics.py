@@ -0,0 +1,62 @@
+from collections import defaultdict
+import threading
+
+
+class Metrics:
+    """In-process counters, gauges and timings, exposed by /v1/metrics.
+
+    Values are per process; callers may update them from worker threads.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = defaultdict(float)
+        self._gauges = {}
+        self._gauge_callbacks = {}
+        self._timings = {}
+
+    def inc(self, name, value=1):
+        with self._lock:
+            self._counters[name] += value
+
+    def set_gauge(self, name, value):
+        with self._lock:
+            self._gauges[name] = value
+
+    def register_gauge(self, name, callback):
+        """Read `callback()` lazily on every snapshot"""
+        with self._lock:
+            self._gauge_callbacks[name] = callback
+
+    def observe(self, name, seconds):
+        with self._lock:
+            timing = self._timings.setdefault(name, {"count": 0, "sum": 0.0, "max": 0.0})
+            timing["count"] += 1
+            timing["sum"] += seconds
+            timing["max"] = max(timing["max"], seconds)
+
+    def average(self, name):
+        with self._lock:
+            timing = self._timings.get(name)
+            if not timing or not timing["count"]:
+                return 0.0
+            return timing["sum"] / timing["count"]
+
+    def snapshot(self):
+        with self._lock:
+            counters = dict(self._counters)
+            gauges = dict(self._gauges)
+            callbacks = dict(self._gauge_callbacks)
+            timings = {name: dict(timing) for name, timing in self._timings.items()}
+
+        for name, callback in callbacks.items():
+            gauges[name] = callback()
+
+        return {
+            "counters": counters,
+            "gauges": gauges,
+            "timings": timings
+        }
+
+
+metrics = Metrics()
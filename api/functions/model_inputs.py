@@ -0,0 +1,68 @@
+from cachetools import LRUCache
+from typing import NamedTuple
+import hashlib
+import logging
+import threading
+import time
+from .metrics import metrics
+from .tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+
+class FileHandle(NamedTuple):
+    uri: str
+    mime_type: str
+    expires_at: float
+
+
+class ModelInputCache:
+    """Provider file handles for source images, keyed by content hash.
+
+    A photo used for several generations is uploaded once through `upload`
+    (bytes, mime type, timeout seconds -> FileHandle) and later calls reference the handle instead
+    of inlining the bytes again. Handles within `expiry_margin` seconds of expiring
+    are treated as gone so a long model call never outlives its inputs. Per process.
+    """
+
+    def __init__(self, upload, max_entries, expiry_margin):
+        self.upload = upload
+        self.expiry_margin = expiry_margin
+        self._handles = LRUCache(maxsize=max_entries)
+        self._lock = threading.Lock()
+
+        metrics.register_gauge("model_input_cache_entries", lambda: len(self._handles))
+
+    def handle_for(self, image_bytes, mime_type, timeout):
+        """Cached or freshly uploaded handle; None when the upload fails (send inline instead)"""
+        key = hashlib.sha256(image_bytes).digest()
+        with self._lock:
+            handle = self._handles.get(key)
+        if handle and handle.expires_at - self.expiry_margin > time.time():
+            metrics.inc("model_input_cache_hits_total")
+            metrics.inc("model_input_bytes_saved_total", len(image_bytes))
+            return handle
+
+        metrics.inc("model_input_cache_misses_total")
+        start = time.monotonic()
+        try:
+            with tracer.span("gemini.upload_file", bytes=len(image_bytes)):
+                handle = self.upload(image_bytes, mime_type, timeout)
+        except Exception as e:
+            metrics.inc("model_input_upload_failures_total")
+            logger.warning(f"model input upload failed, sending inline | {type(e).__name__}: {str(e)}")
+            return None
+        finally:
+            metrics.observe("model_input_upload_seconds", time.monotonic() - start)
+
+        with self._lock:
+            self._handles[key] = handle
+        return handle
+
+    def invalidate(self, handle):
+        """Drop a handle the provider no longer accepts"""
+        with self._lock:
+            for key, cached in list(self._handles.items()):
+                if cached.uri == handle.uri:
+                    del self._handles[key]
+        metrics.inc("model_input_invalidations_total")
@@ -0,0 +1,137 @@
+from collections import deque
+from google.genai import errors as genai_errors
+from tenacity.stop import stop_base
+import httpx
+import threading
+import time
+from .metrics import metrics
+
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, name, retry_after):
+        super().__init__(f"{name} circuit is open")
+        self.retry_after = retry_after
+
+
+def is_retryable(exc):
+    """Transient backend failures: 5xx, 429, timeouts and connection errors"""
+    if isinstance(exc, (CircuitOpenError, DeadlineExceeded)):
+        return False
+    if isinstance(exc, genai_errors.ServerError):
+        return True
+    if isinstance(exc, genai_errors.ClientError):
+        return exc.code == 429
+    return isinstance(exc, (TimeoutError, httpx.TimeoutException, httpx.TransportError))
+
+
+class stop_before_deadline(stop_base):
+    """Stop retrying when the next attempt could not start before `deadline`"""
+
+    def __init__(self, deadline, min_attempt_time=1.0):
+        self.deadline = deadline
+        self.min_attempt_time = min_attempt_time
+
+    def __call__(self, retry_state):
+        next_start = time.monotonic() + (retry_state.upcoming_sleep or 0)
+        return next_start + self.min_attempt_time >= self.deadline
+
+
+class CircuitBreaker:
+    """Fails fast once the recent failure rate of a dependency crosses a threshold.
+
+    Outcomes are kept in a rolling window of the last `window_size` calls. When at
+    least `min_calls` are recorded and the failure rate reaches `failure_threshold`
+    the circuit opens for `open_seconds`, then lets one probe call through
+    (half-open). A successful probe closes the circuit, a failed one reopens it.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+    STATE_CODES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+    def __init__(self, name, window_size=20, min_calls=10, failure_threshold=0.5, open_seconds=30):
+        self.name = name
+        self.window_size = window_size
+        self.min_calls = min_calls
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+
+        self._lock = threading.Lock()
+        self._outcomes = deque(maxlen=window_size)
+        self._state = self.CLOSED
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+
+        metrics.register_gauge(f"{name}_circuit_state", lambda: self.STATE_CODES[self.state])
+        metrics.register_gauge(f"{name}_failure_rate", self.failure_rate)
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+                self._state = self.HALF_OPEN
+            return self._state
+
+    def failure_rate(self):
+        with self._lock:
+            if not self._outcomes:
+                return 0.0
+            return self._outcomes.count(False) / len(self._outcomes)
+
+    def _before_call(self):
+        state = self.state
+        with self._lock:
+            if state == self.CLOSED:
+                return
+            if state == self.HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return
+            retry_after = max(1.0, self.open_seconds - (time.monotonic() - self._opened_at))
+
+        metrics.inc(f"{self.name}_circuit_rejected_total")
+        raise CircuitOpenError(self.name, retry_after)
+
+    def _open(self):
+        self._state = self.OPEN
+        self._opened_at = time.monotonic()
+        self._outcomes.clear()
+        metrics.inc(f"{self.name}_circuit_opened_total")
+
+    def _record(self, success):
+        with self._lock:
+            if self._probe_in_flight:
+                self._probe_in_flight = False
+                if success:
+                    self._state = self.CLOSED
+                    self._outcomes.clear()
+                else:
+                    self._open()
+                return
+
+            self._outcomes.append(success)
+            failures = self._outcomes.count(False)
+            if (
+                self._state == self.CLOSED
+                and len(self._outcomes) >= self.min_calls
+                and failures / len(self._outcomes) >= self.failure_threshold
+            ):
+                self._open()
+
+    def call(self, func, *args, **kwargs):
+        self._before_call()
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            # Only transient failures say something about the dependency's health
+            if is_retryable(e):
+                self._record(False)
+            else:
+                self._record(True)
+            raise
+        self._record(True)
+        return result
@@ -0,0 +1,207 @@
+from contextvars import ContextVar
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler, WatchedFileHandler
+import copy
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+from .metrics import metrics
+from .tracing import tracer
+from .worker_limits import worker_count
+
+# Mutable per-request dict: dependencies running in worker threads (JWT check) can fill in user_id
+request_context: ContextVar = ContextVar("request_context", default=None)
+
+
+def set_request_user(user_id):
+    context = request_context.get()
+    if context is not None:
+        context["user_id"] = user_id
+
+
+class ContextFilter(logging.Filter):
+    """Stamps request id, route, user id and elapsed time on records in the caller's context"""
+
+    def filter(self, record):
+        context = request_context.get()
+        if context is not None:
+            record.request_id = context["request_id"]
+            record.route = context["route"]
+            record.user_id = context["user_id"]
+            record.latency_ms = round((time.perf_counter() - context["start"]) * 1000, 1)
+            record.trace_id = context.get("trace_id")
+        return True
+
+
+class DuplicateFilter(logging.Filter):
+    """Lets the first record from a call site through per window and counts the rest.
+
+    Runs before formatting, so suppressed records never pay for traceback rendering.
+    The next record let through carries the number suppressed in between.
+    """
+
+    def __init__(self, window_seconds):
+        super().__init__()
+        self.window_seconds = window_seconds
+        self._lock = threading.Lock()
+        self._seen = {}
+
+    def filter(self, record):
+        # Only warnings and errors storm; access records must all get through
+        if self.window_seconds <= 0 or record.levelno < logging.WARNING:
+            return True
+
+        exc_type = record.exc_info[0].__name__ if record.exc_info else None
+        key = (record.name, record.levelno, record.pathname, record.lineno, exc_type)
+        now = time.monotonic()
+
+        with self._lock:
+            first_seen, suppressed = self._seen.get(key, (None, 0))
+            if first_seen is not None and now - first_seen < self.window_seconds:
+                self._seen[key] = (first_seen, suppressed + 1)
+                return False
+            self._seen[key] = (now, 0)
+
+            # Keep the table bounded under a storm of distinct call sites
+            if len(self._seen) > 10000:
+                self._seen = {k: v for k, v in self._seen.items() if now - v[0] < self.window_seconds}
+
+        if suppressed:
+            record.suppressed = suppressed
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    FIELDS = ("request_id", "trace_id", "route", "user_id", "latency_ms", "status_code", "suppressed")
+
+    def format(self, record):
+        entry = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for field in self.FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class DroppingQueueHandler(QueueHandler):
+    """Never blocks the caller: when the writer falls behind, records are dropped and counted"""
+
+    dropped = 0
+
+    def prepare(self, record):
+        # Only the message is resolved here, since its args may change once the call returns.
+        # JSON and traceback rendering happen in the writer thread
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            DroppingQueueHandler.dropped += 1
+
+
+def setup_logging(log_path):
+    """Route all logging through a bounded queue to a background JSON file writer.
+
+    A single process rotates the file itself. Several workers all append to the same
+    file instead: each rotating it on its own would clobber the others' backups, so
+    rotation is left to logrotate (or similar), and WatchedFileHandler reopens the
+    file once it has been moved.
+    """
+    log_queue = queue.Queue(maxsize=int(os.getenv("LOG_QUEUE_SIZE", 10000)))
+
+    if worker_count() > 1:
+        file_handler = WatchedFileHandler(log_path)
+    else:
+        file_handler = RotatingFileHandler(
+            log_path,
+            maxBytes=int(os.getenv("LOG_MAX_BYTES", 10 * 1024 * 1024)),
+            backupCount=int(os.getenv("LOG_BACKUP_COUNT", 5)),
+        )
+    file_handler.setFormatter(JsonFormatter())
+
+    # Filters run on the caller's thread: they need its context, and they drop duplicates before any formatting
+    queue_handler = DroppingQueueHandler(log_queue)
+    queue_handler.addFilter(DuplicateFilter(float(os.getenv("LOG_DUPLICATE_WINDOW", 10))))
+    queue_handler.addFilter(ContextFilter())
+
+    # force: api.server has already configured the root logger in this process (single worker)
+    logging.basicConfig(
+        level=os.getenv("LOG_LEVEL", "ERROR").upper(),
+        handlers=[queue_handler],
+        force=True
+    )
+    # Access records are INFO; they have their own level so they aren't cut by LOG_LEVEL
+    logging.getLogger("api.access").setLevel(os.getenv("ACCESS_LOG_LEVEL", "INFO").upper())
+
+    metrics.register_gauge("log_records_dropped", lambda: DroppingQueueHandler.dropped)
+    metrics.register_gauge("log_queue_depth", log_queue.qsize)
+
+    listener = QueueListener(log_queue, file_handler, respect_handler_level=True)
+    listener.start()
+    return listener
+
+
+class RequestContextMiddleware:
+    """Pure ASGI middleware: per-request id, route, user id and latency for logs.
+
+    Echoes the id back in X-Request-ID and logs a completion record at INFO. Also
+    opens the request's root trace span, continuing an incoming traceparent, and
+    returns the span's traceparent when the request is traced.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.logger = logging.getLogger("api.access")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        headers = dict(scope.get("headers") or [])
+        request_id = headers.get(b"x-request-id", b"").decode("latin-1")[:64] or uuid.uuid4().hex
+        context = {
+            "request_id": request_id,
+            "route": scope["path"],
+            "user_id": None,
+            "start": time.perf_counter(),
+        }
+        token = request_context.set(context)
+        status = {"code": 500}
+
+        with tracer.root(
+            f"{scope['method']} {scope['path']}",
+            traceparent=headers.get(b"traceparent", b"").decode("latin-1"),
+            request_id=request_id
+        ) as span:
+            context["trace_id"] = span.trace_id
+
+            async def send_with_request_id(message):
+                if message["type"] == "http.response.start":
+                    status["code"] = message["status"]
+                    span.set("http.status_code", message["status"])
+                    extra_headers = [(b"x-request-id", request_id.encode("latin-1"))]
+                    if span.traceparent:
+                        extra_headers.append((b"traceparent", span.traceparent.encode("latin-1")))
+                    message["headers"] = list(message.get("headers", [])) + extra_headers
+                await send(message)
+
+            try:
+                await self.app(scope, receive, send_with_request_id)
+            finally:
+                span.set("user_id", context["user_id"])
+                self.logger.info("request completed", extra={"status_code": status["code"]})
+                request_context.reset(token)
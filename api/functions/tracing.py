@@ -0,0 +1,279 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+import functools
+import importlib
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import threading
+import time
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class Span:
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "start", "duration", "attributes", "error", "trace")
+    recording = True
+
+    def __init__(self, name, trace_id, parent_id, trace, attributes):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent_id
+        self.start = time.time()
+        self.duration = None
+        self.attributes = attributes
+        self.error = None
+        self.trace = trace
+
+    def set(self, key, value):
+        self.attributes[key] = value
+
+    def add(self, key, value):
+        self.attributes[key] = self.attributes.get(key, 0) + value
+
+    @property
+    def traceparent(self):
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    def to_dict(self):
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.start,
+            "duration_ms": round(self.duration * 1000, 3),
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+class NoopSpan:
+    """Stands in when tracing is off or the trace isn't sampled, so callers never branch"""
+
+    recording = False
+    trace_id = None
+    traceparent = None
+
+    def set(self, key, value):
+        pass
+
+    def add(self, key, value):
+        pass
+
+
+NOOP_SPAN = NoopSpan()
+
+current_span: ContextVar = ContextVar("current_span", default=None)
+
+
+class _Trace:
+    """Spans of one trace, held until its root ends so fast traces can be dropped whole"""
+
+    __slots__ = ("spans", "done")
+
+    def __init__(self):
+        self.spans = []
+        self.done = False
+
+
+class ConsoleExporter:
+    def export(self, spans):
+        for span in spans:
+            sys.stderr.write(json.dumps(span, default=str) + "\n")
+
+
+class FileExporter:
+    """JSON lines, one span per line; group by trace_id to rebuild a request's tree"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def export(self, spans):
+        with open(self.path, "a") as f:
+            for span in spans:
+                f.write(json.dumps(span, default=str) + "\n")
+
+
+def load_exporter(spec):
+    """'console', 'file' (TRACE_FILE), 'package.module:factory' for any object with export(spans), or None"""
+    spec = (spec or "").strip()
+    if spec in ("", "none"):
+        return None
+    if spec == "console":
+        return ConsoleExporter()
+    if spec == "file":
+        return FileExporter(os.getenv("TRACE_FILE", "traces.jsonl"))
+    module_name, _, attr = spec.partition(":")
+    return getattr(importlib.import_module(module_name), attr)()
+
+
+class Tracer:
+    """Request-scoped spans carried in a ContextVar, exported off the request path.
+
+    Whether a trace is recorded is decided once at its root (TRACE_SAMPLE_RATE, or
+    the sampled flag of an incoming traceparent); when it isn't, every span in it is
+    the no-op span. Traces whose root is faster than `min_duration` are dropped, so
+    the sink can be left to collect only the slow requests worth reading. Finished
+    traces go through a bounded queue to a background thread; when the exporter
+    falls behind, traces are dropped and counted rather than slowing requests.
+    """
+
+    def __init__(self, exporter, sample_rate, min_duration, queue_size=1000):
+        self.exporter = exporter
+        self.enabled = exporter is not None
+        self.sample_rate = sample_rate
+        self.min_duration = min_duration
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = None
+        self._thread_lock = threading.Lock()
+
+        metrics.register_gauge("trace_spans_dropped", lambda: self.dropped)
+
+    @contextmanager
+    def root(self, name, traceparent=None, **attributes):
+        """Start a trace, continuing the caller's when a W3C traceparent header is given"""
+        if not self.enabled:
+            yield NOOP_SPAN
+            return
+
+        trace_id, parent_id, sampled = self._parse_traceparent(traceparent)
+        if sampled is None:
+            sampled = random.random() < self.sample_rate
+        if not sampled:
+            token = current_span.set(NOOP_SPAN)
+            try:
+                yield NOOP_SPAN
+            finally:
+                current_span.reset(token)
+            return
+
+        span = Span(name, trace_id or f"{random.getrandbits(128):032x}", parent_id, _Trace(), attributes)
+        with self._activate(span, root=True):
+            yield span
+
+    @contextmanager
+    def span(self, name, **attributes):
+        parent = current_span.get()
+        if parent is None:
+            # Outside a request (background task, CLI): its own trace
+            with self.root(name, **attributes) as span:
+                yield span
+            return
+        if not parent.recording:
+            yield NOOP_SPAN
+            return
+
+        span = Span(name, parent.trace_id, parent.span_id, parent.trace, attributes)
+        with self._activate(span, root=False):
+            yield span
+
+    @contextmanager
+    def _activate(self, span, root):
+        token = current_span.set(span)
+        started = time.perf_counter()
+        try:
+            yield span
+        except BaseException as e:
+            span.error = f"{type(e).__name__}: {str(e)}"
+            raise
+        finally:
+            span.duration = time.perf_counter() - started
+            current_span.reset(token)
+            self._finish(span, root)
+
+    def _finish(self, span, root):
+        trace = span.trace
+        if not root:
+            if trace.done:
+                # Outlived its root (e.g. a task left running): goes out on its own
+                self._enqueue([span])
+            else:
+                trace.spans.append(span)
+            return
+
+        trace.done = True
+        if span.duration >= self.min_duration:
+            self._enqueue(trace.spans + [span])
+        trace.spans = []
+
+    def _enqueue(self, spans):
+        self._ensure_thread()
+        try:
+            self._queue.put_nowait(spans)
+        except queue.Full:
+            self.dropped += len(spans)
+
+    def _ensure_thread(self):
+        if self._thread is None:
+            with self._thread_lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._export_loop, name="trace-exporter", daemon=True)
+                    self._thread.start()
+
+    def _export_loop(self):
+        while True:
+            spans = self._queue.get()
+            if spans is None:
+                return
+            try:
+                self.exporter.export([span.to_dict() for span in spans])
+            except Exception as e:
+                self.dropped += len(spans)
+                logger.warning(f"trace export failed | {type(e).__name__}: {str(e)}")
+
+    def shutdown(self, timeout=5):
+        """Flush queued traces before the process exits"""
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join(timeout)
+
+    def _parse_traceparent(self, header):
+        # version-traceid-parentid-flags; anything malformed starts a fresh trace
+        parts = (header or "").strip().split("-")
+        if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16 or parts[1] == "0" * 32:
+            return None, None, None
+        try:
+            int(parts[1], 16), int(parts[2], 16)
+            sampled = bool(int(parts[3], 16) & 1)
+        except ValueError:
+            return None, None, None
+        return parts[1], parts[2], sampled
+
+
+def traced(name):
+    """Run the decorated (sync) function inside a span called `name`"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not tracer.enabled:
+                return func(*args, **kwargs)
+            with tracer.span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def payload_bytes(value):
+    """Bytes carried by binary values in a (nested) result or argument list"""
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return len(value)
+    if isinstance(value, (list, tuple)):
+        return sum(payload_bytes(item) for item in value)
+    if isinstance(value, dict):
+        return sum(payload_bytes(item) for item in value.values())
+    return 0
+
+
+tracer = Tracer(
+    load_exporter(os.getenv("TRACE_EXPORTER", "none")),
+    sample_rate=float(os.getenv("TRACE_SAMPLE_RATE", 1.0)),
+    min_duration=float(os.getenv("TRACE_MIN_DURATION_MS", 0)) / 1000,
+    queue_size=int(os.getenv("TRACE_QUEUE_SIZE", 1000))
+)
@@ -0,0 +1,143 @@
+from collections import OrderedDict
+from dotenv import load_dotenv
+from pathlib import Path
+import os
+import shutil
+import tempfile
+import threading
+import time
+from .metrics import metrics
+
+
+class VariantCache:
+    """Byte-budget LRU of resized variants on local disk, shared by all workers.
+
+    Files live at root/user_id/image_id/<width>.<ext>, so deleting an image drops
+    all of its variants at once. Recency is the file's mtime (bumped on every hit),
+    so it is shared too. Each worker rebuilds its index from a scan of the directory
+    at first use and every `rescan_interval` seconds, picking up files written before
+    a restart or by other workers, and evicts the oldest until the whole directory
+    is within the budget again.
+    """
+
+    def __init__(self, root, max_bytes, rescan_interval=300):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.rescan_interval = rescan_interval
+        self._index = OrderedDict()
+        self._size = 0
+        self._next_scan = 0.0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        metrics.register_gauge("variant_cache_hit_rate", self._hit_rate)
+        metrics.register_gauge("variant_cache_bytes", lambda: self._size)
+        metrics.register_gauge("variant_cache_files", lambda: len(self._index))
+
+    @classmethod
+    def from_env(cls):
+        load_dotenv()
+        return cls(
+            os.getenv("VARIANT_CACHE_DIR", os.path.join(tempfile.gettempdir(), "unmarble-variants")),
+            # The directory's total, not a per-worker share: every worker evicts across all of it
+            int(os.getenv("VARIANT_CACHE_MB", 512)) * 1024 * 1024,
+            float(os.getenv("VARIANT_CACHE_RESCAN_SECONDS", 300))
+        )
+
+    def _hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def _path(self, user_id, image_id, width, ext):
+        return self.root / str(user_id) / str(image_id) / f"{width}.{ext}"
+
+    def get(self, user_id, image_id, width, ext):
+        path = self._path(user_id, image_id, width, ext)
+        try:
+            data = path.read_bytes()
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            metrics.inc("variant_cache_misses_total")
+            return None
+
+        with self._lock:
+            self.hits += 1
+            if path in self._index:
+                self._index.move_to_end(path)
+            else:
+                # Written by another worker since the last scan
+                self._index[path] = len(data)
+                self._size += len(data)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        metrics.inc("variant_cache_hits_total")
+        return data
+
+    def put(self, user_id, image_id, width, ext, data):
+        if len(data) > self.max_bytes:
+            return
+        path = self._path(user_id, image_id, width, ext)
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        # Write then rename so concurrent readers never see a partial file
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+
+        if time.monotonic() >= self._next_scan:
+            self._rescan()
+
+        evicted = []
+        with self._lock:
+            self._size += len(data) - self._index.pop(path, 0)
+            self._index[path] = len(data)
+            while self._size > self.max_bytes:
+                old_path, old_size = self._index.popitem(last=False)
+                self._size -= old_size
+                evicted.append(old_path)
+
+        for old_path in evicted:
+            old_path.unlink(missing_ok=True)
+        if evicted:
+            metrics.inc("variant_cache_evictions_total", len(evicted))
+
+    def _rescan(self):
+        """Rebuild the index from the files on disk, least recently used first"""
+        self._next_scan = time.monotonic() + self.rescan_interval
+        files = []
+        for path in self.root.glob("*/*/*"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            if path.suffix == ".tmp":
+                # Left behind by a writer that died mid-write
+                if stat.st_mtime < time.time() - 3600:
+                    path.unlink(missing_ok=True)
+                continue
+            files.append((stat.st_mtime, path, stat.st_size))
+        files.sort()
+
+        with self._lock:
+            self._index = OrderedDict((path, size) for _, path, size in files)
+            self._size = sum(size for _, _, size in files)
+        metrics.inc("variant_cache_rescans_total")
+
+    def delete(self, user_id, image_id):
+        directory = self.root / str(user_id) / str(image_id)
+        with self._lock:
+            for path in [p for p in self._index if p.parent == directory]:
+                self._size -= self._index.pop(path)
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+variant_cache = VariantCache.from_env()
@@ -0,0 +1,51 @@
+import logging
+import os
+import random
+import signal
+
+
+logger = logging.getLogger(__name__)
+
+
+def worker_count():
+    """Number of server processes sharing this host's limits (set by api.server)"""
+    return max(1, int(os.getenv("WEB_CONCURRENCY", 1)))
+
+
+def per_worker(total, minimum=1):
+    """Split a deployment-wide limit evenly across worker processes, but never below `minimum`"""
+    return max(int(minimum), int(total) // worker_count())
+
+
+def recycle_limit():
+    """Requests this worker serves before it is replaced; 0 never replaces it.
+
+    MAX_REQUESTS plus a random part of MAX_REQUESTS_JITTER, so workers started
+    together don't all restart at the same moment. Always 0 for a single worker:
+    uvicorn runs it without a supervisor, so an exit would stop the server.
+    """
+    max_requests = int(os.getenv("MAX_REQUESTS", 0))
+    if max_requests <= 0 or worker_count() <= 1:
+        return 0
+    return max_requests + random.randint(0, int(os.getenv("MAX_REQUESTS_JITTER", max_requests // 5)))
+
+
+class RecycleMiddleware:
+    """Pure ASGI middleware: once the worker has served `max_requests`, it shuts down gracefully.
+
+    Same mechanism as uvicorn's own limit (SIGTERM drains in-flight requests, then
+    the supervisor starts a fresh worker), but with a per-worker limit.
+    """
+
+    def __init__(self, app, max_requests):
+        self.app = app
+        self.max_requests = max_requests
+        self.requests = 0
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and self.max_requests:
+            self.requests += 1
+            if self.requests == self.max_requests:
+                logger.warning(f"worker {os.getpid()} served {self.requests} requests, recycling")
+                os.kill(os.getpid(), signal.SIGTERM)
+        await self.app(scope, receive, send)
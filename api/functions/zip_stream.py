@@ -0,0 +1,131 @@
+import struct
+
+ZIP64_LIMIT = 0xFFFFFFFF
+LOCAL_HEADER_SIZE = 30
+DATA_DESCRIPTOR_SIZE = 16
+CENTRAL_RECORD_SIZE = 46
+ZIP64_OFFSET_EXTRA_SIZE = 12
+ZIP64_END_SIZE = 56 + 20
+END_SIZE = 22
+# Bit 3: CRC comes in a data descriptor after the data, so entries can be written as they're read
+FLAGS = 0x08
+
+
+class ZipEntry:
+    __slots__ = ("name", "size", "modified", "crc", "offset", "source")
+
+    def __init__(self, name, size, modified, crc=None, source=None):
+        self.name = name.encode()
+        self.size = size
+        self.modified = modified
+        self.crc = crc
+        self.offset = None
+        self.source = source
+
+    @property
+    def data_offset(self):
+        return self.offset + LOCAL_HEADER_SIZE + len(self.name)
+
+    @property
+    def descriptor_offset(self):
+        return self.data_offset + self.size
+
+    @property
+    def end_offset(self):
+        return self.descriptor_offset + DATA_DESCRIPTOR_SIZE
+
+
+class StoredZip:
+    """Byte-exact layout of an uncompressed (store mode) ZIP whose entry sizes are known up front.
+
+    Every offset, and the total size, is fixed before any data is read, so the
+    archive can be streamed with a Content-Length and any byte range of it can be
+    produced on its own. CRCs are only needed for the data descriptors and the
+    central directory. Switches to ZIP64 end records past 4GB or 65535 entries.
+    """
+
+    def __init__(self, entries):
+        self.entries = entries
+        offset = 0
+        for entry in entries:
+            if entry.size >= ZIP64_LIMIT:
+                raise ValueError(f"{entry.name!r} is too large for a stored entry")
+            entry.offset = offset
+            offset = entry.end_offset
+
+        self.directory_offset = offset
+        self.directory_size = sum(
+            CENTRAL_RECORD_SIZE + len(entry.name) + (ZIP64_OFFSET_EXTRA_SIZE if entry.offset >= ZIP64_LIMIT else 0)
+            for entry in entries
+        )
+        self.zip64 = (
+            len(entries) > 0xFFFF
+            or self.directory_offset >= ZIP64_LIMIT
+            or self.directory_size >= ZIP64_LIMIT
+        )
+        self.size = self.directory_offset + self.directory_size + (ZIP64_END_SIZE if self.zip64 else 0) + END_SIZE
+
+    def local_header(self, entry):
+        dos_time, dos_date = dos_datetime(entry.modified)
+        return struct.pack(
+            "<IHHHHHIIIHH",
+            0x04034B50, 20, FLAGS, 0, dos_time, dos_date,
+            0, 0, 0, len(entry.name), 0
+        ) + entry.name
+
+    def data_descriptor(self, entry):
+        return struct.pack("<IIII", 0x08074B50, entry.crc, entry.size, entry.size)
+
+    def central_record(self, entry):
+        dos_time, dos_date = dos_datetime(entry.modified)
+        extra = b""
+        offset = entry.offset
+        if offset >= ZIP64_LIMIT:
+            extra = struct.pack("<HHQ", 0x0001, 8, offset)
+            offset = ZIP64_LIMIT
+        version = 45 if extra else 20
+        return struct.pack(
+            "<IHHHHHHIIIHHHHHII",
+            0x02014B50, version, version, FLAGS, 0, dos_time, dos_date,
+            entry.crc, entry.size, entry.size, len(entry.name), len(extra), 0, 0, 0, 0, offset
+        ) + entry.name + extra
+
+    def end_records(self):
+        count = len(self.entries)
+        records = b""
+        if self.zip64:
+            zip64_end_offset = self.directory_offset + self.directory_size
+            records += struct.pack(
+                "<IQHHIIQQQQ",
+                0x06064B50, 44, 45, 45, 0, 0, count, count, self.directory_size, self.directory_offset
+            )
+            records += struct.pack("<IIQI", 0x07064B50, 0, zip64_end_offset, 1)
+        records += struct.pack(
+            "<IHHHHIIH",
+            0x06054B50, 0, 0, min(count, 0xFFFF), min(count, 0xFFFF),
+            min(self.directory_size, ZIP64_LIMIT), min(self.directory_offset, ZIP64_LIMIT), 0
+        )
+        return records
+
+
+def dos_datetime(value):
+    # DOS timestamps start in 1980 and have 2-second resolution
+    if value is None or value.year < 1980:
+        return 0, (1 << 5) | 1
+    return (
+        (value.hour << 11) | (value.minute << 5) | (value.second // 2),
+        ((value.year - 1980) << 9) | (value.month << 5) | value.day
+    )
+
+
+def overlaps(segment_start, length, start, end):
+    """Whether [segment_start, segment_start + length) meets the inclusive range [start, end]"""
+    return length > 0 and segment_start <= end and segment_start + length > start
+
+
+def clip(segment_start, data, start, end):
+    """The part of `data` (placed at segment_start) inside [start, end], without copying"""
+    view = memoryview(data)
+    lo = max(start - segment_start, 0)
+    hi = min(end + 1 - segment_start, len(view))
+    return view[lo:hi]
@@ -1,21 +1,46 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from contextlib import asynccontextmanager
+import asyncio
 import os
 
-# Logging
-import logging
-error_handler = logging.FileHandler(os.path.join(os.path.dirname(os.path.dirname(__file__)), 'errors.log'))
-error_handler.setLevel(logging.ERROR)
-error_handler.setFormatter(logging.Formatter('%(asctime)s | %(message)s', datefmt='%Y-%m-%d %H:%M:%S'))
-
-logging.basicConfig(
-    level=logging.ERROR,
-    handlers=[error_handler]
-)
+# Logging: JSON lines written to errors.log by a background thread
+from .functions.structured_logging import setup_logging, RequestContextMiddleware
+log_listener = setup_logging(os.path.join(os.path.dirname(os.path.dirname(__file__)), 'errors.log'))
 
 # API
 from .endpoints import router
-app = FastAPI(title="Unmarble API", version="1.0.0")
+from .db.archive import run_archiver, ARCHIVE_INTERVAL
+from .db.idempotency import run_purger, IDEMPOTENCY_PURGE_INTERVAL
+from .db.database import Database
+from .functions.cold_storage import cold_tier
+from .functions.image_pool import image_pool
+from .functions.loop_lag import loop_lag
+from .functions.tracing import tracer
+from .functions.worker_limits import RecycleMiddleware, recycle_limit
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Cold-tier archiver runs in every worker; row locks keep them from overlapping
+    archiver = None
+    if cold_tier and ARCHIVE_INTERVAL > 0:
+        archiver = asyncio.create_task(run_archiver())
+    lag_monitor = asyncio.create_task(loop_lag.run())
+    purger = None
+    if IDEMPOTENCY_PURGE_INTERVAL > 0:
+        purger = asyncio.create_task(run_purger())
+    yield
+    lag_monitor.cancel()
+    if archiver:
+        archiver.cancel()
+    if purger:
+        purger.cancel()
+    image_pool.shutdown()
+    Database.close_pool()
+    tracer.shutdown()
+    log_listener.stop()
+
+app = FastAPI(title="Unmarble API", version="1.0.0", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -30,6 +55,11 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+app.add_middleware(RequestContextMiddleware)
+
+# Set by api.server; off when the app is run on its own
+app.add_middleware(RecycleMiddleware, max_requests=recycle_limit())
+
 app.include_router(router, prefix="/v1")
 
 @app.get("/")
@@ -0,0 +1,46 @@
+import logging
+import os
+import uvicorn
+
+
+logger = logging.getLogger(__name__)
+
+
+def main():
+    """Production launcher: python -m api.server
+
+    Runs WEB_CONCURRENCY pre-started worker processes (default: CPU count) under
+    uvicorn's supervisor. SIGHUP restarts workers one by one, SIGTERM drains
+    in-flight requests for up to GRACEFUL_TIMEOUT seconds, and workers exit and
+    are replaced after MAX_REQUESTS (+ up to MAX_REQUESTS_JITTER) requests to bound
+    memory held by image buffers. A single worker runs without a supervisor, so
+    nothing would replace it: it is never recycled.
+    """
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    workers = int(os.getenv("WEB_CONCURRENCY", os.cpu_count() or 1))
+    # Workers inherit the environment and use it to size their share of pools and limits
+    os.environ["WEB_CONCURRENCY"] = str(workers)
+
+    # Recycling is done by the workers (RecycleMiddleware) so each gets its own jittered limit
+    max_requests = int(os.getenv("MAX_REQUESTS", 2000)) if workers > 1 else 0
+    max_requests_jitter = int(os.getenv("MAX_REQUESTS_JITTER", max_requests // 5))
+    os.environ["MAX_REQUESTS"] = str(max_requests)
+    os.environ["MAX_REQUESTS_JITTER"] = str(max_requests_jitter)
+    if max_requests:
+        logger.info(f"Starting {workers} worker(s), recycling each after {max_requests}-{max_requests + max_requests_jitter} requests")
+    else:
+        logger.info(f"Starting {workers} worker(s), without recycling")
+
+    uvicorn.run(
+        "api.main:app",
+        host=os.getenv("HOST", "0.0.0.0"),
+        port=int(os.getenv("PORT", 8000)),
+        workers=workers,
+        timeout_graceful_shutdown=int(os.getenv("GRACEFUL_TIMEOUT", 30)),
+        timeout_keep_alive=int(os.getenv("KEEP_ALIVE", 5)),
+    )
+
+
+if __name__ == "__main__":
+    main()
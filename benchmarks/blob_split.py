@@ -0,0 +1,173 @@
+"""Gallery listing and fav-toggle throughput: blobs in-row vs split into a blob table.
+
+Builds both layouts in a scratch schema with incompressible payloads (like
+JPEG/PNG/WEBP), runs the listing and fav-toggle queries the API uses against
+each, prints ops/s and table sizes, then drops the schema.
+
+    python -m benchmarks.blob_split --users 20 --images 10 --blob-kb 2048
+"""
+import argparse
+import os
+import random
+import time
+import psycopg2
+from api.db.database import Database
+
+SCHEMA = "bench_blob_split"
+
+SETUP = """
+DROP SCHEMA IF EXISTS {schema} CASCADE;
+CREATE SCHEMA {schema};
+
+CREATE TABLE {schema}.wide (
+    image_id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    user_id UUID NOT NULL,
+    category VARCHAR(20) NOT NULL,
+    image_bytes BYTEA,
+    preview_bytes BYTEA,
+    faved BOOLEAN DEFAULT FALSE,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE {schema}.narrow (
+    image_id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    user_id UUID NOT NULL,
+    category VARCHAR(20) NOT NULL,
+    preview_bytes BYTEA,
+    faved BOOLEAN DEFAULT FALSE,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE TABLE {schema}.narrow_blobs (
+    image_id UUID PRIMARY KEY REFERENCES {schema}.narrow(image_id) ON DELETE CASCADE,
+    user_id UUID NOT NULL,
+    image_bytes BYTEA NOT NULL
+);
+ALTER TABLE {schema}.narrow_blobs ALTER COLUMN image_bytes SET STORAGE EXTERNAL;
+ALTER TABLE {schema}.narrow ALTER COLUMN preview_bytes SET STORAGE EXTERNAL;
+
+CREATE INDEX ON {schema}.wide (user_id, created_at DESC);
+CREATE INDEX ON {schema}.narrow (user_id, created_at DESC);
+"""
+
+
+def populate(cursor, users, images, blob_kb, preview_kb):
+    rows = []
+    for _ in range(users):
+        cursor.execute("SELECT gen_random_uuid()")
+        user_id = cursor.fetchone()[0]
+        for i in range(images):
+            category = "yourself" if i % 2 else "clothing"
+            rows.append((user_id, category, os.urandom(blob_kb * 1024), os.urandom(preview_kb * 1024)))
+
+    start = time.perf_counter()
+    for user_id, category, image_bytes, preview_bytes in rows:
+        cursor.execute(
+            f"INSERT INTO {SCHEMA}.wide (user_id, category, image_bytes, preview_bytes) VALUES (%s, %s, %s, %s)",
+            (user_id, category, image_bytes, preview_bytes)
+        )
+    wide_insert = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for user_id, category, image_bytes, preview_bytes in rows:
+        cursor.execute(f"""
+            WITH new_image AS (
+                INSERT INTO {SCHEMA}.narrow (user_id, category, preview_bytes)
+                VALUES (%s, %s, %s)
+                RETURNING image_id, user_id
+            )
+            INSERT INTO {SCHEMA}.narrow_blobs (image_id, user_id, image_bytes)
+            SELECT image_id, user_id, %s FROM new_image
+        """, (user_id, category, preview_bytes, image_bytes))
+    narrow_insert = time.perf_counter() - start
+
+    return sorted({row[0] for row in rows}), len(rows), wide_insert, narrow_insert
+
+
+def bench_listing(conn, table, user_ids, iterations):
+    cursor = conn.cursor()
+    start = time.perf_counter()
+    for _ in range(iterations):
+        cursor.execute(f"""
+            SELECT image_id, category, preview_bytes, faved, created_at
+            FROM {SCHEMA}.{table}
+            WHERE user_id = %s
+            ORDER BY created_at DESC
+        """, (random.choice(user_ids),))
+        cursor.fetchall()
+    conn.commit()
+    cursor.close()
+    return iterations / (time.perf_counter() - start)
+
+
+def bench_fav_toggle(conn, table, iterations):
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT image_id, user_id FROM {SCHEMA}.{table}")
+    targets = cursor.fetchall()
+    conn.commit()
+
+    start = time.perf_counter()
+    for _ in range(iterations):
+        image_id, user_id = random.choice(targets)
+        cursor.execute(f"""
+            UPDATE {SCHEMA}.{table}
+            SET faved = NOT faved
+            WHERE image_id = %s AND user_id = %s
+            RETURNING faved
+        """, (image_id, user_id))
+        cursor.fetchone()
+        conn.commit()
+    cursor.close()
+    return iterations / (time.perf_counter() - start)
+
+
+def table_sizes(cursor, table):
+    cursor.execute(
+        "SELECT pg_relation_size(%s), pg_total_relation_size(%s)",
+        (f"{SCHEMA}.{table}", f"{SCHEMA}.{table}")
+    )
+    return cursor.fetchone()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--images", type=int, default=10, help="images per user")
+    parser.add_argument("--blob-kb", type=int, default=2048)
+    parser.add_argument("--preview-kb", type=int, default=40)
+    parser.add_argument("--iterations", type=int, default=2000)
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(**Database._config())
+    cursor = conn.cursor()
+    try:
+        cursor.execute(SETUP.format(schema=SCHEMA))
+        user_ids, row_count, wide_insert, narrow_insert = populate(
+            cursor, args.users, args.images, args.blob_kb, args.preview_kb
+        )
+        conn.commit()
+        conn.autocommit = True
+        cursor.execute(f"VACUUM ANALYZE {SCHEMA}.wide")
+        cursor.execute(f"VACUUM ANALYZE {SCHEMA}.narrow")
+        cursor.execute(f"VACUUM ANALYZE {SCHEMA}.narrow_blobs")
+        conn.autocommit = False
+
+        print(f"{row_count} rows, {args.blob_kb} KB blobs, {args.preview_kb} KB previews, {args.iterations} iterations")
+        print(f"{'layout':<8} {'insert s':>9} {'list ops/s':>11} {'fav ops/s':>10} {'heap MB':>8} {'total MB':>9}")
+        for table, insert_seconds in (("wide", wide_insert), ("narrow", narrow_insert)):
+            listing = bench_listing(conn, table, user_ids, args.iterations)
+            fav = bench_fav_toggle(conn, table, args.iterations)
+            heap, total = table_sizes(cursor, table)
+            if table == "narrow":
+                total += table_sizes(cursor, "narrow_blobs")[1]
+            conn.commit()
+            print(f"{table:<8} {insert_seconds:>9.2f} {listing:>11.0f} {fav:>10.0f} {heap / 2**20:>8.2f} {total / 2**20:>9.1f}")
+    finally:
+        conn.rollback()
+        conn.autocommit = True
+        cursor.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+        cursor.close()
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
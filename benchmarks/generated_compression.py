@@ -0,0 +1,121 @@
+"""Bytes saved and download time of re-encoding generated images, per output format.
+
+Runs ImageFunctions.compress_generated over a sample set with each candidate
+format/quality (so the min-savings and max-side thresholds apply as in production)
+and prints total size, savings, encode time, PSNR against the model output and
+the mean time to download the base64 JSON payload on a few link speeds.
+
+    python -m benchmarks.generated_compression --limit 50        # sample generation_blobs
+    python -m benchmarks.generated_compression --dir samples/    # image files on disk
+    python -m benchmarks.generated_compression --synthetic 20    # no DB needed
+"""
+import argparse
+import io
+import math
+import random
+import statistics
+import time
+from pathlib import Path
+from PIL import Image, ImageChops, ImageFilter, ImageStat, features
+from api.db.database import Database
+from api.functions.image_functions import ImageFunctions
+
+# (label, format, quality, lossless)
+CANDIDATES = [
+    ("none", "NONE", None, None),
+    ("png", "PNG", None, None),
+    ("webp-lossless", "WEBP", 100, True),
+    ("webp-q90", "WEBP", 90, False),
+    ("webp-q80", "WEBP", 80, False),
+    ("jpeg-q90", "JPEG", 90, False),
+    ("avif-q70", "AVIF", 70, False),
+]
+
+# Link speeds in Mbit/s
+LINKS = [("3g", 1.5), ("4g", 10), ("wifi", 50)]
+
+
+def load_samples(args):
+    if args.dir:
+        return [p.read_bytes() for p in sorted(Path(args.dir).iterdir()) if p.is_file()][:args.limit]
+
+    if args.synthetic:
+        samples = []
+        rng = random.Random(0)
+        for _ in range(args.synthetic):
+            # Smooth noise plus detail, roughly photo-like to the encoders
+            image = Image.effect_noise((1024, 1536), 64).convert("RGB")
+            image = image.filter(ImageFilter.GaussianBlur(rng.uniform(1, 4)))
+            overlay = Image.linear_gradient("L").resize(image.size).convert("RGB")
+            image = Image.blend(image, overlay, 0.4)
+            output = io.BytesIO()
+            image.save(output, format="PNG")
+            samples.append(output.getvalue())
+        return samples
+
+    with Database() as db:
+        db.cursor.execute(
+            "SELECT image_bytes FROM generation_blobs ORDER BY random() LIMIT %s",
+            (args.limit,)
+        )
+        return [bytes(row[0]) for row in db.cursor.fetchall()]
+
+
+def psnr(original_bytes, compressed_bytes):
+    original = Image.open(io.BytesIO(original_bytes)).convert("RGB")
+    compressed = Image.open(io.BytesIO(compressed_bytes)).convert("RGB")
+    if compressed.size != original.size:
+        original = original.resize(compressed.size, Image.LANCZOS)
+    mse = statistics.mean(v ** 2 for v in ImageStat.Stat(ImageChops.difference(original, compressed)).rms)
+    return math.inf if mse == 0 else 10 * math.log10(255 ** 2 / mse)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--limit", type=int, default=50)
+    parser.add_argument("--dir")
+    parser.add_argument("--synthetic", type=int, default=0, help="generate this many images instead of reading any")
+    args = parser.parse_args()
+
+    imgf = ImageFunctions()
+    samples = load_samples(args)
+    if not samples:
+        raise SystemExit("No samples")
+    original_total = sum(len(s) for s in samples)
+
+    print(f"{len(samples)} samples, {original_total / 2**20:.1f} MB, min savings {imgf.generated_min_savings:.0%}, max side {imgf.generated_max_side}")
+    header = f"{'format':<14} {'MB':>7} {'saved':>6} {'kept':>5} {'enc ms':>7} {'psnr':>6}"
+    print(header + "".join(f" {name + ' s':>8}" for name, _ in LINKS))
+
+    for label, image_format, quality, lossless in CANDIDATES:
+        if image_format == "AVIF" and not features.check("avif"):
+            continue
+
+        total = 0
+        kept = 0
+        encode_seconds = []
+        psnrs = []
+        for sample in samples:
+            start = time.perf_counter()
+            compressed = imgf.compress_generated(sample, image_format, quality, lossless)
+            encode_seconds.append(time.perf_counter() - start)
+            total += len(compressed)
+            if compressed is sample:
+                kept += 1
+            else:
+                psnrs.append(psnr(sample, compressed))
+
+        # What a client downloads: the bytes base64-encoded in the JSON response
+        mean_payload_bits = total / len(samples) * 4 / 3 * 8
+        downloads = "".join(f" {mean_payload_bits / (mbps * 1e6):>8.2f}" for _, mbps in LINKS)
+        finite = [p for p in psnrs if math.isfinite(p)]
+        quality_text = f"{statistics.mean(finite):>6.1f}" if finite else f"{'lossl' if psnrs else '-':>6}"
+
+        print(
+            f"{label:<14} {total / 2**20:>7.2f} {1 - total / original_total:>6.1%} {kept:>5} "
+            f"{statistics.median(encode_seconds) * 1000:>7.0f} {quality_text}{downloads}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""Peak RSS of concurrent upload and full-image download payload handling, before and after.
+
+Each mode runs in a fresh process: N concurrent requests each parse an upload
+JSON body, decode it, build the preview and render a full-image base64 response.
+"before" follows the old handlers: the body stays cached on the request, the
+parsed base64 text is kept, and JSONResponse is built over a base64 str. "after"
+uses the current handlers' path, which drops the body once parsed. Both modes
+run under the same memory budget reservation per request, so the difference is
+the buffers themselves. Prints peak RSS above the idle baseline. No database needed.
+
+    python -m benchmarks.payload_memory --concurrency 16 --image-mb 6 --budget-mb 128
+"""
+import argparse
+import asyncio
+import base64
+import io
+import json
+import multiprocessing
+import os
+import resource
+import time
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+
+
+def make_upload_body(image_mb):
+    # Noise compresses badly, so side ~ sqrt(bytes) gets near the target JPEG size
+    side = int((image_mb * 1024 * 1024 / 0.9) ** 0.5)
+    image = Image.effect_noise((side, side), 80).convert("RGB")
+    output = io.BytesIO()
+    image.save(output, format="JPEG", quality=95)
+    image_bytes = output.getvalue()
+    return json.dumps({"category": "yourself", "imageBytes": base64.b64encode(image_bytes).decode()}).encode(), len(image_bytes)
+
+
+def handle_before(imgf, request_body):
+    from fastapi.responses import JSONResponse
+
+    # request.json(): the body stays referenced by the request until the response is sent
+    body = request_body[0]
+    data = json.loads(body)
+    image_base64 = data.get("imageBytes")
+    decoded_bytes = base64.b64decode(image_base64)
+    preview_bytes = imgf.create_preview(decoded_bytes)
+    response = JSONResponse(content={"image_base64": base64.b64encode(decoded_bytes).decode('utf-8')})
+    return len(response.body) + len(preview_bytes) + len(data)
+
+
+def handle_after(imgf, request_body):
+    from api.endpoints import base64_json_response
+
+    # read_body(): the handler holds the only reference, and drops it after parsing
+    body = request_body.pop()
+    data = json.loads(body)
+    del body
+    decoded_bytes = base64.b64decode(data.pop("imageBytes"))
+    del data
+    preview_bytes = imgf.create_preview(decoded_bytes)
+    response = base64_json_response({}, "image_base64", decoded_bytes)
+    return len(response.body) + len(preview_bytes)
+
+
+def run_mode(mode, concurrency, rounds, image_mb, budget_mb, results):
+    os.environ.setdefault("IMAGE_BACKEND", "simulated")
+    from api.endpoints import imgf
+    from api.functions.memory_budget import MemoryBudget
+
+    body, image_size = make_upload_body(image_mb)
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    handler = handle_before if mode == "before" else handle_after
+    budget = MemoryBudget(budget_mb * 1024 * 1024, timeout=600)
+
+    async def request():
+        # Same reservation in both modes; the body is read (copied) only once admitted, as it would be from the socket
+        async with budget.reserve(len(body) * 2):
+            request_body = [bytearray(body)]
+            return await asyncio.to_thread(handler, imgf, request_body)
+
+    async def main():
+        loop = asyncio.get_running_loop()
+        loop.set_default_executor(ThreadPoolExecutor(concurrency))
+        for _ in range(rounds):
+            await asyncio.gather(*(request() for _ in range(concurrency)))
+
+    start = time.perf_counter()
+    asyncio.run(main())
+    elapsed = time.perf_counter() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    results[mode] = (image_size, (peak - baseline) / 1024, elapsed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--rounds", type=int, default=2)
+    parser.add_argument("--image-mb", type=float, default=6)
+    parser.add_argument("--budget-mb", type=int, default=128)
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context("spawn")
+    results = context.Manager().dict()
+    for mode in ("before", "after"):
+        process = context.Process(
+            target=run_mode,
+            args=(mode, args.concurrency, args.rounds, args.image_mb, args.budget_mb, results)
+        )
+        process.start()
+        process.join()
+
+    image_size = results["before"][0]
+    print(f"{args.concurrency} concurrent requests x {args.rounds} rounds, {image_size / 2**20:.1f} MB JPEG, budget {args.budget_mb} MB")
+    print(f"{'mode':<8} {'peak RSS MB':>12} {'per request MB':>15} {'seconds':>8}")
+    for mode in ("before", "after"):
+        _, peak_mb, elapsed = results[mode]
+        print(f"{mode:<8} {peak_mb:>12.0f} {peak_mb / args.concurrency:>15.1f} {elapsed:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
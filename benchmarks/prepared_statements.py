@@ -0,0 +1,190 @@
+"""Per-query latency and server time of hot queries: ad-hoc SQL vs prepared statements.
+
+Builds a users/generations scratch schema, then runs the get_user_info lookup and
+the fav toggle N times as plain parameterised SQL (parsed and planned on every
+call) and N times through PREPARE/EXECUTE on one connection. Prints client-side
+latency, the planner time EXPLAIN reports for one ad-hoc call, and server
+execution plus planning time from pg_stat_statements when the extension is
+installed (the DB CPU actually spent), then drops the schema.
+
+    python -m benchmarks.prepared_statements --users 1000 --iterations 5000
+"""
+import argparse
+import random
+import statistics
+import time
+import psycopg2
+from api.db.database import Database
+
+SCHEMA = "bench_prepared"
+
+SETUP = """
+DROP SCHEMA IF EXISTS {schema} CASCADE;
+CREATE SCHEMA {schema};
+
+CREATE TABLE {schema}.users (
+    user_id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    user_name VARCHAR(50) NOT NULL,
+    user_surname VARCHAR(50) NOT NULL,
+    user_email VARCHAR(100) UNIQUE NOT NULL,
+    picture_url TEXT,
+    user_type VARCHAR(20) DEFAULT 'free',
+    uploads_left INTEGER DEFAULT 10,
+    generations_left INTEGER DEFAULT 10,
+    recents_left INTEGER DEFAULT 10,
+    last_payment_at TIMESTAMP
+);
+
+CREATE TABLE {schema}.generations (
+    image_id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    user_id UUID NOT NULL REFERENCES {schema}.users(user_id),
+    faved BOOLEAN DEFAULT FALSE,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX ON {schema}.generations (user_id, created_at DESC);
+"""
+
+QUERIES = {
+    "get_user_info": (f"""
+        SELECT user_name, user_surname, user_email, picture_url, user_type, uploads_left, generations_left, recents_left, last_payment_at
+        FROM {SCHEMA}.users
+        WHERE user_id = %s
+    """, lambda users, images: (random.choice(users),)),
+    "update_fav": (f"""
+        UPDATE {SCHEMA}.generations
+        SET faved = NOT faved
+        WHERE image_id = %s AND user_id = %s
+        RETURNING faved
+    """, lambda users, images: random.choice(images)),
+}
+
+
+def populate(cursor, users, images_per_user):
+    cursor.execute(f"""
+        INSERT INTO {SCHEMA}.users (user_name, user_surname, user_email)
+        SELECT 'name', 'surname', 'user' || i || '@example.com' FROM generate_series(1, %s) i
+        RETURNING user_id
+    """, (users,))
+    user_ids = [str(row[0]) for row in cursor.fetchall()]
+
+    cursor.execute(f"""
+        INSERT INTO {SCHEMA}.generations (user_id)
+        SELECT user_id FROM {SCHEMA}.users, generate_series(1, %s)
+        RETURNING image_id, user_id
+    """, (images_per_user,))
+    images = [(str(row[0]), str(row[1])) for row in cursor.fetchall()]
+    return user_ids, images
+
+
+def numbered(query, count):
+    for i in range(1, count + 1):
+        query = query.replace("%s", f"${i}", 1)
+    return query
+
+
+def run(conn, name, query, make_params, users, images, iterations, prepared):
+    cursor = conn.cursor()
+    params = make_params(users, images)
+    if prepared:
+        cursor.execute(f"PREPARE bench_{name} AS {numbered(query, len(params))}")
+        statement = f"EXECUTE bench_{name} ({', '.join(['%s'] * len(params))})"
+    else:
+        statement = query
+
+    latencies = []
+    for _ in range(iterations):
+        params = make_params(users, images)
+        start = time.perf_counter()
+        cursor.execute(statement, params)
+        cursor.fetchall()
+        conn.commit()
+        latencies.append(time.perf_counter() - start)
+
+    if prepared:
+        cursor.execute(f"DEALLOCATE bench_{name}")
+    cursor.close()
+    latencies.sort()
+    return statistics.mean(latencies), latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.95)]
+
+
+def planning_ms(cursor, query, params):
+    cursor.execute(f"EXPLAIN (ANALYZE, SUMMARY) {query}", params)
+    for (line,) in cursor.fetchall():
+        if line.startswith("Planning Time"):
+            return float(line.split(":")[1].split()[0])
+    return None
+
+
+def server_stats(cursor):
+    """(query, calls, exec ms, plan ms) rows from pg_stat_statements, or None without it"""
+    try:
+        cursor.execute("""
+            SELECT query, calls, total_exec_time, total_plan_time
+            FROM pg_stat_statements
+            WHERE query LIKE %s
+        """, (f"%{SCHEMA}%",))
+    except psycopg2.Error:
+        cursor.connection.rollback()
+        return None
+    return cursor.fetchall()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--images", type=int, default=10, help="generations per user")
+    parser.add_argument("--iterations", type=int, default=5000)
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(**Database._config())
+    cursor = conn.cursor()
+    try:
+        cursor.execute(SETUP.format(schema=SCHEMA))
+        users, images = populate(cursor, args.users, args.images)
+        conn.commit()
+        conn.autocommit = True
+        cursor.execute(f"VACUUM ANALYZE {SCHEMA}.users")
+        cursor.execute(f"VACUUM ANALYZE {SCHEMA}.generations")
+        conn.autocommit = False
+
+        has_stats = server_stats(cursor) is not None
+        print(f"{args.users} users, {len(images)} generations, {args.iterations} iterations")
+        print(f"{'query':<15} {'mode':<9} {'mean us':>8} {'p50 us':>8} {'p95 us':>8} {'server ms':>10} {'plan ms':>8}")
+
+        for name, (query, make_params) in QUERIES.items():
+            plan = planning_ms(cursor, query, make_params(users, images))
+            conn.rollback()
+            for prepared in (False, True):
+                if has_stats:
+                    try:
+                        cursor.execute("SELECT pg_stat_statements_reset()")
+                        conn.commit()
+                    except psycopg2.Error:
+                        # Resetting needs superuser or an explicit grant
+                        conn.rollback()
+                        has_stats = False
+                mean, p50, p95 = run(conn, name, query, make_params, users, images, args.iterations, prepared)
+
+                server = plan_total = "-"
+                if has_stats:
+                    rows = [row for row in server_stats(cursor) if "EXPLAIN" not in row[0]]
+                    server = f"{sum(row[2] for row in rows):.1f}"
+                    plan_total = f"{sum(row[3] or 0 for row in rows):.1f}"
+                    conn.commit()
+
+                mode = "prepared" if prepared else "ad-hoc"
+                print(f"{name:<15} {mode:<9} {mean * 1e6:>8.0f} {p50 * 1e6:>8.0f} {p95 * 1e6:>8.0f} {server:>10} {plan_total:>8}")
+            print(f"{'':<15} planner time per ad-hoc call: {plan:.3f} ms")
+
+        if not has_stats:
+            print("pg_stat_statements is not available: server-side time not shown")
+    finally:
+        conn.rollback()
+        conn.autocommit = True
+        cursor.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+        cursor.close()
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,36 @@
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Importing api.endpoints builds an ImageFunctions; keep the model client out of tests
+os.environ.setdefault("IMAGE_BACKEND", "simulated")
+os.environ["WEB_CONCURRENCY"] = "1"
+
+
+class FakeClock:
+    """Stands in for the `time` module of the code under test: sleeping only advances the clock"""
+
+    def __init__(self, start=1000.0):
+        self.now = start
+
+    def monotonic(self):
+        return self.now
+
+    def perf_counter(self):
+        return self.now
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += max(seconds, 0)
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
@@ -0,0 +1,69 @@
+import asyncio
+import pytest
+from api.functions import admission
+from api.functions.admission import AdmissionController, AdmissionRejected
+
+
+@pytest.fixture
+def controller(clock, monkeypatch):
+    monkeypatch.setattr(admission, "time", clock)
+    monkeypatch.setenv("GENERATION_USER_RATE_PER_MIN", "6")
+    monkeypatch.setenv("GENERATION_USER_BURST", "2")
+    monkeypatch.setenv("GENERATION_GLOBAL_RATE_PER_MIN", "600")
+    monkeypatch.setenv("GENERATION_GLOBAL_BURST", "100")
+    monkeypatch.setenv("GENERATION_CONCURRENCY", "1")
+    monkeypatch.setenv("GENERATION_QUEUE_MAX", "2")
+    monkeypatch.setenv("GENERATION_QUEUE_TIMEOUT", "0.05")
+    return AdmissionController()
+
+
+def test_user_bucket_refills_over_time(controller, clock):
+    controller.admit("user").release()
+    controller.admit("user").release()
+    with pytest.raises(AdmissionRejected) as rejected:
+        controller.admit("user")
+    assert rejected.value.reason == "Too many generation requests"
+    # 6 per minute: one token every 10 seconds
+    assert rejected.value.retry_after == 10
+
+    clock.advance(10)
+    controller.admit("user").release()
+
+
+def test_batch_larger_than_burst_is_rejected(controller):
+    with pytest.raises(AdmissionRejected):
+        controller.admit("user", cost=3)
+
+
+def test_queue_bound_counts_admitted_calls(controller):
+    # One free slot plus a queue of two
+    admitted = [controller.admit(f"user{i}") for i in range(3)]
+    assert controller.queued == 3
+    with pytest.raises(AdmissionRejected) as rejected:
+        controller.admit("user3")
+    assert rejected.value.reason == "Generation queue is full"
+
+    admitted[0].release()
+    controller.admit("user3")
+    assert controller.queued == 3
+
+
+def test_slots_hand_back_admission_and_time_out(controller):
+    async def run():
+        first = controller.admit("user0")
+        second = controller.admit("user1")
+
+        async with first.slot():
+            assert controller.in_flight == 1
+            assert controller.admitted == 1
+            # The only slot is held: the second call waits GENERATION_QUEUE_TIMEOUT, then gives up
+            with pytest.raises(AdmissionRejected):
+                async with second.slot():
+                    pass
+
+        second.release()
+        first.release()
+
+    asyncio.run(run())
+    assert controller.queued == 0
+    assert controller.in_flight == 0
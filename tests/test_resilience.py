@@ -0,0 +1,130 @@
+import functools
+import pytest
+import tenacity
+from google.genai import errors as genai_errors
+from api.functions import image_functions, resilience
+from api.functions.resilience import CircuitBreaker, CircuitOpenError
+
+
+def server_error():
+    return genai_errors.ServerError(503, {"error": {"code": 503, "message": "unavailable", "status": "UNAVAILABLE"}})
+
+
+def fail():
+    raise server_error()
+
+
+@pytest.fixture
+def breaker(clock, monkeypatch):
+    monkeypatch.setattr(resilience, "time", clock)
+    return CircuitBreaker("test", window_size=10, min_calls=4, failure_threshold=0.5, open_seconds=30)
+
+
+@pytest.fixture
+def failing_backend(clock, monkeypatch):
+    """ImageFunctions on the failing backend, sleeping and retrying on the fake clock"""
+    monkeypatch.setenv("IMAGE_BACKEND", "failing")
+    monkeypatch.setenv("MODEL_INPUT_CACHE", "false")
+    monkeypatch.setenv("SIMULATED_LATENCY", "2")
+    monkeypatch.setenv("GEMINI_ATTEMPT_TIMEOUT", "60")
+    monkeypatch.setenv("GEMINI_MAX_ATTEMPTS", "3")
+    monkeypatch.setenv("GEMINI_BREAKER_MIN_CALLS", "6")
+    monkeypatch.setenv("GEMINI_BREAKER_OPEN_SECONDS", "30")
+    monkeypatch.setattr(resilience, "time", clock)
+    monkeypatch.setattr(image_functions, "time", clock)
+    monkeypatch.setattr(image_functions, "Retrying", functools.partial(tenacity.Retrying, sleep=clock.sleep))
+    return image_functions.ImageFunctions()
+
+
+def test_breaker_opens_at_threshold(breaker):
+    for _ in range(3):
+        with pytest.raises(genai_errors.ServerError):
+            breaker.call(fail)
+    # Below min_calls the failure rate doesn't count yet
+    assert breaker.state == CircuitBreaker.CLOSED
+
+    with pytest.raises(genai_errors.ServerError):
+        breaker.call(fail)
+    assert breaker.state == CircuitBreaker.OPEN
+
+    with pytest.raises(CircuitOpenError) as rejected:
+        breaker.call(lambda: "not called")
+    assert rejected.value.retry_after == 30
+
+
+def test_breaker_half_open_probe_reopens_then_closes(breaker, clock):
+    for _ in range(4):
+        with pytest.raises(genai_errors.ServerError):
+            breaker.call(fail)
+
+    clock.advance(30)
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+
+    # Only the probe goes through; calls made while it runs are rejected
+    def probe():
+        with pytest.raises(CircuitOpenError):
+            breaker.call(lambda: "not called")
+        raise server_error()
+
+    with pytest.raises(genai_errors.ServerError):
+        breaker.call(probe)
+    assert breaker.state == CircuitBreaker.OPEN
+
+    clock.advance(29)
+    with pytest.raises(CircuitOpenError):
+        breaker.call(lambda: "not called")
+
+    clock.advance(1)
+    assert breaker.call(lambda: "ok") == "ok"
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.failure_rate() == 0.0
+
+
+def test_breaker_ignores_non_transient_errors(breaker):
+    def bad_request():
+        raise genai_errors.ClientError(400, {"error": {"code": 400, "message": "bad", "status": "INVALID_ARGUMENT"}})
+
+    for _ in range(10):
+        with pytest.raises(genai_errors.ClientError):
+            breaker.call(bad_request)
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_failing_backend_retries_then_gives_up(failing_backend, clock):
+    start = clock.monotonic()
+    with pytest.raises(genai_errors.ServerError):
+        failing_backend.generate_image(b"person", b"clothing", deadline=start + 90)
+
+    # Three attempts of 2s each, with jittered waits between them
+    assert failing_backend.breaker.failure_rate() == 1.0
+    assert len(failing_backend.breaker._outcomes) == 3
+    assert 6 <= clock.monotonic() - start < 90
+
+
+def test_attempt_timeout_is_capped_by_deadline(failing_backend, clock, monkeypatch):
+    monkeypatch.setattr(failing_backend, "simulated_latency", 10)
+    start = clock.monotonic()
+    with pytest.raises(TimeoutError):
+        failing_backend.generate_image(b"person", b"clothing", deadline=start + 5)
+
+    # The attempt got the 5s left rather than GEMINI_ATTEMPT_TIMEOUT, and no retry started past the deadline
+    assert clock.monotonic() - start == pytest.approx(5)
+
+
+def test_expired_deadline_fails_without_calling_the_model(failing_backend, clock):
+    with pytest.raises(resilience.DeadlineExceeded):
+        failing_backend.generate_image(b"person", b"clothing", deadline=clock.monotonic())
+    assert len(failing_backend.breaker._outcomes) == 0
+
+
+def test_failing_backend_opens_the_circuit(failing_backend, clock):
+    for _ in range(2):
+        with pytest.raises(genai_errors.ServerError):
+            failing_backend.generate_image(b"person", b"clothing", deadline=clock.monotonic() + 90)
+    assert failing_backend.breaker.state == CircuitBreaker.OPEN
+
+    # Rejected at once: no model latency, no retries
+    start = clock.monotonic()
+    with pytest.raises(CircuitOpenError):
+        failing_backend.generate_image(b"person", b"clothing", deadline=start + 90)
+    assert clock.monotonic() == start
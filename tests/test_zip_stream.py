@@ -0,0 +1,113 @@
+import io
+import random
+import zipfile
+import zlib
+from datetime import datetime
+import pytest
+from api.db.export import GalleryExport
+from api.endpoints import parse_range
+from api.functions.zip_stream import StoredZip, ZipEntry
+
+
+class FakeExportDatabase:
+    """Serves iter_export_blobs from memory, recording which blobs were read"""
+
+    def __init__(self, blobs):
+        self.blobs = blobs
+        self.reads = []
+
+    def iter_export_blobs(self, user_id, kind, image_ids, batch_rows):
+        for image_id in image_ids:
+            self.reads.append(image_id)
+            yield image_id, self.blobs[image_id]
+
+
+def make_export(blobs, known_crcs=()):
+    entries = [
+        ZipEntry(
+            f"generations/{image_id}.bin",
+            len(data),
+            datetime(2025, 6, 1, 12, 30, 10),
+            zlib.crc32(data) if image_id in known_crcs else None,
+            source=("generation", image_id)
+        )
+        for image_id, data in blobs.items()
+    ]
+    export = GalleryExport("user")
+    export.zip = StoredZip(entries)
+    export.db = FakeExportDatabase(blobs)
+    return export
+
+
+def read_range(export, start, end):
+    return b"".join(bytes(chunk) for chunk in export.chunks(start, end))
+
+
+@pytest.fixture
+def blobs():
+    rng = random.Random(7)
+    return {f"g{i}": rng.randbytes(rng.randint(0, 5000)) for i in range(12)}
+
+
+def test_archive_unzips_with_matching_contents(blobs):
+    export = make_export(blobs)
+    archive = read_range(export, 0, export.size - 1)
+
+    assert len(archive) == export.size
+    with zipfile.ZipFile(io.BytesIO(archive)) as zip_file:
+        assert zip_file.testzip() is None
+        assert {name: zip_file.read(name) for name in zip_file.namelist()} == {
+            f"generations/{image_id}.bin": data for image_id, data in blobs.items()
+        }
+
+
+@pytest.mark.parametrize("start,end", [(0, 99), (31, 4000), (7777, 20000), (1, 1)])
+def test_resumed_range_matches_full_archive(blobs, start, end):
+    export = make_export(blobs)
+    full = read_range(export, 0, export.size - 1)
+    assert read_range(make_export(blobs), start, end) == full[start:end + 1]
+
+
+def test_resume_from_range_header_rebuilds_archive(blobs):
+    export = make_export(blobs)
+    full = read_range(export, 0, export.size - 1)
+
+    cut = export.size // 3
+    first_part = read_range(make_export(blobs), 0, cut - 1)
+    byte_range = parse_range(f"bytes={cut}-", export.size)
+    assert byte_range == (cut, export.size - 1)
+    assert first_part + read_range(make_export(blobs), *byte_range) == full
+
+
+def test_range_with_known_crcs_reads_only_overlapping_blobs(blobs):
+    export = make_export(blobs, known_crcs=set(blobs))
+    entry = export.zip.entries[5]
+
+    read_range(export, entry.data_offset, entry.data_offset + max(entry.size - 1, 0))
+    assert export.db.reads == ["g5"]
+
+    # The central directory needs no blob once every CRC is known
+    export.db.reads.clear()
+    read_range(export, export.zip.directory_offset, export.size - 1)
+    assert export.db.reads == []
+
+
+def test_parse_range_edges():
+    assert parse_range("bytes=-10", 100) == (90, 99)
+    assert parse_range("bytes=90-500", 100) == (90, 99)
+    assert parse_range("bytes=100-", 100) == "unsatisfiable"
+    assert parse_range("bytes=0-1,5-6", 100) is None
+    assert parse_range("items=0-1", 100) is None
+
+
+def test_zip64_end_records_past_65535_entries():
+    count = 0x10000 + 5
+    blobs = {f"g{i}": bytes([i % 256]) for i in range(count)}
+    export = make_export(blobs, known_crcs=set(blobs))
+    assert export.zip.zip64
+
+    archive = read_range(export, 0, export.size - 1)
+    with zipfile.ZipFile(io.BytesIO(archive)) as zip_file:
+        names = zip_file.namelist()
+        assert len(names) == count
+        assert zip_file.read(names[-1]) == blobs[f"g{count - 1}"]